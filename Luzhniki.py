@@ -1,11 +1,29 @@
 import os
+import sys
 import json
+import sqlite3
 import asyncio
 import time
+import itertools
+import bisect
+import heapq
+import zlib
+import mmap
+import struct
+from concurrent.futures import ThreadPoolExecutor
+from array import array
 from pathlib import Path
-from typing import Dict, List, Any, Optional
+from types import MappingProxyType
+from collections import Counter, deque
+from collections.abc import Mapping
+from typing import Dict, List, Any, Iterable, NamedTuple, Optional
 from datetime import datetime, timedelta, timezone
 
+if os.name == "nt":
+    import msvcrt
+else:
+    import fcntl
+
 import aiohttp
 import discord
 from discord import app_commands
@@ -19,13 +37,19 @@ load_dotenv()
 DISCORD_TOKEN = ""
 FOOTBALL_DATA_TOKEN = ""
 
-GUILD_ID = 1225075859333845154          # ID сервера
-TEXT_CHANNEL_ID = 1407445373571563610   # ID текстового канала
-VOICE_CHANNEL_ID = 1289694911234310155  # ID голосового канала
+GUILD_ID = 1225075859333845154          # ID основного сервера
+TEXT_CHANNEL_ID = 1407445373571563610   # ID текстового канала основного сервера
+VOICE_CHANNEL_ID = 1289694911234310155  # ID голосового канала основного сервера
+
+# Серверы, которые обслуживает бот, и их каналы. У каждого сервера свои
+# подписки; подписки основного сервера лежат в прежних файлах.
+GUILDS: Dict[int, Dict[str, int]] = {
+    GUILD_ID: {"text_channel_id": TEXT_CHANNEL_ID, "voice_channel_id": VOICE_CHANNEL_ID},
+}
 
 FOOTBALL_DATA_BASE = "https://api.football-data.org/v4"  # v4 API
 
-# Нужны только для /league-table и /leagues, live/upcoming теперь по командам
+# Турниры, чьи команды попадают в кэш команд; на них же можно подписаться через /live-league
 COMPETITIONS_TRACKED: Dict[str, str] = {
     "WC":  "FIFA World Cup",
     "CL":  "UEFA Champions League",
@@ -41,7 +65,85 @@ COMPETITIONS_TRACKED: Dict[str, str] = {
     "PL":  "Premier League",
 }
 
+# id турниров в football-data.org (competition.id в ответах API)
+COMPETITION_IDS: Dict[str, int] = {
+    "WC":  2000,
+    "CL":  2001,
+    "BL1": 2002,
+    "DED": 2003,
+    "BSA": 2013,
+    "PD":  2014,
+    "FL1": 2015,
+    "ELC": 2016,
+    "PPL": 2017,
+    "EC":  2018,
+    "SA":  2019,
+    "PL":  2021,
+}
+
+# Дополнительные названия команд для поиска (в нижнем регистре) -> team_id.
+# Короткие названия и трёхбуквенные коды (shortName, tla) приходят из API сами.
+TEAM_ALIASES: Dict[str, int] = {
+    "spurs": 73,
+    "gunners": 57,
+    "man utd": 66,
+    "man united": 66,
+    "man city": 65,
+    "psg": 524,
+    "barca": 81,
+    "barça": 81,
+    "atleti": 78,
+    "bayern": 5,
+    "bvb": 4,
+    "juve": 109,
+    "inter": 108,
+    "milan": 98,
+    "om": 516,
+    "sporting": 498,
+}
+
+# "json" — файл в памяти, "sqlite" — база SQLite, "sharded" — файлы-шарды по user_id.
+# С одними подписками могут работать несколько процессов бота только в "sqlite".
+SUBSCRIPTIONS_BACKEND = "json"
 SUBSCRIPTIONS_FILE = Path("subscriptions.json")
+SUBSCRIPTIONS_DB_FILE = Path("subscriptions.db")
+SUBSCRIPTIONS_SHARDS_DIR = Path("subscriptions_shards")
+SUBSCRIPTIONS_SHARD_COUNT = 256
+SUBSCRIPTIONS_JOURNAL_MAX_BYTES = 1_000_000  # после этого размера журнал сворачивается в снимок
+SUBSCRIPTIONS_CHANGE_FEED_SIZE = 10_000      # сколько последних изменений помнит лента
+RECIPIENT_CACHE_SIZE = 256                   # наборов получателей в кэше
+SUBSCRIPTIONS_BATCH_SIZE = 5_000             # пар (user, team) за одну запись при импорте/выгрузке
+SUBSCRIPTIONS_INACTIVE_DAYS = 180            # подписки молчащих дольше снимаются; 0 — не снимать
+SUBSCRIPTIONS_SWEEP_SECONDS = 6 * 3600       # как часто искать неактивных
+SUBSCRIPTIONS_TOUCH_SECONDS = 3600           # чаще этого время активности на диск не пишется
+
+# Типы событий матча — биты в настройках уведомлений подписки
+NOTIFY_START = 1
+NOTIFY_GOAL = 2
+NOTIFY_PAUSE = 4
+NOTIFY_END = 8
+NOTIFY_ALL = NOTIFY_START | NOTIFY_GOAL | NOTIFY_PAUSE | NOTIFY_END
+NOTIFY_EVENTS: Dict[str, int] = {
+    "start": NOTIFY_START,
+    "goal":  NOTIFY_GOAL,
+    "pause": NOTIFY_PAUSE,
+    "end":   NOTIFY_END,
+}
+NOTIFY_EVENT_NAMES: Dict[int, str] = {
+    NOTIFY_START: "начало",
+    NOTIFY_GOAL:  "голы",
+    NOTIFY_PAUSE: "перерыв",
+    NOTIFY_END:   "итог",
+}
+# Варианты для /live-notify
+NOTIFY_PRESETS: Dict[str, int] = {
+    "Все события":            NOTIFY_ALL,
+    "Только голы":            NOTIFY_GOAL,
+    "Только итоговый счёт":   NOTIFY_END,
+    "Только начало матча":    NOTIFY_START,
+    "Начало и итог":          NOTIFY_START | NOTIFY_END,
+    "Голы и итог":            NOTIFY_GOAL | NOTIFY_END,
+}
 
 SOUNDS = {
     "command":     "sounds/command.mp3",
@@ -52,10 +154,34 @@ SOUNDS = {
 }
 
 TEAMS_CACHE_FILE = Path("teams_cache.json")
+TEAMS_CATALOG_FILE = Path("teams_cache.bin")  # собирается из teams_cache.json, читается через mmap
+TEAMS_REFRESH_SECONDS = 24 * 3600        # как часто сверять составы турниров с API
+TEAMS_REFRESH_REQUEST_GAP_SECONDS = 7    # бесплатный тариф football-data — 10 запросов в минуту
+
+# Тихие часы: отложенные уведомления и настройки окон
+DEFERRED_FILE = Path("deferred_notifications.json")
+NOTIFICATIONS_DB_FILE = Path("notifications.db")  # тихие часы и недоставляемые при SUBSCRIPTIONS_BACKEND = "sqlite"
+QUIET_DIGEST_MAX_MATCHES = 25   # матчей в одной сводке после тихих часов
+
+# Закрытые личные сообщения: повторная попытка через 1 ч, 2 ч, 4 ч... но не реже раза в неделю
+UNDELIVERABLE_FILE = Path("undeliverable_recipients.json")
+UNDELIVERABLE_RETRY_SECONDS = 3600
+UNDELIVERABLE_RETRY_MAX_SECONDS = 7 * 24 * 3600
+UNDELIVERABLE_MENTION_FALLBACK = False  # упоминать таких пользователей в текстовом канале, раз за матч
+UNDELIVERABLE_MENTIONS_MAX = 40         # упоминаний в одном сообщении канала
 
 # Кэш live-матчей
 LIVE_CACHE_TTL_SECONDS = 60
 
+AUTOCOMPLETE_CHOICES = 25         # больше Discord не показывает
+AUTOCOMPLETE_PRECOMPUTED_LEN = 2  # ответы на запросы до этой длины строятся заранее
+AUTOCOMPLETE_LRU_SIZE = 2048      # последних запросов в памяти
+
+# Контроль задержек event loop
+LOOP_LAG_SAMPLE_SECONDS = 0.5
+LOOP_LAG_STALL_MS = 100    # всё дольше этого считаем блокировкой
+LOOP_LAG_REPORT_SECONDS = 600
+
 intents = discord.Intents.default()
 intents.guilds = True
 intents.members = True
@@ -66,7 +192,15 @@ bot = commands.Bot(command_prefix="!", intents=intents)
 tree = bot.tree
 
 last_fixtures_state: Dict[int, Dict[str, Any]] = {}
+# match_id -> кого из недоставляемых уже упомянули в канале по этому матчу
+undeliverable_mentioned: Dict[int, set[int]] = {}
 TEAMS_CACHE: Dict[str, Dict[str, Any]] = {}
+TEAMS_BY_ID: Dict[int, Dict[str, Any]] = {}
+TEAMS_INDEX: Optional["TeamIndex"] = None
+TEAMS_AUTOCOMPLETE: Optional["TeamAutocomplete"] = None
+# код турнира -> ETag/Last-Modified последнего ответа и team_id его команд
+TEAMS_CACHE_SOURCES: Dict[str, Dict[str, Any]] = {}
+TEAMS_CACHE_UPDATED: Optional[datetime] = None
 TEAMS_CACHE_BUILT = False
 
 live_cache: Dict[str, Any] = {
@@ -76,68 +210,2338 @@ live_cache: Dict[str, Any] = {
 
 # ---------------------------- УТИЛИТЫ JSON-БД ----------------------------
 
-def load_subscriptions() -> Dict[str, Any]:
-    if not SUBSCRIPTIONS_FILE.exists():
-        return {"users": {}}
-    with SUBSCRIPTIONS_FILE.open("r", encoding="utf-8") as f:
+SNAPSHOT_HEADER = '{"users": {'
+
+
+class UserSubscriptions:
+    """
+    Подписки пользователя: team_id в array('i'), время последней активности
+    и маски событий, отличные от NOTIFY_ALL. Запись не меняется на месте.
+    """
+
+    __slots__ = ("teams", "last_active", "events")
+
+    def __init__(
+        self,
+        teams: Iterable[int] = (),
+        last_active: int = 0,
+        events: Optional[Dict[int, int]] = None,
+    ):
+        self.teams = array("i", teams)
+        self.last_active = last_active
+        self.events = events or None
+
+    @classmethod
+    def from_json(cls, entry: Dict[str, Any], default_active: int = 0) -> "UserSubscriptions":
+        # в старых записях времени активности нет
+        return cls(entry_team_ids(entry), entry.get("last_active", default_active), entry_events(entry))
+
+    def to_json(self) -> Dict[str, Any]:
+        data: Dict[str, Any] = {"teams": self.teams.tolist(), "last_active": self.last_active}
+        if self.events:
+            data["events"] = {str(tid): mask for tid, mask in self.events.items()}
+        return data
+
+    def events_for(self, team_id: int) -> int:
+        return self.events.get(team_id, NOTIFY_ALL) if self.events else NOTIFY_ALL
+
+    def with_team(self, team_id: int, at: int) -> "UserSubscriptions":
+        return UserSubscriptions(self.teams.tolist() + [team_id], at, self.events)
+
+    def without_team(self, team_id: int, at: int) -> "UserSubscriptions":
+        events = self.events
+        if events and team_id in events:
+            events = {tid: mask for tid, mask in events.items() if tid != team_id}
+        return UserSubscriptions((tid for tid in self.teams if tid != team_id), at, events)
+
+    def with_events(self, team_id: int, mask: int, at: int) -> "UserSubscriptions":
+        events = {tid: m for tid, m in (self.events or {}).items() if tid != team_id}
+        if mask != NOTIFY_ALL:
+            events[team_id] = mask
+        return UserSubscriptions(self.teams, at, events)
+
+
+class SubscriptionRecord(NamedTuple):
+    """
+    Подписка целиком — для выгрузки и загрузки между хранилищами.
+    """
+    user_id: int
+    team_id: int
+    events: int = NOTIFY_ALL
+    # None — время активности неизвестно, при загрузке ставится текущее
+    last_active: Optional[int] = None
+
+
+class SubscriptionChange(NamedTuple):
+    version: int
+    user_id: int
+    team_id: int
+    # True — подписка добавлена, False — снята, None — изменились только
+    # настройки уведомлений
+    added: Optional[bool]
+
+
+# номера единичных битов для каждого значения байта
+_BYTE_BITS = [tuple(bit for bit in range(8) if value >> bit & 1) for value in range(256)]
+
+
+def bitmap_positions(mask: int) -> List[int]:
+    """
+    Номера единичных битов маски по возрастанию; маска разбирается побайтно.
+    """
+    data = mask.to_bytes((mask.bit_length() + 7) // 8, "little")
+    return [
+        byte_pos * 8 + bit
+        for byte_pos, byte in enumerate(data) if byte
+        for bit in _BYTE_BITS[byte]
+    ]
+
+
+def bitmap_from_positions(positions: Iterable[int]) -> int:
+    """
+    Собирает маску сразу из всех позиций: поштучный |= на большом int
+    каждый раз копирует всё число.
+    """
+    positions = list(positions)
+    if not positions:
+        return 0
+    data = bytearray(max(positions) // 8 + 1)
+    for pos in positions:
+        data[pos >> 3] |= 1 << (pos & 7)
+    return int.from_bytes(data, "little")
+
+
+def entry_team_ids(entry: Dict[str, Any]) -> List[int]:
+    """
+    Старые записи хранили словари с названием команды и лиги,
+    новые — только team_id.
+    """
+    return [t["team_id"] if isinstance(t, dict) else t for t in entry.get("teams", [])]
+
+
+def entry_events(entry: Dict[str, Any]) -> Dict[int, int]:
+    """
+    Настройки уведомлений записи: team_id -> маска событий, только
+    отличающиеся от NOTIFY_ALL.
+    """
+    return {int(tid): mask for tid, mask in entry.get("events", {}).items()}
+
+
+def read_json_file(path: Path) -> Any:
+    with path.open("r", encoding="utf-8") as f:
         return json.load(f)
 
 
-def save_subscriptions(data: Dict[str, Any]) -> None:
-    SUBSCRIPTIONS_FILE.parent.mkdir(parents=True, exist_ok=True)
-    with SUBSCRIPTIONS_FILE.open("w", encoding="utf-8") as f:
-        json.dump(data, f, ensure_ascii=False, indent=2)
+def load_subscriptions(path: Path = SUBSCRIPTIONS_FILE) -> Dict[str, Any]:
+    """
+    Читает снимок подписок: построчный формат — по строке, старый с indent=2 — целиком.
+    """
+    if not path.exists():
+        return {"users": {}}
+
+    with path.open("r", encoding="utf-8") as f:
+        if f.readline().rstrip("\n") != SNAPSHOT_HEADER:
+            f.seek(0)
+            return json.load(f)
+
+        users: Dict[str, Any] = {}
+        for line in f:
+            line = line.rstrip("\n").rstrip(",")
+            if line == "}}":
+                break
+            users.update(json.loads("{" + line + "}"))
+    return {"users": users}
+
+
+def save_subscriptions(data: Dict[str, Any], path: Path = SUBSCRIPTIONS_FILE) -> None:
+    path.parent.mkdir(parents=True, exist_ok=True)
+    # пишем во временный файл и подменяем: падение посреди записи не портит снимок
+    tmp_path = path.with_name(path.name + ".tmp")
+    users = data.get("users", {})
+    with tmp_path.open("w", encoding="utf-8") as f:
+        f.write(SNAPSHOT_HEADER + "\n")
+        last = len(users) - 1
+        for i, (user_key, entry) in enumerate(users.items()):
+            if isinstance(entry, UserSubscriptions):
+                entry = entry.to_json()
+            f.write(json.dumps(str(user_key)) + ": " + json.dumps(entry, ensure_ascii=False))
+            f.write("\n" if i == last else ",\n")
+        f.write("}}\n")
+    os.replace(tmp_path, path)
+
+
+def lock_process_file(path: Path):
+    """
+    Эксклюзивная блокировка файла средствами ОС, пока процесс держит его открытым:
+    второй процесс с тем же хранилищем сразу получает ошибку.
+    """
+    path.parent.mkdir(parents=True, exist_ok=True)
+    f = path.open("a+b")
+    try:
+        if os.name == "nt":
+            msvcrt.locking(f.fileno(), msvcrt.LK_NBLCK, 1)
+        else:
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except OSError:
+        f.close()
+        raise RuntimeError(
+            f"{path} занят другим процессом бота. Для нескольких процессов "
+            f'на одних подписках нужен SUBSCRIPTIONS_BACKEND = "sqlite"'
+        )
+    return f
 
 
-def add_team_subscription(user_id: int, team_id: int, team_name: str, league_name: str) -> None:
-    db = load_subscriptions()
-    users = db.setdefault("users", {})
-    user_entry = users.setdefault(str(user_id), {"teams": []})
+class SubscriptionStore:
+    """
+    Общий интерфейс хранилища подписок; все методы — корутины, диск — в рабочих потоках.
+    """
 
-    for t in user_entry["teams"]:
-        if t["team_id"] == team_id:
+    def __init__(self, path: Path):
+        self.path = path
+        self.loaded = False
+        self._open_lock = asyncio.Lock()
+        self._user_locks: Dict[int, asyncio.Lock] = {}
+        # версия растёт на каждую добавленную или снятую пару (user, team)
+        self.version = 0
+        self._changes: deque[SubscriptionChange] = deque(maxlen=SUBSCRIPTIONS_CHANGE_FEED_SIZE)
+        self.recipient_cache = RecipientCache(self)
+
+    def load(self) -> None:
+        """
+        Синхронная загрузка — для старта и служебных скриптов без event loop.
+        """
+        raise NotImplementedError
+
+    async def open(self) -> None:
+        async with self._open_lock:
+            if not self.loaded:
+                await asyncio.to_thread(self.load)
+
+    def close(self) -> None:
+        pass
+
+    async def wait_idle(self) -> None:
+        """
+        Дожидается фоновой работы хранилища — перед close() из event loop.
+        """
+
+    def _lock(self, user_id: int) -> asyncio.Lock:
+        lock = self._user_locks.get(user_id)
+        if lock is None:
+            lock = self._user_locks[user_id] = asyncio.Lock()
+        return lock
+
+    # ---- лента изменений ----
+
+    def _publish(self, user_id: int, team_id: int, added: Optional[bool]) -> None:
+        self.version += 1
+        self._changes.append(SubscriptionChange(self.version, user_id, team_id, added))
+
+    def changes_since(self, version: int) -> Optional[List[SubscriptionChange]]:
+        """
+        Изменения после version. None — лента уже не покрывает этот
+        промежуток, и производную структуру надо пересобрать целиком.
+        """
+        if version == self.version:
+            return []
+        if version > self.version or not self._changes or self._changes[0].version > version + 1:
+            return None
+        # версии в ленте идут подряд, нужный хвост считается по разнице
+        return list(itertools.islice(self._changes, len(self._changes) - (self.version - version), None))
+
+    async def sync(self) -> None:
+        """
+        Подтягивает в ленту изменения, сделанные другими процессами.
+        Хранилищам, которыми владеет один процесс, подтягивать нечего.
+        """
+
+    # ---- чтение ----
+
+    async def get_user(self, user_id: int) -> List[int]:
+        raise NotImplementedError
+
+    async def all_team_ids(self) -> set[int]:
+        raise NotImplementedError
+
+    async def team_counts(self) -> Dict[int, int]:
+        raise NotImplementedError
+
+    async def subscribers_for_teams(self, team_ids: set[int], event: int = NOTIFY_ALL) -> set[int]:
+        """
+        Подписчики любой из команд, у кого в этой подписке включено событие
+        event (NOTIFY_ALL — без отбора по событию).
+        """
+        raise NotImplementedError
+
+    async def get_events(self, user_id: int) -> Dict[int, int]:
+        """
+        Настройки уведомлений пользователя: team_id -> маска событий,
+        только для подписок, где они отличаются от NOTIFY_ALL.
+        """
+        raise NotImplementedError
+
+    async def iter_subscriptions(self, batch_size: int = SUBSCRIPTIONS_BATCH_SIZE):
+        """
+        Все подписки (SubscriptionRecord) пачками не больше batch_size —
+        для выгрузки без чтения всей базы в один словарь.
+        """
+        raise NotImplementedError
+        yield
+
+    async def recipients_for_teams(
+        self,
+        team_ids: set[int],
+        exclude: set[int] = frozenset(),
+        event: int = NOTIFY_ALL,
+    ) -> set[int]:
+        """
+        Подписчики любой из команд с включённым событием event, кроме пользователей из exclude.
+        """
+        return await self.recipient_cache.get(team_ids, event) - exclude
+
+    async def add(self, user_id: int, team_id: int) -> bool:
+        raise NotImplementedError
+
+    async def add_many(self, pairs: Iterable[tuple[int, int]]) -> int:
+        """
+        Добавляет пачку пар (user_id, team_id) одной записью на диск.
+        Уже существующие подписки пропускаются; возвращает число добавленных.
+        """
+        return await self.import_records(SubscriptionRecord(user_id, team_id) for user_id, team_id in pairs)
+
+    async def import_records(self, records: Iterable[SubscriptionRecord]) -> int:
+        """
+        Как add_many, но с настройками уведомлений и временем активности из
+        выгрузки. Настройки уже существующих подписок не меняются.
+        """
+        raise NotImplementedError
+
+    async def remove(self, user_id: int, team_id: int) -> bool:
+        raise NotImplementedError
+
+    async def clear(self, user_id: int) -> None:
+        raise NotImplementedError
+
+    async def set_events(self, user_id: int, team_id: int, events: int) -> bool:
+        """
+        Задаёт маску событий подписки. False — подписки на команду нет.
+        """
+        raise NotImplementedError
+
+    # ---- активность ----
+
+    async def touch(self, user_id: int) -> None:
+        await self.touch_many((user_id,))
+
+    async def touch_many(self, user_ids: Iterable[int]) -> None:
+        """
+        Отмечает, что пользователи пользуются ботом. Пишет на диск не чаще
+        раза в SUBSCRIPTIONS_TOUCH_SECONDS; без подписок ничего не делает.
+        """
+        raise NotImplementedError
+
+    async def inactive_users(self, cutoff: float) -> List[int]:
+        """
+        Пользователи с подписками, не проявлявшие активности с момента cutoff.
+        """
+        raise NotImplementedError
+
+    async def expire(self, cutoff: float) -> List[int]:
+        expired = await self.inactive_users(cutoff)
+        for user_id in expired:
+            await self.clear(user_id)
+        return expired
+
+
+class JsonSubscriptionStore(SubscriptionStore):
+    """
+    Подписки в памяти: снимок subscriptions.json и журнал изменений, подписчики
+    команды — битовая маска по номерам пользователей.
+    """
+
+    def __init__(self, path: Path, journal_max_bytes: int = SUBSCRIPTIONS_JOURNAL_MAX_BYTES):
+        super().__init__(path)
+        self.journal_path = path.with_suffix(".journal")
+        # журнал, который сейчас сворачивается в снимок
+        self.compacting_path = path.with_suffix(".journal.compacting")
+        self.journal_max_bytes = journal_max_bytes
+        self.users: Dict[int, UserSubscriptions] = {}
+        # плотные номера пользователей для битовых масок
+        self.user_slots: Dict[int, int] = {}
+        self.slot_users: List[int] = []
+        # обратный индекс team_id -> маска подписчиков, обновляется при каждом изменении
+        self.team_subscribers: Dict[int, int] = {}
+        # (team_id, событие) -> маска подписчиков команды, отключивших это событие
+        self.event_optouts: Dict[tuple[int, int], int] = {}
+        self._journal: Optional[Any] = None
+        self._journal_size = 0
+        self._compact_task: Optional[asyncio.Task] = None
+        self._io = ThreadPoolExecutor(max_workers=1, thread_name_prefix="subscriptions-journal")
+        self._process_lock: Optional[Any] = None
+        # записям без времени активности отсчёт идёт от загрузки
+        self._loaded_at = 0
+
+    def load(self) -> None:
+        self._process_lock = lock_process_file(self.path.with_suffix(".lock"))
+        self._loaded_at = int(time.time())
+        data = load_subscriptions(self.path)
+        self.users = {
+            int(user_key): UserSubscriptions.from_json(entry, self._loaded_at)
+            for user_key, entry in data.get("users", {}).items()
+        }
+        replayed = self._replay(self.compacting_path) + self._replay(self.journal_path)
+        if self.compacting_path.exists():
+            # прошлая свёртка не завершилась — дописываем её до нового снимка
+            save_subscriptions({"users": self.users}, self.path)
+            self.compacting_path.unlink()
+        self._build_index()
+        self._open_journal()
+        self.loaded = True
+        print(f"[subscriptions] Загружено пользователей: {len(self.users)}, из журнала: {replayed}")
+
+    def close(self) -> None:
+        # дожидаемся хвоста записей журнала, дальше event loop уже не нужен
+        self._io.shutdown(wait=True)
+        if self.loaded and self._journal_size:
+            snapshot = self.snapshot()
+            self._rotate_journal()
+            self._write_snapshot(snapshot)
+            self._journal_size = 0
+        if self._journal is not None:
+            self._journal.close()
+            self._journal = None
+        if self._process_lock is not None:
+            self._process_lock.close()
+            self._process_lock = None
+
+    async def wait_idle(self) -> None:
+        if self._compact_task is not None:
+            await self._compact_task
+
+    def _build_index(self) -> None:
+        self.user_slots = {}
+        self.slot_users = []
+        positions: Dict[int, List[int]] = {}
+        optouts: Dict[tuple[int, int], List[int]] = {}
+        for user_id, record in self.users.items():
+            if not record.teams:
+                continue
+            slot = self._slot(user_id)
+            for tid in record.teams:
+                positions.setdefault(tid, []).append(slot)
+            for tid, mask in (record.events or {}).items():
+                for event in NOTIFY_EVENTS.values():
+                    if not mask & event:
+                        optouts.setdefault((tid, event), []).append(slot)
+        self.team_subscribers = {
+            tid: bitmap_from_positions(slots) for tid, slots in positions.items()
+        }
+        self.event_optouts = {
+            key: bitmap_from_positions(slots) for key, slots in optouts.items()
+        }
+
+    def _slot(self, user_id: int) -> int:
+        slot = self.user_slots.get(user_id)
+        if slot is None:
+            slot = self.user_slots[user_id] = len(self.slot_users)
+            self.slot_users.append(user_id)
+        return slot
+
+    def _index_add(self, user_id: int, team_id: int) -> None:
+        bit = 1 << self._slot(user_id)
+        self.team_subscribers[team_id] = self.team_subscribers.get(team_id, 0) | bit
+
+    def _index_remove(self, user_id: int, team_id: int) -> None:
+        mask = self.team_subscribers.get(team_id)
+        slot = self.user_slots.get(user_id)
+        if mask is None or slot is None:
             return
+        mask &= ~(1 << slot)
+        if mask:
+            self.team_subscribers[team_id] = mask
+        else:
+            del self.team_subscribers[team_id]
+        self._index_events(user_id, team_id, NOTIFY_ALL)
+
+    def _index_events(self, user_id: int, team_id: int, events: int) -> None:
+        bit = 1 << self._slot(user_id)
+        for event in NOTIFY_EVENTS.values():
+            key = (team_id, event)
+            mask = self.event_optouts.get(key, 0)
+            mask = mask & ~bit if events & event else mask | bit
+            if mask:
+                self.event_optouts[key] = mask
+            else:
+                self.event_optouts.pop(key, None)
+
+    def subscriber_mask_for_event(self, team_ids: Iterable[int], event: int) -> int:
+        if event == NOTIFY_ALL:
+            return self.subscriber_mask(team_ids)
+        mask = 0
+        for tid in team_ids:
+            mask |= self.team_subscribers.get(tid, 0) & ~self.event_optouts.get((tid, event), 0)
+        return mask
+
+    def subscriber_mask(self, team_ids: Iterable[int]) -> int:
+        mask = 0
+        for tid in team_ids:
+            mask |= self.team_subscribers.get(tid, 0)
+        return mask
+
+    def mask_of(self, user_ids: Iterable[int]) -> int:
+        return bitmap_from_positions(
+            self.user_slots[uid] for uid in user_ids if uid in self.user_slots
+        )
 
-    user_entry["teams"].append(
-        {"team_id": team_id, "team_name": team_name, "league": league_name}
-    )
-    save_subscriptions(db)
+    def users_in_mask(self, mask: int) -> List[int]:
+        slot_users = self.slot_users
+        return [slot_users[slot] for slot in bitmap_positions(mask)]
+
+    def snapshot(self) -> Dict[str, Any]:
+        """
+        Неизменяемый срез подписок: записи подменяются целиком, хватает поверхностной копии.
+        """
+        return {"users": MappingProxyType(dict(self.users))}
+
+    # ---- журнал ----
+
+    def _replay(self, path: Path) -> int:
+        if not path.exists():
+            return 0
+        count = 0
+        with path.open("r", encoding="utf-8") as f:
+            for line in f:
+                try:
+                    op = json.loads(line)
+                except json.JSONDecodeError:
+                    # оборванная последняя строка после падения — просто пропускаем
+                    print(f"[subscriptions] Пропущена битая строка журнала {path}")
+                    continue
+                self._apply(op)
+                count += 1
+        return count
+
+    def _apply(self, op: Dict[str, Any]) -> None:
+        """
+        Применяет операцию журнала к данным в памяти. Повторное применение
+        того же хвоста журнала даёт тот же результат.
+        """
+        user_id = int(op["user"])
+        kind = op["op"]
+        # записи подменяются целиком, а не правятся на месте: на старые
+        # могут ссылаться срезы для снимка
+        record = self.users.get(user_id) or UserSubscriptions()
+        # в старых журналах времени операции нет
+        at = op.get("at") or record.last_active or self._loaded_at
+        if kind == "add":
+            # в старых журналах вместо team_id лежал словарь команды
+            team_id = op["team"]["team_id"] if "team" in op else op["team_id"]
+            if team_id not in record.teams:
+                self.users[user_id] = record.with_team(team_id, at)
+        elif kind == "remove":
+            if user_id in self.users:
+                self.users[user_id] = record.without_team(op["team_id"], at)
+        elif kind == "clear":
+            self.users[user_id] = UserSubscriptions()
+        elif kind == "touch":
+            if user_id in self.users:
+                self.users[user_id] = UserSubscriptions(record.teams, at, record.events)
+        elif kind == "events":
+            if op["team_id"] in record.teams:
+                self.users[user_id] = record.with_events(op["team_id"], op["events"], at)
+
+    def _open_journal(self) -> None:
+        self._journal = self.journal_path.open("a", encoding="utf-8")
+        self._journal_size = self.journal_path.stat().st_size
+        if self._journal_size:
+            with self.journal_path.open("rb") as f:
+                f.seek(-1, os.SEEK_END)
+                if f.read(1) != b"\n":
+                    # новая запись не должна склеиться с оборванной строкой
+                    self._journal.write("\n")
+                    self._journal.flush()
+                    self._journal_size += 1
+
+    def _write_journal_line(self, line: str) -> None:
+        self._journal.write(line)
+        self._journal.flush()
+
+    def _rotate_journal(self) -> None:
+        self._journal.close()
+        os.replace(self.journal_path, self.compacting_path)
+        self._journal = self.journal_path.open("a", encoding="utf-8")
+
+    def _write_snapshot(self, snapshot: Dict[str, Any]) -> None:
+        save_subscriptions(snapshot, self.path)
+        self.compacting_path.unlink()
+
+    async def _record(self, op: Dict[str, Any]) -> None:
+        self._apply(op)
+        await self._write_ops([op])
+
+    async def _write_ops(self, ops: List[Dict[str, Any]]) -> None:
+        """
+        Дописывает уже применённые операции в журнал одной записью.
+        """
+        lines = "".join(json.dumps(op, ensure_ascii=False) + "\n" for op in ops)
+        self._journal_size += len(lines.encode("utf-8"))
+        await asyncio.get_running_loop().run_in_executor(self._io, self._write_journal_line, lines)
+        if self._journal_size > self.journal_max_bytes:
+            if self._compact_task is None or self._compact_task.done():
+                self._compact_task = asyncio.create_task(self.compact())
+
+    async def compact(self) -> None:
+        """
+        Сворачивает журнал в снимок: текущий журнал откладывается в сторону,
+        новые изменения пишутся в свежий, снимок сохраняется атомарно.
+        """
+        loop = asyncio.get_running_loop()
+        # срез и ротация ставятся в очередь без await между ними: всё, что
+        # попало в срез, записано в старый журнал, всё после — в новый
+        snapshot = self.snapshot()
+        self._journal_size = 0
+        await loop.run_in_executor(self._io, self._rotate_journal)
+        await asyncio.to_thread(self._write_snapshot, snapshot)
+        print(f"[subscriptions] Журнал свёрнут в снимок {self.path}")
+
+    # ---- чтение ----
+
+    async def get_user(self, user_id: int) -> List[int]:
+        await self.open()
+        record = self.users.get(user_id)
+        return record.teams.tolist() if record else []
+
+    async def all_team_ids(self) -> set[int]:
+        await self.open()
+        return set(self.team_subscribers)
+
+    async def team_counts(self) -> Dict[int, int]:
+        await self.open()
+        return {tid: mask.bit_count() for tid, mask in self.team_subscribers.items()}
+
+    async def subscribers_for_teams(self, team_ids: set[int], event: int = NOTIFY_ALL) -> set[int]:
+        await self.open()
+        return set(self.users_in_mask(self.subscriber_mask_for_event(team_ids, event)))
+
+    async def get_events(self, user_id: int) -> Dict[int, int]:
+        await self.open()
+        record = self.users.get(user_id)
+        return dict(record.events) if record and record.events else {}
+
+    async def iter_subscriptions(self, batch_size: int = SUBSCRIPTIONS_BATCH_SIZE):
+        await self.open()
+        batch: List[SubscriptionRecord] = []
+        # записи не меняются на месте, срез словаря не поедет под ногами
+        for user_id, record in list(self.users.items()):
+            for tid in record.teams:
+                batch.append(SubscriptionRecord(user_id, tid, record.events_for(tid), record.last_active))
+            if len(batch) >= batch_size:
+                yield batch
+                batch = []
+        if batch:
+            yield batch
+
+    async def recipients_for_teams(
+        self,
+        team_ids: set[int],
+        exclude: set[int] = frozenset(),
+        event: int = NOTIFY_ALL,
+    ) -> set[int]:
+        await self.open()
+        mask = self.subscriber_mask_for_event(team_ids, event)
+        if exclude:
+            mask &= ~self.mask_of(exclude)
+        return set(self.users_in_mask(mask))
+
+    # ---- изменения ----
+
+    async def add(self, user_id: int, team_id: int) -> bool:
+        await self.open()
+        async with self._lock(user_id):
+            record = self.users.get(user_id)
+            if record and team_id in record.teams:
+                return False
+            self._index_add(user_id, team_id)
+            self._publish(user_id, team_id, True)
+            await self._record({"op": "add", "user": str(user_id), "team_id": team_id, "at": int(time.time())})
+            return True
+
+    async def import_records(self, records: Iterable[SubscriptionRecord]) -> int:
+        await self.open()
+        ops: List[Dict[str, Any]] = []
+        positions: Dict[int, List[int]] = {}
+        added = 0
+        now = int(time.time())
+        for user_id, team_id, events, last_active in records:
+            record = self.users.get(user_id)
+            if record and team_id in record.teams:
+                continue
+            at = now if last_active is None else last_active
+            if record and record.teams:
+                at = max(at, record.last_active)
+            op = {"op": "add", "user": str(user_id), "team_id": team_id, "at": at}
+            # применяем сразу, чтобы повтор пары внутри пачки отсеялся
+            self._apply(op)
+            ops.append(op)
+            positions.setdefault(team_id, []).append(self._slot(user_id))
+            self._publish(user_id, team_id, True)
+            if events != NOTIFY_ALL:
+                self._index_events(user_id, team_id, events)
+                # для кэшей получателей это смена настроек, а не подписка на все события
+                self._publish(user_id, team_id, None)
+                op = {"op": "events", "user": str(user_id), "team_id": team_id, "events": events, "at": at}
+                self._apply(op)
+                ops.append(op)
+            added += 1
+        if not ops:
+            return 0
+        for tid, slots in positions.items():
+            self.team_subscribers[tid] = self.team_subscribers.get(tid, 0) | bitmap_from_positions(slots)
+        await self._write_ops(ops)
+        return added
+
+    async def remove(self, user_id: int, team_id: int) -> bool:
+        await self.open()
+        async with self._lock(user_id):
+            record = self.users.get(user_id)
+            if not record or team_id not in record.teams:
+                return False
+            self._index_remove(user_id, team_id)
+            self._publish(user_id, team_id, False)
+            await self._record({"op": "remove", "user": str(user_id), "team_id": team_id, "at": int(time.time())})
+            return True
+
+    async def clear(self, user_id: int) -> None:
+        await self.open()
+        async with self._lock(user_id):
+            record = self.users.get(user_id)
+            for tid in record.teams if record else []:
+                self._index_remove(user_id, tid)
+                self._publish(user_id, tid, False)
+            await self._record({"op": "clear", "user": str(user_id)})
+
+    async def set_events(self, user_id: int, team_id: int, events: int) -> bool:
+        await self.open()
+        async with self._lock(user_id):
+            record = self.users.get(user_id)
+            if not record or team_id not in record.teams:
+                return False
+            if record.events_for(team_id) != events:
+                self._index_events(user_id, team_id, events)
+                self._publish(user_id, team_id, None)
+                await self._record({
+                    "op": "events", "user": str(user_id), "team_id": team_id,
+                    "events": events, "at": int(time.time()),
+                })
+            return True
+
+    # ---- активность ----
+
+    async def touch_many(self, user_ids: Iterable[int]) -> None:
+        await self.open()
+        now = int(time.time())
+        ops: List[Dict[str, Any]] = []
+        for user_id in user_ids:
+            record = self.users.get(user_id)
+            if not record or not record.teams or now - record.last_active < SUBSCRIPTIONS_TOUCH_SECONDS:
+                continue
+            op = {"op": "touch", "user": str(user_id), "at": now}
+            self._apply(op)
+            ops.append(op)
+        if ops:
+            await self._write_ops(ops)
+
+    async def inactive_users(self, cutoff: float) -> List[int]:
+        await self.open()
+        return [
+            user_id for user_id, record in self.users.items()
+            if record.teams and record.last_active < cutoff
+        ]
+
+
+def read_json_store(path: Path) -> Optional[Dict[int, UserSubscriptions]]:
+    """
+    Подписки JSON-хранилища вместе с журналом для переноса в другой бэкенд:
+    в одном снимке нет изменений с последней свёртки. None — переносить нечего.
+    """
+    if not any(p.exists() for p in (path, path.with_suffix(".journal"), path.with_suffix(".journal.compacting"))):
+        return None
+    # load() берёт блокировку: работающий процесс на JSON не даст перенести недописанное
+    store = JsonSubscriptionStore(path)
+    store.load()
+    try:
+        return {user_id: record for user_id, record in store.users.items() if record.teams}
+    finally:
+        # close() сворачивает журнал в снимок
+        store.close()
 
 
-def remove_team_subscription(user_id: int, team_id: int) -> bool:
-    db = load_subscriptions()
-    users = db.setdefault("users", {})
-    entry = users.get(str(user_id))
-    if not entry:
-        return False
+class SqliteSubscriptionStore(SubscriptionStore):
+    """
+    Подписки в SQLite, по строке на пару (user_id, team_id); с одной базой
+    могут работать несколько процессов бота.
+    """
+
+    SCHEMA = f"""
+        CREATE TABLE IF NOT EXISTS subscriptions (
+            user_id INTEGER NOT NULL,
+            team_id INTEGER NOT NULL,
+            events  INTEGER NOT NULL DEFAULT {NOTIFY_ALL},
+            PRIMARY KEY (user_id, team_id)
+        );
+        CREATE INDEX IF NOT EXISTS idx_subscriptions_team ON subscriptions (team_id, user_id);
+        CREATE TABLE IF NOT EXISTS meta (
+            key   TEXT PRIMARY KEY,
+            value TEXT NOT NULL
+        );
+        CREATE TABLE IF NOT EXISTS changes (
+            seq     INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER NOT NULL,
+            team_id INTEGER NOT NULL,
+            added   INTEGER NOT NULL
+        );
+        CREATE TABLE IF NOT EXISTS user_activity (
+            user_id     INTEGER PRIMARY KEY,
+            last_active INTEGER NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS idx_user_activity_last ON user_activity (last_active);
+    """
+
+    # значение changes.added для смены настроек уведомлений (1 — добавлена, 0 — снята)
+    CHANGE_EVENTS = 2
+
+    def __init__(self, path: Path, migrate_from: Optional[Path] = None):
+        super().__init__(path)
+        self.migrate_from = migrate_from
+        self.conn: Optional[sqlite3.Connection] = None
+        self._db = ThreadPoolExecutor(max_workers=1, thread_name_prefix="subscriptions-sqlite")
+        # последняя строка changes, уже попавшая в ленту этого процесса
+        self._seen_seq = 0
+        self._data_version: Optional[int] = None
+
+    def load(self) -> None:
+        self._db.submit(self._connect).result()
+
+    async def open(self) -> None:
+        async with self._open_lock:
+            if not self.loaded:
+                await self._run(self._connect)
+
+    def close(self) -> None:
+        if self.conn is not None:
+            self._db.submit(self.conn.close).result()
+            self.conn = None
+            self.loaded = False
+        self._db.shutdown(wait=True)
+
+    async def _run(self, fn, *args):
+        return await asyncio.get_running_loop().run_in_executor(self._db, fn, *args)
+
+    async def _query(self, sql: str, params: tuple = ()) -> List[tuple]:
+        await self.open()
+        return await self._run(lambda: self.conn.execute(sql, params).fetchall())
+
+    async def _write(self, fn):
+        """
+        Выполняет fn в транзакции в потоке базы и сразу дочитывает changes:
+        свои и чужие изменения попадают в ленту в порядке их записи в базу.
+        """
+        def write():
+            with self.conn:
+                # IMMEDIATE: блокировку на запись берём сразу, а не при первом INSERT
+                self.conn.execute("BEGIN IMMEDIATE")
+                result = fn()
+            return result, self._pull_changes()
+
+        await self.open()
+        result, rows = await self._run(write)
+        self._apply_changes(rows)
+        return result
+
+    def _log_changes(self, rows: List[tuple[int, int, int]]) -> None:
+        if not rows:
+            return
+        self.conn.executemany("INSERT INTO changes (user_id, team_id, added) VALUES (?, ?, ?)", rows)
+        # таблица помнит столько же изменений, сколько лента в памяти
+        self.conn.execute(
+            "DELETE FROM changes WHERE seq <= (SELECT MAX(seq) FROM changes) - ?",
+            (SUBSCRIPTIONS_CHANGE_FEED_SIZE,),
+        )
+
+    def _mark_active(self, user_ids: Iterable[int]) -> None:
+        now = int(time.time())
+        self.conn.executemany(
+            "INSERT OR REPLACE INTO user_activity (user_id, last_active) VALUES (?, ?)",
+            [(user_id, now) for user_id in user_ids],
+        )
+
+    def _pull_changes(self) -> Optional[List[tuple]]:
+        """
+        Строки changes после последней прочитанной. None — процесс отстал
+        дальше, чем помнит таблица.
+        """
+        self._data_version = self.conn.execute("PRAGMA data_version").fetchone()[0]
+        rows = self.conn.execute(
+            "SELECT seq, user_id, team_id, added FROM changes WHERE seq > ? ORDER BY seq",
+            (self._seen_seq,),
+        ).fetchall()
+        if not rows:
+            return []
+        missed = rows[0][0] != self._seen_seq + 1
+        self._seen_seq = rows[-1][0]
+        return None if missed else rows
+
+    def _apply_changes(self, rows: Optional[List[tuple]]) -> None:
+        if rows is None:
+            # хвост потерян — сбрасываем ленту, производные структуры пересоберутся
+            self.version += 1
+            self._changes.clear()
+            return
+        for _, user_id, team_id, added in rows:
+            self._publish(user_id, team_id, None if added == self.CHANGE_EVENTS else bool(added))
+
+    async def sync(self) -> None:
+        def pull() -> Optional[List[tuple]]:
+            # data_version меняется только от чужих коммитов; свои дочитывает _write
+            if self.conn.execute("PRAGMA data_version").fetchone()[0] == self._data_version:
+                return []
+            return self._pull_changes()
+
+        await self.open()
+        self._apply_changes(await self._run(pull))
+
+    def _connect(self) -> None:
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        # isolation_level=None: автокоммит, транзакции открываем явно
+        self.conn = sqlite3.connect(self.path, isolation_level=None)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        # другой процесс может держать запись — ждём его, а не падаем с "database is locked"
+        self.conn.execute("PRAGMA busy_timeout = 5000")
+        self.conn.executescript(self.SCHEMA)
+        self._drop_team_name_columns()
+        self._add_events_column()
+        self.loaded = True
+        self._migrate_from_json()
+        self._backfill_activity()
+        self._seen_seq = self.conn.execute("SELECT COALESCE(MAX(seq), 0) FROM changes").fetchone()[0]
+        self._data_version = self.conn.execute("PRAGMA data_version").fetchone()[0]
+        count = self.conn.execute("SELECT COUNT(*) FROM subscriptions").fetchone()[0]
+        print(f"[subscriptions] SQLite {self.path}: подписок {count}")
+
+    def _drop_team_name_columns(self) -> None:
+        """
+        Первая версия таблицы хранила team_name и league в каждой строке;
+        теперь названия берутся из TEAMS_CACHE, строки — только пары id.
+        """
+        columns = {row[1] for row in self.conn.execute("PRAGMA table_info(subscriptions)")}
+        if "team_name" not in columns:
+            return
+        with self.conn:
+            self.conn.execute("BEGIN")
+            self.conn.execute(
+                "CREATE TABLE subscriptions_compact ("
+                "user_id INTEGER NOT NULL, team_id INTEGER NOT NULL, "
+                "PRIMARY KEY (user_id, team_id))"
+            )
+            self.conn.execute(
+                "INSERT INTO subscriptions_compact (user_id, team_id) "
+                "SELECT user_id, team_id FROM subscriptions ORDER BY rowid"
+            )
+            self.conn.execute("DROP TABLE subscriptions")
+            self.conn.execute("ALTER TABLE subscriptions_compact RENAME TO subscriptions")
+        self.conn.executescript(self.SCHEMA)
+        self.conn.execute("VACUUM")
+        print(f"[subscriptions] {self.path}: названия команд убраны из таблицы подписок")
+
+    def _add_events_column(self) -> None:
+        columns = {row[1] for row in self.conn.execute("PRAGMA table_info(subscriptions)")}
+        if "events" not in columns:
+            self.conn.execute(
+                f"ALTER TABLE subscriptions ADD COLUMN events INTEGER NOT NULL DEFAULT {NOTIFY_ALL}"
+            )
+
+    def _migrate_from_json(self) -> None:
+        if self.migrate_from is None:
+            return
+        done = self.conn.execute("SELECT value FROM meta WHERE key = 'json_migrated'").fetchone()
+        if done:
+            return
+        users = read_json_store(self.migrate_from)
+        if users is None:
+            return
+
+        rows = [(user_id, tid) for user_id, record in users.items() for tid in record.teams]
+        activity = [(user_id, record.last_active) for user_id, record in users.items()]
+        events = [
+            (mask, user_id, tid)
+            for user_id, record in users.items()
+            for tid, mask in (record.events or {}).items()
+        ]
+        with self.conn:
+            self.conn.execute("BEGIN")
+            self.conn.executemany(
+                "INSERT OR IGNORE INTO subscriptions (user_id, team_id) VALUES (?, ?)",
+                rows,
+            )
+            self.conn.executemany(
+                "INSERT OR REPLACE INTO user_activity (user_id, last_active) VALUES (?, ?)",
+                activity,
+            )
+            self.conn.executemany(
+                "UPDATE subscriptions SET events = ? WHERE user_id = ? AND team_id = ?",
+                events,
+            )
+            self.conn.execute(
+                "INSERT INTO meta (key, value) VALUES ('json_migrated', ?)",
+                (datetime.now(timezone.utc).isoformat(),),
+            )
+        print(f"[subscriptions] Перенесено из {self.migrate_from}: {len(rows)} подписок")
+
+    def _backfill_activity(self) -> None:
+        """
+        Подписки, заведённые до учёта активности, считаются активными
+        с момента этой миграции, а не сразу просроченными.
+        """
+        done = self.conn.execute("SELECT value FROM meta WHERE key = 'activity_backfilled'").fetchone()
+        if done:
+            return
+        with self.conn:
+            self.conn.execute("BEGIN")
+            self.conn.execute(
+                "INSERT OR IGNORE INTO user_activity (user_id, last_active) "
+                "SELECT DISTINCT user_id, ? FROM subscriptions",
+                (int(time.time()),),
+            )
+            self.conn.execute(
+                "INSERT INTO meta (key, value) VALUES ('activity_backfilled', ?)",
+                (datetime.now(timezone.utc).isoformat(),),
+            )
+
+    # ---- чтение ----
+
+    async def get_user(self, user_id: int) -> List[int]:
+        rows = await self._query(
+            "SELECT team_id FROM subscriptions WHERE user_id = ? ORDER BY rowid",
+            (user_id,),
+        )
+        return [tid for (tid,) in rows]
+
+    async def all_team_ids(self) -> set[int]:
+        rows = await self._query("SELECT DISTINCT team_id FROM subscriptions")
+        return {tid for (tid,) in rows}
+
+    async def team_counts(self) -> Dict[int, int]:
+        rows = await self._query("SELECT team_id, COUNT(*) FROM subscriptions GROUP BY team_id")
+        return dict(rows)
+
+    async def subscribers_for_teams(self, team_ids: set[int], event: int = NOTIFY_ALL) -> set[int]:
+        if not team_ids:
+            return set()
+        placeholders = ", ".join("?" for _ in team_ids)
+        rows = await self._query(
+            f"SELECT DISTINCT user_id FROM subscriptions "
+            f"WHERE team_id IN ({placeholders}) AND events & ? != 0",
+            (*team_ids, event),
+        )
+        return {uid for (uid,) in rows}
+
+    async def get_events(self, user_id: int) -> Dict[int, int]:
+        rows = await self._query(
+            "SELECT team_id, events FROM subscriptions WHERE user_id = ? AND events != ?",
+            (user_id, NOTIFY_ALL),
+        )
+        return dict(rows)
+
+    async def iter_subscriptions(self, batch_size: int = SUBSCRIPTIONS_BATCH_SIZE):
+        # постранично по первичному ключу: каждая страница — короткий запрос по индексу
+        last = (-1, -1)
+        while True:
+            rows = await self._query(
+                "SELECT s.user_id, s.team_id, s.events, a.last_active FROM subscriptions s "
+                "LEFT JOIN user_activity a ON a.user_id = s.user_id "
+                "WHERE (s.user_id, s.team_id) > (?, ?) ORDER BY s.user_id, s.team_id LIMIT ?",
+                (*last, batch_size),
+            )
+            if not rows:
+                return
+            yield [SubscriptionRecord(*row) for row in rows]
+            last = rows[-1][:2]
+
+    # ---- изменения ----
+
+    async def add(self, user_id: int, team_id: int) -> bool:
+        def insert_row() -> bool:
+            changed = self.conn.execute(
+                "INSERT OR IGNORE INTO subscriptions (user_id, team_id) VALUES (?, ?)",
+                (user_id, team_id),
+            ).rowcount
+            if changed:
+                self._log_changes([(user_id, team_id, 1)])
+                self._mark_active([user_id])
+            return changed > 0
+
+        async with self._lock(user_id):
+            return await self._write(insert_row)
+
+    async def import_records(self, records: Iterable[SubscriptionRecord]) -> int:
+        records = list(records)
+        now = int(time.time())
+
+        def insert_rows() -> int:
+            inserted = [
+                record for record in records
+                if self.conn.execute(
+                    "INSERT OR IGNORE INTO subscriptions (user_id, team_id, events) VALUES (?, ?, ?)",
+                    record[:3],
+                ).rowcount
+            ]
+            changes = [(record.user_id, record.team_id, 1) for record in inserted]
+            # своя маска событий — ещё и смена настроек: кэш получателей выбросит записи команды
+            changes += [
+                (record.user_id, record.team_id, self.CHANGE_EVENTS)
+                for record in inserted if record.events != NOTIFY_ALL
+            ]
+            self._log_changes(changes)
+            activity: Dict[int, int] = {}
+            for record in inserted:
+                at = now if record.last_active is None else record.last_active
+                activity[record.user_id] = max(at, activity.get(record.user_id, at))
+            # у тех, кто уже был подписан, время активности назад не уходит
+            self.conn.executemany(
+                "INSERT INTO user_activity (user_id, last_active) VALUES (?, ?) "
+                "ON CONFLICT (user_id) DO UPDATE SET last_active = MAX(last_active, excluded.last_active)",
+                activity.items(),
+            )
+            return len(inserted)
+
+        return await self._write(insert_rows)
+
+    async def remove(self, user_id: int, team_id: int) -> bool:
+        def delete_row() -> bool:
+            changed = self.conn.execute(
+                "DELETE FROM subscriptions WHERE user_id = ? AND team_id = ?",
+                (user_id, team_id),
+            ).rowcount
+            if changed:
+                self._log_changes([(user_id, team_id, 0)])
+                self._mark_active([user_id])
+            return changed > 0
+
+        async with self._lock(user_id):
+            return await self._write(delete_row)
+
+    async def clear(self, user_id: int) -> None:
+        def clear_rows() -> None:
+            rows = self.conn.execute(
+                "SELECT team_id FROM subscriptions WHERE user_id = ?", (user_id,)
+            ).fetchall()
+            self.conn.execute("DELETE FROM subscriptions WHERE user_id = ?", (user_id,))
+            self.conn.execute("DELETE FROM user_activity WHERE user_id = ?", (user_id,))
+            self._log_changes([(user_id, tid, 0) for (tid,) in rows])
+
+        async with self._lock(user_id):
+            await self._write(clear_rows)
+
+    async def set_events(self, user_id: int, team_id: int, events: int) -> bool:
+        def update_row() -> bool:
+            row = self.conn.execute(
+                "SELECT events FROM subscriptions WHERE user_id = ? AND team_id = ?",
+                (user_id, team_id),
+            ).fetchone()
+            if row is None:
+                return False
+            if row[0] != events:
+                self.conn.execute(
+                    "UPDATE subscriptions SET events = ? WHERE user_id = ? AND team_id = ?",
+                    (events, user_id, team_id),
+                )
+                self._log_changes([(user_id, team_id, self.CHANGE_EVENTS)])
+                self._mark_active([user_id])
+            return True
+
+        async with self._lock(user_id):
+            return await self._write(update_row)
+
+    # ---- активность ----
+
+    async def touch_many(self, user_ids: Iterable[int]) -> None:
+        user_ids = list(user_ids)
+        now = int(time.time())
+        cutoff = now - SUBSCRIPTIONS_TOUCH_SECONDS
+        # сначала чтение: почти всегда отметка свежая, и транзакция на запись не нужна
+        stale: List[int] = []
+        for start in range(0, len(user_ids), SUBSCRIPTIONS_BATCH_SIZE):
+            batch = user_ids[start:start + SUBSCRIPTIONS_BATCH_SIZE]
+            placeholders = ", ".join("?" for _ in batch)
+            rows = await self._query(
+                f"SELECT user_id FROM user_activity WHERE user_id IN ({placeholders}) AND last_active < ?",
+                (*batch, cutoff),
+            )
+            stale.extend(uid for (uid,) in rows)
+        if not stale:
+            return
+        rows = [(now, user_id, cutoff) for user_id in stale]
+        # строка есть только у пользователей с подписками; свежую не трогаем
+        await self._write(lambda: self.conn.executemany(
+            "UPDATE user_activity SET last_active = ? WHERE user_id = ? AND last_active < ?",
+            rows,
+        ))
+
+    async def inactive_users(self, cutoff: float) -> List[int]:
+        rows = await self._query(
+            "SELECT a.user_id FROM user_activity a WHERE a.last_active < ? "
+            "AND EXISTS (SELECT 1 FROM subscriptions s WHERE s.user_id = a.user_id)",
+            (int(cutoff),),
+        )
+        return [uid for (uid,) in rows]
+
+
+class ShardedSubscriptionStore(SubscriptionStore):
+    """
+    Подписки в файлах-шардах по хешу user_id; сводка teams_summary.json
+    говорит, какие команды опрашивать и какие шарды открывать.
+    """
+
+    def __init__(
+        self,
+        path: Path,
+        shard_count: int = SUBSCRIPTIONS_SHARD_COUNT,
+        migrate_from: Optional[Path] = None,
+        journal_max_bytes: int = SUBSCRIPTIONS_JOURNAL_MAX_BYTES,
+    ):
+        super().__init__(path)
+        self.shard_count = shard_count
+        self.migrate_from = migrate_from
+        self.summary_path = path / "teams_summary.json"
+        # приращения счётчиков сводки строками [team_id, шард, ±1] поверх teams_summary.json
+        self.summary_journal_path = path / "teams_summary.journal"
+        self.journal_max_bytes = journal_max_bytes
+        # пока метка есть, сводка может отставать от шардов
+        self.dirty_path = path / "teams_summary.dirty"
+        self.summary: Dict[int, Dict[int, int]] = {}
+        # приращения, ещё не дописанные в журнал сводки
+        self._summary_deltas: List[tuple[int, int, int]] = []
+        self._summary_journal_size = 0
+        self._writes_in_flight = 0
+        self._shard_locks: Dict[int, asyncio.Lock] = {}
+        self._summary_lock = asyncio.Lock()
+        self._process_lock: Optional[Any] = None
+
+    def shard_of(self, user_id: int) -> int:
+        return zlib.crc32(str(user_id).encode("ascii")) % self.shard_count
+
+    def _shard_path(self, shard: int) -> Path:
+        return self.path / f"shard_{shard:03d}.json"
+
+    def _shard_lock(self, shard: int) -> asyncio.Lock:
+        lock = self._shard_locks.get(shard)
+        if lock is None:
+            lock = self._shard_locks[shard] = asyncio.Lock()
+        return lock
+
+    # ---- сводка по командам ----
+
+    def load(self) -> None:
+        self._process_lock = lock_process_file(self.path / "subscriptions.lock")
+        shard_files = list(self.path.glob("shard_*.json"))
+        users = read_json_store(self.migrate_from) if not shard_files and self.migrate_from else None
+        if users is not None:
+            self._migrate_from_json(users)
+        elif self.dirty_path.exists() or (
+            shard_files and not self.summary_path.exists() and not self.summary_journal_path.exists()
+        ):
+            # прошлый процесс упал между записью шарда и записью сводки
+            self._rebuild_summary()
+        else:
+            if self.summary_journal_path.exists():
+                self._fold_summary_journal()
+                self.dirty_path.unlink(missing_ok=True)
+            data = read_json_file(self.summary_path) if self.summary_path.exists() else {}
+            if data and data.get("shard_count") != self.shard_count:
+                raise RuntimeError(
+                    f"Шарды в {self.path} разложены на {data.get('shard_count')} частей, "
+                    f"а SUBSCRIPTIONS_SHARD_COUNT = {self.shard_count}"
+                )
+            self.summary = {
+                int(tid): {int(shard): count for shard, count in shards.items()}
+                for tid, shards in data.get("teams", {}).items()
+            }
+        self.loaded = True
+        print(f"[subscriptions] Шарды {self.path}: команд в сводке {len(self.summary)}")
+
+    def close(self) -> None:
+        if self._process_lock is not None:
+            self._process_lock.close()
+            self._process_lock = None
+
+    def _rebuild_summary(self) -> None:
+        self.summary = {}
+        for shard in range(self.shard_count):
+            users = load_subscriptions(self._shard_path(shard)).get("users", {})
+            for entry in users.values():
+                for tid in entry_team_ids(entry):
+                    counts = self.summary.setdefault(tid, {})
+                    counts[shard] = counts.get(shard, 0) + 1
+        self._write_summary(self._summary_data())
+        self.summary_journal_path.unlink(missing_ok=True)
+        self.dirty_path.unlink(missing_ok=True)
+        print(f"[subscriptions] Сводка {self.summary_path} пересобрана по шардам")
+
+    def _migrate_from_json(self, users: Dict[int, UserSubscriptions]) -> None:
+        shards: Dict[int, Dict[str, Any]] = {}
+        for user_id, record in users.items():
+            shards.setdefault(self.shard_of(user_id), {})[str(user_id)] = record
+        for shard, shard_users in shards.items():
+            save_subscriptions({"users": shard_users}, self._shard_path(shard))
+        print(f"[subscriptions] {self.migrate_from} разложен по {len(shards)} шардам")
+        self._rebuild_summary()
+
+    def _summary_data(self) -> Dict[str, Any]:
+        return {
+            "shard_count": self.shard_count,
+            "teams": {
+                str(tid): {str(shard): count for shard, count in counts.items()}
+                for tid, counts in self.summary.items()
+            },
+        }
+
+    def _write_summary(self, data: Dict[str, Any]) -> None:
+        tmp_path = self.summary_path.with_name(self.summary_path.name + ".tmp")
+        with tmp_path.open("w", encoding="utf-8") as f:
+            json.dump(data, f)
+        os.replace(tmp_path, self.summary_path)
+
+    def _fold_summary_journal(self) -> None:
+        """
+        Сворачивает журнал сводки в teams_summary.json по файлам, не трогая self.summary.
+        Приращения нельзя применить дважды: упавшую свёртку метка dirty отправит на пересборку.
+        """
+        self.dirty_path.touch()
+        data: Dict[str, Any] = {"shard_count": self.shard_count, "teams": {}}
+        if self.summary_path.exists():
+            data = read_json_file(self.summary_path)
+        teams = data["teams"]
+        with self.summary_journal_path.open("r", encoding="utf-8") as f:
+            for line in f:
+                tid, shard, delta = json.loads(line)
+                counts = teams.setdefault(str(tid), {})
+                count = counts.get(str(shard), 0) + delta
+                if count > 0:
+                    counts[str(shard)] = count
+                else:
+                    counts.pop(str(shard), None)
+                    if not counts:
+                        del teams[str(tid)]
+        self._write_summary(data)
+        self.summary_journal_path.unlink()
+
+    def _append_summary_journal(self, lines: str) -> None:
+        with self.summary_journal_path.open("a", encoding="utf-8") as f:
+            f.write(lines)
+
+    def _adjust_summary(self, shard: int, team_id: int, delta: int) -> None:
+        self._summary_deltas.append((team_id, shard, delta))
+        counts = self.summary.setdefault(team_id, {})
+        count = counts.get(shard, 0) + delta
+        if count > 0:
+            counts[shard] = count
+        else:
+            counts.pop(shard, None)
+            if not counts:
+                del self.summary[team_id]
+
+    async def _save_summary(self) -> None:
+        # на диск уходят только приращения этой записи, а не вся сводка
+        async with self._summary_lock:
+            deltas, self._summary_deltas = self._summary_deltas, []
+            if deltas:
+                lines = "".join(json.dumps(delta) + "\n" for delta in deltas)
+                await asyncio.to_thread(self._append_summary_journal, lines)
+                self._summary_journal_size += len(lines)
+            if self._summary_journal_size > self.journal_max_bytes:
+                await asyncio.to_thread(self._fold_summary_journal)
+                self._summary_journal_size = 0
+            if self._writes_in_flight == 0:
+                await asyncio.to_thread(self.dirty_path.unlink, True)
+
+    # ---- шарды ----
+
+    async def _read_shard(self, shard: int) -> Dict[str, Any]:
+        data = await asyncio.to_thread(load_subscriptions, self._shard_path(shard))
+        return data.get("users", {})
+
+    async def _read_shard_locked(self, shard: int) -> Dict[str, Any]:
+        # на Windows os.replace падает с PermissionError, пока файл шарда открыт на чтение
+        async with self._shard_lock(shard):
+            return await self._read_shard(shard)
+
+    async def _update_user(self, user_id: int, update) -> bool:
+        """
+        Переписывает шард со списком team_id от update(teams); None — менять нечего.
+        """
+        await self.open()
+        shard = self.shard_of(user_id)
+        async with self._shard_lock(shard):
+            users = await self._read_shard(shard)
+            user_key = str(user_id)
+            entry = users.get(user_key, {})
+            teams = entry_team_ids(entry)
+            new_teams = update(teams)
+            if new_teams is None:
+                return False
+            users[user_key] = {"teams": new_teams, "last_active": int(time.time())}
+            # настройки снятых подписок не храним
+            events = {str(tid): mask for tid, mask in entry_events(entry).items() if tid in new_teams}
+            if events:
+                users[user_key]["events"] = events
+            self._writes_in_flight += 1
+            try:
+                await asyncio.to_thread(self.dirty_path.touch)
+                await asyncio.to_thread(save_subscriptions, {"users": users}, self._shard_path(shard))
+            finally:
+                self._writes_in_flight -= 1
+
+        before = set(teams)
+        after = set(new_teams)
+        for tid in before - after:
+            self._adjust_summary(shard, tid, -1)
+            self._publish(user_id, tid, False)
+        for tid in after - before:
+            self._adjust_summary(shard, tid, +1)
+            self._publish(user_id, tid, True)
+        await self._save_summary()
+        return True
+
+    # ---- чтение ----
+
+    async def get_user(self, user_id: int) -> List[int]:
+        await self.open()
+        users = await self._read_shard_locked(self.shard_of(user_id))
+        return entry_team_ids(users.get(str(user_id), {}))
+
+    async def all_team_ids(self) -> set[int]:
+        await self.open()
+        return set(self.summary)
+
+    async def team_counts(self) -> Dict[int, int]:
+        await self.open()
+        return {tid: sum(counts.values()) for tid, counts in self.summary.items()}
+
+    async def subscribers_for_teams(self, team_ids: set[int], event: int = NOTIFY_ALL) -> set[int]:
+        await self.open()
+        shards: set[int] = set()
+        for tid in team_ids:
+            shards.update(self.summary.get(tid, {}))
+
+        matched: set[int] = set()
+        for shard in sorted(shards):
+            for user_key, entry in (await self._read_shard_locked(shard)).items():
+                teams = team_ids.intersection(entry_team_ids(entry))
+                if not teams:
+                    continue
+                events = entry_events(entry) if event != NOTIFY_ALL else {}
+                if any(events.get(tid, NOTIFY_ALL) & event for tid in teams):
+                    matched.add(int(user_key))
+        return matched
+
+    async def get_events(self, user_id: int) -> Dict[int, int]:
+        await self.open()
+        users = await self._read_shard_locked(self.shard_of(user_id))
+        return entry_events(users.get(str(user_id), {}))
+
+    async def iter_subscriptions(self, batch_size: int = SUBSCRIPTIONS_BATCH_SIZE):
+        await self.open()
+        batch: List[tuple[int, int]] = []
+        # в памяти одновременно только один шард
+        for shard in range(self.shard_count):
+            for user_key, entry in (await self._read_shard_locked(shard)).items():
+                events = entry_events(entry)
+                batch.extend(
+                    SubscriptionRecord(int(user_key), tid, events.get(tid, NOTIFY_ALL), entry.get("last_active"))
+                    for tid in entry_team_ids(entry)
+                )
+                if len(batch) >= batch_size:
+                    yield batch
+                    batch = []
+        if batch:
+            yield batch
+
+    # ---- изменения ----
+
+    async def add(self, user_id: int, team_id: int) -> bool:
+        def update(teams):
+            if team_id in teams:
+                return None
+            return teams + [team_id]
+
+        return await self._update_user(user_id, update)
+
+    async def import_records(self, records: Iterable[SubscriptionRecord]) -> int:
+        await self.open()
+        by_shard: Dict[int, Dict[int, Dict[int, SubscriptionRecord]]] = {}
+        for record in records:
+            shard_records = by_shard.setdefault(self.shard_of(record.user_id), {})
+            # повтор пары внутри пачки: первая запись выигрывает, как и в других хранилищах
+            shard_records.setdefault(record.user_id, {}).setdefault(record.team_id, record)
+
+        added = 0
+        now = int(time.time())
+        # каждый затронутый шард читается и переписывается один раз, сводка — один раз на пачку
+        for shard, user_records in sorted(by_shard.items()):
+            async with self._shard_lock(shard):
+                users = await self._read_shard(shard)
+                new_pairs = []
+                for user_id, team_records in user_records.items():
+                    entry = users.get(str(user_id), {})
+                    teams = entry_team_ids(entry)
+                    fresh = [record for tid, record in team_records.items() if tid not in teams]
+                    if not fresh:
+                        continue
+                    last_active = max(now if r.last_active is None else r.last_active for r in fresh)
+                    if teams:
+                        last_active = max(last_active, entry.get("last_active", 0))
+                    events = entry_events(entry)
+                    events.update((r.team_id, r.events) for r in fresh if r.events != NOTIFY_ALL)
+                    entry = {**entry, "teams": teams + [r.team_id for r in fresh], "last_active": last_active}
+                    if events:
+                        entry["events"] = {str(tid): mask for tid, mask in events.items()}
+                    users[str(user_id)] = entry
+                    new_pairs.extend((user_id, r.team_id) for r in fresh)
+                if not new_pairs:
+                    continue
+                self._writes_in_flight += 1
+                try:
+                    await asyncio.to_thread(self.dirty_path.touch)
+                    await asyncio.to_thread(save_subscriptions, {"users": users}, self._shard_path(shard))
+                finally:
+                    self._writes_in_flight -= 1
+            for user_id, tid in new_pairs:
+                self._adjust_summary(shard, tid, +1)
+                self._publish(user_id, tid, True)
+                if user_records[user_id][tid].events != NOTIFY_ALL:
+                    # для кэшей получателей это смена настроек, а не подписка на все события
+                    self._publish(user_id, tid, None)
+            added += len(new_pairs)
+        if added:
+            await self._save_summary()
+        return added
+
+    async def remove(self, user_id: int, team_id: int) -> bool:
+        def update(teams):
+            if team_id not in teams:
+                return None
+            return [tid for tid in teams if tid != team_id]
+
+        return await self._update_user(user_id, update)
+
+    async def clear(self, user_id: int) -> None:
+        await self._update_user(user_id, lambda teams: [])
+
+    async def set_events(self, user_id: int, team_id: int, events: int) -> bool:
+        await self.open()
+        shard = self.shard_of(user_id)
+        user_key = str(user_id)
+        async with self._shard_lock(shard):
+            users = await self._read_shard(shard)
+            entry = users.get(user_key, {})
+            if team_id not in entry_team_ids(entry):
+                return False
+            current = entry_events(entry)
+            if current.get(team_id, NOTIFY_ALL) == events:
+                return True
+            current.pop(team_id, None)
+            if events != NOTIFY_ALL:
+                current[team_id] = events
+            entry = {**entry, "last_active": int(time.time())}
+            entry.pop("events", None)
+            if current:
+                entry["events"] = {str(tid): mask for tid, mask in current.items()}
+            users[user_key] = entry
+            # сводка по командам не меняется, метка dirty не нужна
+            await asyncio.to_thread(save_subscriptions, {"users": users}, self._shard_path(shard))
+        self._publish(user_id, team_id, None)
+        return True
+
+    # ---- активность ----
+
+    async def touch_many(self, user_ids: Iterable[int]) -> None:
+        await self.open()
+        by_shard: Dict[int, List[int]] = {}
+        for user_id in user_ids:
+            by_shard.setdefault(self.shard_of(user_id), []).append(user_id)
+        now = int(time.time())
+        for shard, shard_user_ids in sorted(by_shard.items()):
+            async with self._shard_lock(shard):
+                users = await self._read_shard(shard)
+                touched = False
+                for user_id in shard_user_ids:
+                    user_key = str(user_id)
+                    entry = users.get(user_key)
+                    if not entry or not entry.get("teams") or now - entry.get("last_active", 0) < SUBSCRIPTIONS_TOUCH_SECONDS:
+                        continue
+                    users[user_key] = {**entry, "last_active": now}
+                    touched = True
+                if touched:
+                    await asyncio.to_thread(save_subscriptions, {"users": users}, self._shard_path(shard))
+
+    async def inactive_users(self, cutoff: float) -> List[int]:
+        await self.open()
+        now = int(time.time())
+        inactive: List[int] = []
+        for shard in range(self.shard_count):
+            async with self._shard_lock(shard):
+                users = await self._read_shard(shard)
+                unstamped = False
+                for user_key, entry in users.items():
+                    if not entry.get("teams"):
+                        continue
+                    if "last_active" not in entry:
+                        # подписки старше учёта активности: отсчёт с первой проверки
+                        entry["last_active"] = now
+                        unstamped = True
+                    elif entry["last_active"] < cutoff:
+                        inactive.append(int(user_key))
+                if unstamped:
+                    await asyncio.to_thread(save_subscriptions, {"users": users}, self._shard_path(shard))
+        return inactive
+
+
+class DerivedView:
+    """
+    Структура, вычисляемая из подписок: догоняет хранилище по ленте изменений
+    и пересобирается, только если лента не покрывает отставание.
+    """
+
+    def __init__(self, store: SubscriptionStore):
+        self.store = store
+        self.version = -1
+        self._refresh_lock = asyncio.Lock()
+
+    async def rebuild(self) -> None:
+        raise NotImplementedError
+
+    def apply(self, change: SubscriptionChange) -> None:
+        raise NotImplementedError
+
+    async def refresh(self) -> None:
+        store = self.store
+        await store.sync()
+        if self.version == store.version:
+            return
+        async with self._refresh_lock:
+            changes = store.changes_since(self.version) if self.version >= 0 else None
+            if changes is None:
+                # пока шла пересборка, хранилище могло измениться — тогда ещё раз
+                while True:
+                    version = store.version
+                    await self.rebuild()
+                    if store.version == version:
+                        break
+                self.version = version
+                return
+            for change in changes:
+                self.apply(change)
+            self.version = changes[-1].version if changes else self.version
+
+
+class SubscribedTeams(DerivedView):
+    """
+    Число подписчиков по командам — из него берётся набор команд для опроса.
+    """
+
+    def __init__(self, store: SubscriptionStore):
+        super().__init__(store)
+        self.counts: Dict[int, int] = {}
+
+    async def rebuild(self) -> None:
+        self.counts = await self.store.team_counts()
+
+    def apply(self, change: SubscriptionChange) -> None:
+        if change.added is None:
+            return
+        count = self.counts.get(change.team_id, 0) + (1 if change.added else -1)
+        if count > 0:
+            self.counts[change.team_id] = count
+        else:
+            self.counts.pop(change.team_id, None)
+
+    async def team_ids(self) -> set[int]:
+        await self.refresh()
+        return set(self.counts)
+
+
+class RecipientCache(DerivedView):
+    """
+    Получатели по набору команд матча и типу события; отписка и смена
+    настроек выбрасывают запись из кэша.
+    """
+
+    def __init__(self, store: SubscriptionStore, max_entries: int = RECIPIENT_CACHE_SIZE):
+        super().__init__(store)
+        self.max_entries = max_entries
+        self.entries: Dict[tuple[frozenset, int], set[int]] = {}
+
+    async def rebuild(self) -> None:
+        self.entries = {}
+
+    def apply(self, change: SubscriptionChange) -> None:
+        for key in [key for key in self.entries if change.team_id in key[0]]:
+            if change.added:
+                self.entries[key].add(change.user_id)
+            else:
+                del self.entries[key]
+
+    async def get(self, team_ids: set[int], event: int = NOTIFY_ALL) -> set[int]:
+        await self.refresh()
+        key = (frozenset(team_ids), event)
+        cached = self.entries.get(key)
+        if cached is not None:
+            return cached
+
+        version = self.store.version
+        recipients = await self.store.subscribers_for_teams(set(team_ids), event)
+        if self.store.version == version == self.version:
+            if len(self.entries) >= self.max_entries:
+                del self.entries[next(iter(self.entries))]
+            self.entries[key] = recipients
+        return recipients
+
+
+def guild_path(path: Path, guild_id: int) -> Path:
+    """
+    Файл или каталог подписок сервера: у основного — прежний путь,
+    у остальных к имени добавляется ID сервера.
+    """
+    if guild_id == GUILD_ID:
+        return path
+    return path.with_name(f"{path.stem}_{guild_id}{path.suffix}")
+
+
+def create_subscription_store(backend: str = SUBSCRIPTIONS_BACKEND, guild_id: int = GUILD_ID) -> SubscriptionStore:
+    json_path = guild_path(SUBSCRIPTIONS_FILE, guild_id)
+    if backend == "json":
+        return JsonSubscriptionStore(json_path)
+    if backend == "sqlite":
+        return SqliteSubscriptionStore(guild_path(SUBSCRIPTIONS_DB_FILE, guild_id), migrate_from=json_path)
+    if backend == "sharded":
+        return ShardedSubscriptionStore(guild_path(SUBSCRIPTIONS_SHARDS_DIR, guild_id), migrate_from=json_path)
+    raise RuntimeError(f"Неизвестный SUBSCRIPTIONS_BACKEND: {backend!r}")
+
+
+class GuildSubscriptions:
+    """
+    Подписки по серверам: у каждого сервера из GUILDS своё хранилище со
+    своим индексом подписчиков и свой набор команд для опроса.
+    """
+
+    def __init__(self, guild_ids: Iterable[int], backend: str = SUBSCRIPTIONS_BACKEND):
+        self.stores: Dict[int, SubscriptionStore] = {
+            guild_id: create_subscription_store(backend, guild_id) for guild_id in guild_ids
+        }
+        self.teams: Dict[int, SubscribedTeams] = {
+            guild_id: SubscribedTeams(store) for guild_id, store in self.stores.items()
+        }
+
+    def store(self, guild_id: int) -> SubscriptionStore:
+        return self.stores[guild_id]
+
+    async def open(self) -> None:
+        await asyncio.gather(*(store.open() for store in self.stores.values()))
+
+    def close(self) -> None:
+        for store in self.stores.values():
+            store.close()
+
+    async def team_guilds(self) -> Dict[int, set[int]]:
+        """
+        team_id -> серверы, где на команду кто-то подписан.
+        """
+        result: Dict[int, set[int]] = {}
+        for guild_id, teams in self.teams.items():
+            for tid in await teams.team_ids():
+                result.setdefault(tid, set()).add(guild_id)
+        return result
+
+
+guild_subscriptions = GuildSubscriptions(GUILDS)
+
+
+async def add_team_subscription(guild_id: int, user_id: int, team_id: int) -> None:
+    await guild_subscriptions.store(guild_id).add(user_id, team_id)
+
+
+async def add_team_subscriptions(guild_id: int, user_id: int, team_ids: Iterable[int]) -> int:
+    # одна пакетная запись вместо записи на каждую команду
+    return await guild_subscriptions.store(guild_id).add_many([(user_id, tid) for tid in team_ids])
+
+
+async def remove_team_subscription(guild_id: int, user_id: int, team_id: int) -> bool:
+    return await guild_subscriptions.store(guild_id).remove(user_id, team_id)
+
+
+async def clear_user_subscriptions(guild_id: int, user_id: int) -> None:
+    await guild_subscriptions.store(guild_id).clear(user_id)
+
+
+async def get_user_subscriptions(guild_id: int, user_id: int) -> List[int]:
+    return await guild_subscriptions.store(guild_id).get_user(user_id)
+
+
+async def set_notification_events(guild_id: int, user_id: int, team_id: int, events: int) -> bool:
+    return await guild_subscriptions.store(guild_id).set_events(user_id, team_id, events)
+
+
+async def get_notification_events(guild_id: int, user_id: int) -> Dict[int, int]:
+    return await guild_subscriptions.store(guild_id).get_events(user_id)
+
+
+def describe_events(events: int) -> str:
+    return ", ".join(name for bit, name in NOTIFY_EVENT_NAMES.items() if events & bit)
+
+
+async def get_all_subscribed_team_ids() -> set[int]:
+    """
+    Команды и турниры (отрицательные ключи), на которые подписан кто-нибудь хоть на одном сервере.
+    """
+    return set(await guild_subscriptions.team_guilds())
+
+
+# Подписка на турнир целиком — одна строка в хранилище с team_id = -id турнира.
+# Хранилища, индексы подписчиков и настройки событий работают с ней как с
+# обычной командой, а опрос ищет получателей по competition.id матча.
+COMPETITION_CODES_BY_ID: Dict[int, str] = {cid: code for code, cid in COMPETITION_IDS.items()}
+
 
-    before = len(entry["teams"])
-    entry["teams"] = [t for t in entry["teams"] if t["team_id"] != team_id]
-    changed = len(entry["teams"]) != before
-    if changed:
-        save_subscriptions(db)
-    return changed
+def competition_key(competition_id: int) -> int:
+    return -competition_id
 
 
-def clear_user_subscriptions(user_id: int) -> None:
-    db = load_subscriptions()
-    users = db.setdefault("users", {})
-    users[str(user_id)] = {"teams": []}
-    save_subscriptions(db)
+def is_competition_key(team_id: int) -> bool:
+    return team_id < 0
 
 
-def get_user_subscriptions(user_id: int) -> List[Dict[str, Any]]:
-    db = load_subscriptions()
-    return db.get("users", {}).get(str(user_id), {}).get("teams", [])
+def competition_code(team_id: int) -> Optional[str]:
+    return COMPETITION_CODES_BY_ID.get(-team_id)
 
+# ------------------- СОСТОЯНИЕ РАССЫЛКИ НА ДИСКЕ ------------------------
 
-def get_all_subscribed_team_ids() -> set[int]:
-    db = load_subscriptions()
-    ids: set[int] = set()
-    for entry in db.get("users", {}).values():
-        for t in entry.get("teams", []):
-            ids.add(t["team_id"])
-    return ids
+class NotificationStateFile:
+    """
+    Состояние рассылки в JSON-файле, переписывается атомарно и только при изменениях.
+    Файл занят одним процессом бота; нескольким нужен SUBSCRIPTIONS_BACKEND = "sqlite".
+    """
+
+    def __init__(self, path: Path):
+        self.path = path
+        self.loaded = False
+        self.dirty = False
+        self._open_lock = asyncio.Lock()
+        self._save_lock = asyncio.Lock()
+        self._process_lock = None
+
+    def load(self) -> None:
+        raise NotImplementedError
+
+    async def open(self) -> None:
+        async with self._open_lock:
+            if not self.loaded:
+                if self._process_lock is None:
+                    self._process_lock = await asyncio.to_thread(lock_process_file, self.path.with_suffix(".lock"))
+                await asyncio.to_thread(self.load)
+
+    async def sync(self) -> None:
+        """
+        Подтягивает изменения других процессов — перед проходом опроса или таймера.
+        """
+        await self.open()
+
+    def close(self) -> None:
+        if self._process_lock is not None:
+            self._process_lock.close()
+            self._process_lock = None
+
+    def _data(self) -> Dict[str, Any]:
+        raise NotImplementedError
+
+    def _write(self, data: Dict[str, Any]) -> None:
+        tmp_path = self.path.with_name(self.path.name + ".tmp")
+        with tmp_path.open("w", encoding="utf-8") as f:
+            json.dump(data, f, ensure_ascii=False)
+        os.replace(tmp_path, self.path)
+
+    async def save(self) -> None:
+        if not self.dirty:
+            return
+        async with self._save_lock:
+            self.dirty = False
+            await asyncio.to_thread(self._write, self._data())
+
+
+class NotificationStateDb:
+    """
+    Общая база SQLite для тихих часов и недоставляемых: с ней, как и с
+    SqliteSubscriptionStore, могут работать несколько процессов бота.
+    """
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS quiet_hours (
+            user_id INTEGER PRIMARY KEY,
+            start   INTEGER NOT NULL,
+            end     INTEGER NOT NULL
+        );
+        CREATE TABLE IF NOT EXISTS deferred (
+            seq      INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id  INTEGER NOT NULL,
+            match_id TEXT NOT NULL,
+            line     TEXT NOT NULL,
+            UNIQUE (user_id, match_id)
+        );
+        CREATE TABLE IF NOT EXISTS undeliverable (
+            user_id  INTEGER PRIMARY KEY,
+            failures INTEGER NOT NULL,
+            since    REAL NOT NULL,
+            retry_at REAL NOT NULL
+        );
+        CREATE TABLE IF NOT EXISTS meta (
+            key   TEXT PRIMARY KEY,
+            value TEXT NOT NULL
+        );
+    """
+
+    def __init__(self, path: Path):
+        self.path = path
+        self.conn: Optional[sqlite3.Connection] = None
+        self._open_lock = asyncio.Lock()
+        self._db = ThreadPoolExecutor(max_workers=1, thread_name_prefix="notifications-sqlite")
+
+    def _connect(self) -> None:
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.conn = sqlite3.connect(self.path, isolation_level=None)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA busy_timeout = 5000")
+        self.conn.executescript(self.SCHEMA)
+
+    async def run(self, fn, *args):
+        loop = asyncio.get_running_loop()
+        async with self._open_lock:
+            if self.conn is None:
+                await loop.run_in_executor(self._db, self._connect)
+        return await loop.run_in_executor(self._db, fn, *args)
+
+    async def write(self, fn):
+        def write():
+            with self.conn:
+                self.conn.execute("BEGIN IMMEDIATE")
+                return fn()
+
+        return await self.run(write)
+
+    def data_version(self) -> int:
+        # меняется только от коммитов других соединений, то есть других процессов
+        return self.conn.execute("PRAGMA data_version").fetchone()[0]
+
+    def close(self) -> None:
+        if self.conn is not None:
+            self._db.submit(self.conn.close).result()
+            self.conn = None
+        self._db.shutdown(wait=True)
+
+
+class SqliteNotificationState(NotificationStateFile):
+    """
+    Общая часть состояний рассылки в NotificationStateDb: изменения копятся
+    в памяти и пишутся одной транзакцией в save(), чужие подтягиваются в sync().
+    """
+
+    def __init__(self, db: NotificationStateDb, json_path: Path):
+        super().__init__(json_path)
+        self.db = db
+        self._ops: List[tuple] = []
+        self._data_version: Optional[int] = None
+
+    async def open(self) -> None:
+        async with self._open_lock:
+            if not self.loaded:
+                await self.db.write(self._migrate)
+                self._reset(await self.db.run(self._read_rows), initial=True)
+                self.loaded = True
+
+    async def sync(self) -> None:
+        await self.open()
+        await self.save()
+        if await self.db.run(self.db.data_version) != self._data_version:
+            self._reset(await self.db.run(self._read_rows))
+
+    def close(self) -> None:
+        self.db.close()
+
+    async def save(self) -> None:
+        if not self._ops:
+            return
+        async with self._save_lock:
+            ops, self._ops = self._ops, []
+            await self.db.write(lambda: self._apply_ops(ops))
+
+    def _migrate(self) -> None:
+        """
+        Первый запуск на SQLite: один раз переносит то, что было в JSON-файле.
+        """
+        key = f"json_migrated:{self.path.name}"
+        if self.db.conn.execute("SELECT 1 FROM meta WHERE key = ?", (key,)).fetchone():
+            return
+        if self.path.exists():
+            self.load()
+            self._insert_loaded()
+        self.db.conn.execute("INSERT INTO meta (key, value) VALUES (?, ?)", (key, str(int(time.time()))))
+
+    def _insert_loaded(self) -> None:
+        raise NotImplementedError
+
+    def _read_rows(self):
+        raise NotImplementedError
+
+    def _reset(self, rows, initial: bool = False) -> None:
+        raise NotImplementedError
+
+    def _apply_ops(self, ops: List[tuple]) -> None:
+        raise NotImplementedError
+
+# ------------------------------ ТИХИЕ ЧАСЫ -------------------------------
+
+def msk_minute_of_day() -> int:
+    now_msk = datetime.now(timezone.utc) + timedelta(hours=3)
+    return now_msk.hour * 60 + now_msk.minute
+
+
+def parse_hh_mm(value: str) -> Optional[int]:
+    try:
+        hours, minutes = value.strip().split(":")
+        hours, minutes = int(hours), int(minutes)
+    except ValueError:
+        return None
+    if not (0 <= hours < 24 and 0 <= minutes < 60):
+        return None
+    return hours * 60 + minutes
+
+
+def format_hh_mm(minute_of_day: int) -> str:
+    return f"{minute_of_day // 60:02d}:{minute_of_day % 60:02d}"
+
+
+class DeferredNotifications(NotificationStateFile):
+    """
+    Тихие часы (минуты суток по МСК) и отложенные на них уведомления, разложенные
+    по минуте окончания окна: после тихих часов приходит одна сводка.
+    """
+
+    def __init__(self, path: Path):
+        super().__init__(path)
+        self.quiet_hours: Dict[int, tuple[int, int]] = {}
+        # user_id -> match_id -> строка сводки
+        self.pending: Dict[int, Dict[str, str]] = {}
+        # минута окончания окна -> пользователи с отложенными уведомлениями
+        self.pending_by_end: Dict[int, set[int]] = {}
+        # группы с окончанием до этой минуты включительно уже разобраны
+        self.last_flush_minute: Optional[int] = None
+
+    def load(self) -> None:
+        self.loaded = True
+        if not self.path.exists():
+            return
+        data = read_json_file(self.path)
+        self._set_state(
+            {int(uid): tuple(window) for uid, window in data.get("quiet_hours", {}).items()},
+            {int(uid): matches for uid, matches in data.get("pending", {}).items()},
+        )
+        print(f"[quiet] Тихие часы у {len(self.quiet_hours)} пользователей, отложено для {len(self.pending)}")
+
+    def _set_state(self, quiet_hours: Dict[int, tuple[int, int]], pending: Dict[int, Dict[str, str]]) -> None:
+        self.quiet_hours = quiet_hours
+        self.pending = pending
+        self.pending_by_end = {}
+        # чьи окна закончились, пока состояние лежало на диске, попадут в группу -1
+        minute = msk_minute_of_day()
+        for user_id in self.pending:
+            self._bucket(user_id, minute).add(user_id)
+        self.last_flush_minute = minute
+
+    def _bucket(self, user_id: int, minute: int) -> set[int]:
+        # у снявших тихие часы или уже вышедших из них сводка уйдёт на ближайшем тике, группа -1
+        end = self.quiet_hours[user_id][1] if self.is_quiet(user_id, minute) else -1
+        return self.pending_by_end.setdefault(end, set())
+
+    def _unbucket(self, user_id: int) -> None:
+        for end, users in list(self.pending_by_end.items()):
+            users.discard(user_id)
+            if not users:
+                del self.pending_by_end[end]
+
+    def is_quiet(self, user_id: int, minute: int) -> bool:
+        window = self.quiet_hours.get(user_id)
+        if window is None:
+            return False
+        start, end = window
+        if start <= end:
+            return start <= minute < end
+        return minute >= start or minute < end
+
+    def set_quiet_hours(self, user_id: int, start: int, end: int) -> None:
+        self._unbucket(user_id)
+        self.quiet_hours[user_id] = (start, end)
+        if user_id in self.pending:
+            self._bucket(user_id, msk_minute_of_day()).add(user_id)
+        self.dirty = True
+
+    def clear_quiet_hours(self, user_id: int) -> None:
+        self._unbucket(user_id)
+        self.quiet_hours.pop(user_id, None)
+        if user_id in self.pending:
+            self._bucket(user_id, msk_minute_of_day()).add(user_id)
+        self.dirty = True
+
+    def defer(self, user_id: int, match_id: int, line: str) -> None:
+        matches = self.pending.get(user_id)
+        if matches is None:
+            matches = self.pending[user_id] = {}
+            # откладываем только в тихие часы: группа — минута их окончания
+            self.pending_by_end.setdefault(self.quiet_hours[user_id][1], set()).add(user_id)
+        # словарь помнит порядок вставки: переставляем матч в конец
+        matches.pop(str(match_id), None)
+        matches[str(match_id)] = line
+        self.dirty = True
+
+    def _take_due_users(self, minute: int) -> List[int]:
+        last = self.last_flush_minute if self.last_flush_minute is not None else minute
+        self.last_flush_minute = minute
+        # окна, закончившиеся в (last, minute], с переходом через полночь
+        span = (minute - last) % 1440
+        due: List[int] = []
+        for end in [end for end in self.pending_by_end if end == -1 or 0 < (end - last) % 1440 <= span]:
+            due.extend(self.pending_by_end.pop(end))
+        return due
+
+    async def take_due(self, minute: int) -> List[tuple[int, List[str]]]:
+        """
+        Забирает сводки всех, у кого тихие часы уже закончились.
+        """
+        due = [(user_id, list(self.pending.pop(user_id).values())) for user_id in self._take_due_users(minute)]
+        if due:
+            self.dirty = True
+        return due
+
+    def _data(self) -> Dict[str, Any]:
+        return {
+            "quiet_hours": {str(uid): list(window) for uid, window in self.quiet_hours.items()},
+            "pending": {str(uid): dict(matches) for uid, matches in self.pending.items()},
+        }
+
+
+class SqliteDeferredNotifications(SqliteNotificationState, DeferredNotifications):
+    """
+    Тихие часы в NotificationStateDb. Сводку забирает тот процесс, чья
+    транзакция удалила строки, — второй её уже не найдёт.
+    """
+
+    def _insert_loaded(self) -> None:
+        self.db.conn.executemany(
+            "INSERT OR REPLACE INTO quiet_hours (user_id, start, end) VALUES (?, ?, ?)",
+            [(uid, start, end) for uid, (start, end) in self.quiet_hours.items()],
+        )
+        self.db.conn.executemany(
+            "INSERT OR REPLACE INTO deferred (user_id, match_id, line) VALUES (?, ?, ?)",
+            [(uid, mid, line) for uid, matches in self.pending.items() for mid, line in matches.items()],
+        )
+
+    def _read_rows(self):
+        conn = self.db.conn
+        self._data_version = self.db.data_version()
+        return (
+            conn.execute("SELECT user_id, start, end FROM quiet_hours").fetchall(),
+            conn.execute("SELECT user_id, match_id, line FROM deferred ORDER BY seq").fetchall(),
+        )
+
+    def _reset(self, rows, initial: bool = False) -> None:
+        quiet_rows, deferred_rows = rows
+        pending: Dict[int, Dict[str, str]] = {}
+        for user_id, match_id, line in deferred_rows:
+            pending.setdefault(user_id, {})[match_id] = line
+        self._set_state({uid: (start, end) for uid, start, end in quiet_rows}, pending)
+        if initial:
+            print(f"[quiet] SQLite {self.db.path}: тихие часы у {len(self.quiet_hours)} пользователей, "
+                  f"отложено для {len(self.pending)}")
+
+    def set_quiet_hours(self, user_id: int, start: int, end: int) -> None:
+        super().set_quiet_hours(user_id, start, end)
+        self._ops.append(("quiet", user_id, start, end))
+
+    def clear_quiet_hours(self, user_id: int) -> None:
+        super().clear_quiet_hours(user_id)
+        self._ops.append(("quiet_off", user_id))
+
+    def defer(self, user_id: int, match_id: int, line: str) -> None:
+        super().defer(user_id, match_id, line)
+        self._ops.append(("defer", user_id, str(match_id), line))
+
+    def _apply_ops(self, ops: List[tuple]) -> None:
+        conn = self.db.conn
+        for op, user_id, *args in ops:
+            if op == "quiet":
+                conn.execute("INSERT OR REPLACE INTO quiet_hours (user_id, start, end) VALUES (?, ?, ?)", (user_id, *args))
+            elif op == "quiet_off":
+                conn.execute("DELETE FROM quiet_hours WHERE user_id = ?", (user_id,))
+            else:
+                # удаление и вставка с новым seq — матч переезжает в конец сводки
+                conn.execute("DELETE FROM deferred WHERE user_id = ? AND match_id = ?", (user_id, args[0]))
+                conn.execute("INSERT INTO deferred (user_id, match_id, line) VALUES (?, ?, ?)", (user_id, *args))
+
+    async def take_due(self, minute: int) -> List[tuple[int, List[str]]]:
+        await self.save()
+        user_ids = self._take_due_users(minute)
+        for user_id in user_ids:
+            self.pending.pop(user_id, None)
+        if not user_ids:
+            return []
+
+        def take() -> List[tuple[int, str]]:
+            rows: List[tuple[int, str]] = []
+            for i in range(0, len(user_ids), 500):
+                chunk = user_ids[i:i + 500]
+                placeholders = ",".join("?" * len(chunk))
+                rows += self.db.conn.execute(
+                    f"SELECT user_id, line FROM deferred WHERE user_id IN ({placeholders}) ORDER BY seq", chunk
+                ).fetchall()
+                self.db.conn.execute(f"DELETE FROM deferred WHERE user_id IN ({placeholders})", chunk)
+            return rows
+
+        lines: Dict[int, List[str]] = {}
+        for user_id, line in await self.db.write(take):
+            lines.setdefault(user_id, []).append(line)
+        return list(lines.items())
+
+# ------------------ НЕДОСТАВЛЯЕМЫЕ ЛИЧНЫЕ СООБЩЕНИЯ ----------------------
+
+class UndeliverableRecipients(NotificationStateFile):
+    """
+    Пользователи с недоступными личными сообщениями: до следующей попытки
+    (интервал удваивается) им ничего не шлём и не делаем fetch_user.
+    """
+
+    def __init__(self, path: Path):
+        super().__init__(path)
+        # user_id -> {"failures": n, "since": ts, "retry_at": ts}
+        self.records: Dict[int, Dict[str, float]] = {}
+
+    def load(self) -> None:
+        self.loaded = True
+        if not self.path.exists():
+            return
+        self.records = {int(uid): record for uid, record in read_json_file(self.path).items()}
+        print(f"[undeliverable] Личные сообщения недоступны у {len(self.records)} пользователей")
+
+    def is_blocked(self, user_id: int, now: float) -> bool:
+        record = self.records.get(user_id)
+        return record is not None and now < record["retry_at"]
+
+    def mark_failed(self, user_id: int, now: float) -> None:
+        record = self.records.get(user_id)
+        if record is None:
+            record = self.records[user_id] = {"failures": 0, "since": now}
+        record["failures"] += 1
+        delay = UNDELIVERABLE_RETRY_SECONDS * 2 ** (record["failures"] - 1)
+        record["retry_at"] = now + min(delay, UNDELIVERABLE_RETRY_MAX_SECONDS)
+        self.dirty = True
+
+    def mark_delivered(self, user_id: int) -> None:
+        if self.records.pop(user_id, None) is not None:
+            self.dirty = True
+
+    def _data(self) -> Dict[str, Any]:
+        return {str(uid): record for uid, record in self.records.items()}
+
+
+class SqliteUndeliverableRecipients(SqliteNotificationState, UndeliverableRecipients):
+    """
+    Недоставляемые в NotificationStateDb: счётчик неудач растёт в самой
+    базе, так что неудачи двух процессов не затирают друг друга.
+    """
+
+    def _insert_loaded(self) -> None:
+        self.db.conn.executemany(
+            "INSERT OR REPLACE INTO undeliverable (user_id, failures, since, retry_at) VALUES (?, ?, ?, ?)",
+            [(uid, r["failures"], r["since"], r["retry_at"]) for uid, r in self.records.items()],
+        )
+
+    def _read_rows(self):
+        self._data_version = self.db.data_version()
+        return self.db.conn.execute("SELECT user_id, failures, since, retry_at FROM undeliverable").fetchall()
+
+    def _reset(self, rows, initial: bool = False) -> None:
+        self.records = {
+            uid: {"failures": failures, "since": since, "retry_at": retry_at}
+            for uid, failures, since, retry_at in rows
+        }
+        if initial:
+            print(f"[undeliverable] SQLite {self.db.path}: личные сообщения недоступны у {len(self.records)} пользователей")
+
+    def mark_failed(self, user_id: int, now: float) -> None:
+        super().mark_failed(user_id, now)
+        self._ops.append(("failed", user_id, now))
+
+    def mark_delivered(self, user_id: int) -> None:
+        if user_id in self.records:
+            self._ops.append(("delivered", user_id))
+        super().mark_delivered(user_id)
+
+    def _apply_ops(self, ops: List[tuple]) -> None:
+        conn = self.db.conn
+        for op, user_id, *args in ops:
+            if op == "delivered":
+                conn.execute("DELETE FROM undeliverable WHERE user_id = ?", (user_id,))
+                continue
+            now = args[0]
+            # в DO UPDATE failures — ещё старое значение: задержка base * 2 ** failures
+            conn.execute(
+                "INSERT INTO undeliverable (user_id, failures, since, retry_at) VALUES (?, 1, ?, ?) "
+                "ON CONFLICT (user_id) DO UPDATE SET failures = failures + 1, "
+                "retry_at = excluded.since + MIN(? * (1 << MIN(failures, 30)), ?)",
+                (user_id, now, now + min(UNDELIVERABLE_RETRY_SECONDS, UNDELIVERABLE_RETRY_MAX_SECONDS),
+                 UNDELIVERABLE_RETRY_SECONDS, UNDELIVERABLE_RETRY_MAX_SECONDS),
+            )
+
+
+def create_notification_state(backend: str = SUBSCRIPTIONS_BACKEND):
+    """
+    Тихие часы и недоставляемые — рядом с подписками: при "sqlite" в общей
+    базе для нескольких процессов, иначе в JSON-файлах одного процесса.
+    """
+    if backend == "sqlite":
+        db = NotificationStateDb(NOTIFICATIONS_DB_FILE)
+        return (
+            SqliteDeferredNotifications(db, DEFERRED_FILE),
+            SqliteUndeliverableRecipients(db, UNDELIVERABLE_FILE),
+        )
+    return DeferredNotifications(DEFERRED_FILE), UndeliverableRecipients(UNDELIVERABLE_FILE)
+
+
+deferred_notifications, undeliverable_recipients = create_notification_state()
+
+
+async def send_direct(user_id: int, now: float, **kwargs) -> bool:
+    """
+    Личное сообщение с учётом реестра недоставляемых.
+    False — не доставлено сейчас или отложено до следующей попытки.
+    """
+    await undeliverable_recipients.open()
+    if undeliverable_recipients.is_blocked(user_id, now):
+        return False
+    try:
+        user = bot.get_user(user_id) or await bot.fetch_user(user_id)
+        await user.send(**kwargs)
+    except (discord.Forbidden, discord.NotFound):
+        undeliverable_recipients.mark_failed(user_id, now)
+        return False
+    undeliverable_recipients.mark_delivered(user_id)
+    return True
 
 # ---------------------------- УТИЛИТЫ ВРЕМЕНИ ----------------------------
 
@@ -166,95 +2570,763 @@ def humanize_time_to_match(utc_iso: str) -> str:
     now_utc = datetime.now(timezone.utc)
     now_msk = now_utc + timedelta(hours=3)
 
-    delta = dt_msk - now_msk
-    total_sec = int(delta.total_seconds())
+    delta = dt_msk - now_msk
+    total_sec = int(delta.total_seconds())
+
+    if total_sec < -3600:
+        return "уже прошёл"
+    if total_sec < 0:
+        return "уже идёт"
+
+    days = total_sec // 86400
+    hours = (total_sec % 86400) // 3600
+    minutes = (total_sec % 3600) // 60
+
+    if days == 0 and hours == 0:
+        return f"через {minutes} минут"
+    if days == 0:
+        return f"через {hours} ч {minutes} мин"
+    if days == 1:
+        return f"через {days} день {hours} ч"
+    if 2 <= days <= 4:
+        return f"через {days} дня {hours} ч"
+    return f"через {days} дней {hours} ч"
+
+# ------------------------- РАБОТА С football-data.org --------------------
+
+def football_headers() -> Dict[str, str]:
+    return {
+        "X-Auth-Token": FOOTBALL_DATA_TOKEN or "",
+        "Accept": "application/json",
+    }
+
+# ---------- КЭШ КОМАНД: ФАЙЛ И ФОНОВОЕ ОБНОВЛЕНИЕ ИЗ API ----------
+
+def intern_team_info(info: Dict[str, Any]) -> Dict[str, Any]:
+    # названия лиг повторяются у десятков команд — держим по одной копии строки
+    return {
+        key: sys.intern(value) if isinstance(value, str) else value
+        for key, value in info.items()
+    }
+
+
+TEAM_NGRAM = 3
+FUZZY_CANDIDATES = 64          # сколько ключей с общими триграммами ранжировать
+FUZZY_MIN_SCORE = 0.5          # доля триграмм запроса, найденных в названии
+FUZZY_COMMON_GRAM_SHARE = 0.05  # триграммы чаще этой доли ключей при отборе пропускаются
+
+
+def key_ngrams(key: str) -> set[str]:
+    return {key[j:j + TEAM_NGRAM] for j in range(len(key) - TEAM_NGRAM + 1)}
+
+
+def team_aliases(cache: Mapping) -> Dict[str, int]:
+    """
+    Псевдоним -> номер записи в порядке кэша; ручные TEAM_ALIASES важнее shortName и tla.
+    """
+    first_by_id: Dict[int, int] = {}
+    aliases: Dict[str, int] = {}
+    for i, info in enumerate(cache.values()):
+        first_by_id.setdefault(info["team_id"], i)
+        for field in ("short_name", "tla"):
+            alias = (info.get(field) or "").lower().strip()
+            if alias:
+                aliases.setdefault(alias, i)
+    for alias, team_id in TEAM_ALIASES.items():
+        if team_id in first_by_id:
+            aliases[alias] = first_by_id[team_id]
+    return aliases
+
+
+class TeamIndex:
+    """
+    Индекс поиска по ключам TEAMS_CACHE: точное совпадение, псевдоним, начало, подстрока
+    по триграммам и поиск с опечатками; ответы как у прежнего перебора.
+    """
+
+    def __init__(self, cache: Dict[str, Dict[str, Any]]):
+        self.cache = cache
+        self.keys: List[str] = list(cache)
+        order = sorted(range(len(self.keys)), key=self.keys.__getitem__)
+        self.sorted_keys: List[str] = [self.keys[i] for i in order]
+        self.sorted_order = array("i", order)
+        self.aliases = team_aliases(cache)
+
+        grams: Dict[str, List[int]] = {}
+        gram_counts = array("i")
+        for i, key in enumerate(self.keys):
+            key_grams = key_ngrams(key)
+            gram_counts.append(len(key_grams))
+            for gram in key_grams:
+                grams.setdefault(gram, []).append(i)
+        self.grams: Dict[str, array] = {gram: array("i", ids) for gram, ids in grams.items()}
+        self.gram_counts = gram_counts
+        self.common_gram_limit = max(FUZZY_CANDIDATES, int(len(self.keys) * FUZZY_COMMON_GRAM_SHARE))
+
+    def _prefix(self, q: str) -> Optional[int]:
+        lo = bisect.bisect_left(self.sorted_keys, q)
+        # все ключи с началом q идут подряд и меньше q + максимальный символ
+        hi = bisect.bisect_left(self.sorted_keys, q + "\U0010ffff", lo)
+        if lo == hi:
+            return None
+        return min(self.sorted_order[lo:hi])
+
+    def _substring(self, q: str) -> Optional[int]:
+        if len(q) < TEAM_NGRAM:
+            return next((i for i, key in enumerate(self.keys) if q in key), None)
+        postings = []
+        for j in range(len(q) - TEAM_NGRAM + 1):
+            ids = self.grams.get(q[j:j + TEAM_NGRAM])
+            if ids is None:
+                return None
+            postings.append(ids)
+        return next((i for i in min(postings, key=len) if q in self.keys[i]), None)
+
+    def fuzzy(self, query: str, limit: int = 1) -> List[tuple[float, Dict[str, Any]]]:
+        """
+        До limit ближайших к запросу команд, лучшие первыми, со степенью
+        сходства 0..1. Пусто, если ничего не похоже.
+        """
+        q_grams = key_ngrams(query.lower().strip())
+        postings = [self.grams[gram] for gram in q_grams if gram in self.grams]
+        if not postings:
+            return []
+        # частые триграммы ("fc ", " cl") почти ничего не отсеивают, а считать их дорого
+        rare = [ids for ids in postings if len(ids) <= self.common_gram_limit]
+        shared: Counter = Counter()
+        for ids in rare or postings:
+            shared.update(ids)
+
+        ranked = []
+        for i, _ in shared.most_common(FUZZY_CANDIDATES):
+            # точный счёт с учётом частых триграмм — только для отобранных
+            common = sum(1 for gram in q_grams if gram in self.keys[i])
+            score = common / len(q_grams)
+            if score < FUZZY_MIN_SCORE:
+                continue
+            dice = 2 * common / (len(q_grams) + self.gram_counts[i])
+            ranked.append((score, dice, -i))
+        ranked.sort(reverse=True)
+        return [(score, self.cache[self.keys[-neg_i]]) for score, _, neg_i in ranked[:limit]]
+
+    def alias(self, query: str) -> Optional[Dict[str, Any]]:
+        i = self.aliases.get(query.lower().strip())
+        return self.cache[self.keys[i]] if i is not None else None
+
+    def lookup(self, query: str, fuzzy: bool = True, aliases: bool = True) -> Optional[Dict[str, Any]]:
+        q = query.lower().strip()
+        info = self.cache.get(q)
+        if info is not None:
+            return info
+        i = self.aliases.get(q) if aliases else None
+        if i is None:
+            i = self._prefix(q)
+        if i is None:
+            i = self._substring(q)
+        if i is not None:
+            return self.cache[self.keys[i]]
+        if not fuzzy:
+            return None
+        best = self.fuzzy(q)
+        return best[0][1] if best else None
+
+
+class TeamAutocomplete:
+    """
+    Подсказки для /live: короткие запросы посчитаны заранее, длинные — по
+    триграммам названий с LRU последних запросов.
+    """
+
+    def __init__(self, cache: Dict[str, Dict[str, Any]], index: Optional[TeamIndex] = None):
+        self.index = index
+        self.names: List[str] = []
+        self.lower: List[str] = []
+        self.choices: List[app_commands.Choice[str]] = []
+        self.by_name: Dict[str, int] = {}
+        for info in cache.values():
+            name = info["team_name"]
+            if name in self.by_name:
+                continue
+            self.by_name[name] = len(self.names)
+            self.names.append(name)
+            self.lower.append(name.lower())
+            self.choices.append(app_commands.Choice(name=name, value=name))
+
+        grams: Dict[str, List[int]] = {}
+        for i, lname in enumerate(self.lower):
+            for gram in key_ngrams(lname):
+                grams.setdefault(gram, []).append(i)
+        self.grams: Dict[str, array] = {gram: array("i", ids) for gram, ids in grams.items()}
+
+        short: Dict[str, List[int]] = {}
+        for i, lname in enumerate(self.lower):
+            fragments = {
+                lname[j:j + n]
+                for n in range(1, AUTOCOMPLETE_PRECOMPUTED_LEN + 1)
+                for j in range(len(lname) - n + 1)
+            }
+            for fragment in fragments:
+                short.setdefault(fragment, []).append(i)
+        self.precomputed: Dict[str, List[app_commands.Choice[str]]] = {
+            fragment: self._ranked(fragment, ids) for fragment, ids in short.items()
+        }
+        self.precomputed[""] = self.choices[:AUTOCOMPLETE_CHOICES]
+        self.recent: Dict[str, List[app_commands.Choice[str]]] = {}
+
+    def _rank(self, q: str, i: int) -> tuple[int, int]:
+        lname = self.lower[i]
+        if lname.startswith(q):
+            return 0, i
+        if f" {q}" in lname:
+            return 1, i
+        return 2, i
+
+    def _ranked(self, q: str, ids: Iterable[int]) -> List[app_commands.Choice[str]]:
+        best = heapq.nsmallest(AUTOCOMPLETE_CHOICES, (self._rank(q, i) for i in ids))
+        return [self.choices[i] for _, i in best]
+
+    def _compute(self, q: str) -> List[app_commands.Choice[str]]:
+        # точный псевдоним ("spurs", "psg") — первым в списке
+        aliased = self.index.alias(q) if self.index is not None else None
+        first = self.by_name.get(aliased["team_name"]) if aliased else None
+
+        postings = [self.grams.get(gram) for gram in key_ngrams(q)]
+        matched: List[int] = []
+        if all(ids is not None for ids in postings):
+            matched = [i for i in min(postings, key=len) if q in self.lower[i] and i != first]
+        if first is not None:
+            return [self.choices[first]] + self._ranked(q, matched)[:AUTOCOMPLETE_CHOICES - 1]
+        if matched:
+            return self._ranked(q, matched)
+        # с опечаткой подстрока не находится — подсказываем похожие названия
+        if self.index is None:
+            return []
+        seen: set[int] = set()
+        result = []
+        for _, info in self.index.fuzzy(q, limit=AUTOCOMPLETE_CHOICES):
+            i = self.by_name.get(info["team_name"])
+            if i is not None and i not in seen:
+                seen.add(i)
+                result.append(self.choices[i])
+        return result
+
+    def complete(self, current: str) -> List[app_commands.Choice[str]]:
+        q = " ".join(current.lower().split())
+        choices = self.precomputed.get(q)
+        if choices is not None:
+            return choices
+        if len(q) <= AUTOCOMPLETE_PRECOMPUTED_LEN:
+            return []
+
+        choices = self.recent.pop(q, None)
+        if choices is None:
+            choices = self._compute(q)
+            if len(self.recent) >= AUTOCOMPLETE_LRU_SIZE:
+                del self.recent[next(iter(self.recent))]
+        # вставка в конец — словарь хранит порядок от давних к недавним
+        self.recent[q] = choices
+        return choices
+
+
+def fixture_team_name(team: Dict[str, Any]) -> str:
+    """
+    Название команды из матча API — такое же, как в /live-list и
+    подсказках, если команда есть в кэше.
+    """
+    team_id = team.get("id")
+    info = TEAMS_BY_ID.get(team_id) if team_id is not None else None
+    return info["team_name"] if info else team.get("name", "?")
+
+
+def team_display(team_id: int) -> tuple[str, str]:
+    """
+    Название команды и лиги по team_id; подписки хранят только id.
+    """
+    if is_competition_key(team_id):
+        code = competition_code(team_id)
+        return COMPETITIONS_TRACKED.get(code, f"Турнир {-team_id}"), "весь турнир"
+    info = TEAMS_BY_ID.get(team_id)
+    if info is None:
+        return f"Team {team_id}", "—"
+    return info["team_name"], info["league_name"]
+
+
+# Двоичный каталог команд: заголовок, записи фиксированной ширины, номера
+# записей по возрастанию ключа, пары (team_id, запись) по возрастанию id и
+# таблица строк UTF-8, в конце — служебные поля teams_cache.json в JSON.
+# Все смещения — от начала файла, разделы выровнены по 8.
+CATALOG_MAGIC = b"LZTC"
+CATALOG_VERSION = 2
+# magic, версия, число записей, разных team_id и псевдонимов, размер и mtime_ns
+# teams_cache.json, смещения разделов, длина служебных полей
+CATALOG_HEADER = struct.Struct("<4sIIIIqqIIIIIII")
+# team_id, затем (смещение, длина) ключа, названия, кода лиги, названия лиги,
+# короткого названия и трёхбуквенного кода
+CATALOG_RECORD = struct.Struct("<i" + "II" * 6)
+CATALOG_FIELDS = ("key", "team_name", "league_code", "league_name", "short_name", "tla")
+# (смещение, длина) псевдонима и номер записи, по возрастанию псевдонима
+CATALOG_ALIAS = struct.Struct("<III")
+
+
+def _aligned(size: int) -> int:
+    return (size + 7) & ~7
+
+
+def compile_team_catalog(source: Path = TEAMS_CACHE_FILE, target: Path = TEAMS_CATALOG_FILE) -> int:
+    """
+    Собирает teams_cache.bin из teams_cache.json, возвращает число команд.
+    Размер и время изменения исходника в заголовке отсекают устаревший каталог.
+    """
+    stat = source.stat()
+    data = read_json_file(source)
+    teams = data.get("teams", {})
+    meta = json.dumps({key: value for key, value in data.items() if key != "teams"}).encode("utf-8")
+    keys = list(teams)
+    n = len(keys)
+
+    strings = bytearray()
+    offsets: Dict[str, tuple[int, int]] = {}
+
+    def ref(value: str) -> tuple[int, int]:
+        # одинаковые строки в таблице не повторяются, записи ссылаются на одну копию
+        if value not in offsets:
+            encoded = value.encode("utf-8")
+            offsets[value] = (len(strings), len(encoded))
+            strings.extend(encoded)
+        return offsets[value]
+
+    records = bytearray()
+    for key in keys:
+        info = teams[key]
+        fields = [ref(key)] + [ref(info.get(name) or "") for name in CATALOG_FIELDS[1:]]
+        records += CATALOG_RECORD.pack(info["team_id"], *(x for pair in fields for x in pair))
+
+    aliases = bytearray()
+    alias_map = team_aliases(teams)
+    for alias in sorted(alias_map, key=lambda a: a.encode("utf-8")):
+        aliases += CATALOG_ALIAS.pack(*ref(alias), alias_map[alias])
+
+    key_order = array("I", sorted(range(n), key=keys.__getitem__))
+    first_by_id: Dict[int, int] = {}
+    for i, key in enumerate(keys):
+        first_by_id.setdefault(teams[key]["team_id"], i)
+    ids = sorted(first_by_id)
+    id_values = array("i", ids)
+    id_records = array("I", (first_by_id[tid] for tid in ids))
+
+    records_off = _aligned(CATALOG_HEADER.size)
+    keys_off = _aligned(records_off + len(records))
+    ids_off = _aligned(keys_off + 4 * n)
+    id_records_off = _aligned(ids_off + 4 * len(ids))
+    aliases_off = _aligned(id_records_off + 4 * len(ids))
+    strings_off = _aligned(aliases_off + len(aliases))
+    meta_off = strings_off + len(strings)
+    header = CATALOG_HEADER.pack(
+        CATALOG_MAGIC, CATALOG_VERSION, n, len(ids), len(alias_map), stat.st_size, stat.st_mtime_ns,
+        records_off, keys_off, ids_off, id_records_off, aliases_off, strings_off, len(meta),
+    )
+    # разделы массивов пишутся в порядке байтов машины; собирается каталог там же, где читается
+    out = bytearray(meta_off + len(meta))
+    for offset, chunk in (
+        (0, header),
+        (records_off, records),
+        (keys_off, key_order.tobytes()),
+        (ids_off, id_values.tobytes()),
+        (id_records_off, id_records.tobytes()),
+        (aliases_off, aliases),
+        (strings_off, strings),
+        (meta_off, meta),
+    ):
+        out[offset:offset + len(chunk)] = chunk
+
+    tmp_path = target.with_name(target.name + ".tmp")
+    tmp_path.write_bytes(out)
+    os.replace(tmp_path, target)
+    return n
+
+
+class MappedTeamCatalog(Mapping):
+    """
+    Каталог команд из teams_cache.bin через mmap, записи раскодируются при обращении.
+    Без TeamIndex умеет точный поиск, псевдонимы и начало, подстроку ищет перебором.
+    """
+
+    def __init__(self, path: Path):
+        with path.open("rb") as f:
+            self.map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        (
+            magic, version, self.count, id_count, self.alias_count, self.source_size, self.source_mtime_ns,
+            self.records_off, keys_off, ids_off, id_records_off, self.aliases_off, self.strings_off, meta_len,
+        ) = CATALOG_HEADER.unpack_from(self.map, 0)
+        if magic != CATALOG_MAGIC or version != CATALOG_VERSION:
+            self.map.close()
+            raise ValueError(f"{path}: не каталог команд версии {CATALOG_VERSION}")
+        view = memoryview(self.map)
+        self.key_order = view[keys_off:keys_off + 4 * self.count].cast("I")
+        self.ids = view[ids_off:ids_off + 4 * id_count].cast("i")
+        self.id_records = view[id_records_off:id_records_off + 4 * id_count].cast("I")
+        meta_off = len(self.map) - meta_len
+        self.meta: Dict[str, Any] = json.loads(self.map[meta_off:]) if meta_len else {}
+        self.by_id = MappedTeamsById(self)
+
+    def is_fresh(self, source: Path) -> bool:
+        try:
+            stat = source.stat()
+        except FileNotFoundError:
+            return True
+        return (stat.st_size, stat.st_mtime_ns) == (self.source_size, self.source_mtime_ns)
+
+    def _fields(self, i: int) -> tuple:
+        return CATALOG_RECORD.unpack_from(self.map, self.records_off + i * CATALOG_RECORD.size)
+
+    def _bytes(self, offset: int, length: int) -> bytes:
+        start = self.strings_off + offset
+        return self.map[start:start + length]
+
+    def _key_bytes(self, i: int) -> bytes:
+        fields = self._fields(i)
+        return self._bytes(fields[1], fields[2])
+
+    def record(self, i: int) -> Dict[str, Any]:
+        fields = self._fields(i)
+        info: Dict[str, Any] = {"team_id": fields[0]}
+        for n, name in enumerate(CATALOG_FIELDS[1:], 1):
+            value = self._bytes(fields[1 + 2 * n], fields[2 + 2 * n]).decode("utf-8")
+            # short_name и tla есть не у всех команд: пустые не возвращаем, как в JSON
+            if value or name not in ("short_name", "tla"):
+                info[name] = value
+        return info
+
+    def alias(self, query: str) -> Optional[Dict[str, Any]]:
+        q = query.lower().strip().encode("utf-8")
+        lo, hi = 0, self.alias_count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            offset, length, record = CATALOG_ALIAS.unpack_from(self.map, self.aliases_off + mid * CATALOG_ALIAS.size)
+            alias = self._bytes(offset, length)
+            if alias == q:
+                return self.record(record)
+            if alias < q:
+                lo = mid + 1
+            else:
+                hi = mid
+        return None
+
+    def _bisect(self, q: bytes) -> int:
+        # порядок байтов UTF-8 совпадает с порядком строк Python
+        lo, hi = 0, self.count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self._key_bytes(self.key_order[mid]) < q:
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo
+
+    def __getitem__(self, key: str) -> Dict[str, Any]:
+        q = key.encode("utf-8")
+        pos = self._bisect(q)
+        if pos < self.count and self._key_bytes(self.key_order[pos]) == q:
+            return self.record(self.key_order[pos])
+        raise KeyError(key)
+
+    def __iter__(self):
+        for i in range(self.count):
+            yield self._key_bytes(i).decode("utf-8")
+
+    def __len__(self) -> int:
+        return self.count
+
+    def lookup(self, query: str, fuzzy: bool = True, aliases: bool = True) -> Optional[Dict[str, Any]]:
+        q = query.lower().strip()
+        lo = self._bisect(q.encode("utf-8"))
+        hi = self._bisect((q + "\U0010ffff").encode("utf-8"))
+        if lo < self.count and self._key_bytes(self.key_order[lo]) == q.encode("utf-8"):
+            return self.record(self.key_order[lo])
+        info = self.alias(q) if aliases else None
+        if info is not None:
+            return info
+        if lo < hi:
+            return self.record(min(self.key_order[lo:hi]))
+        for i, key in enumerate(self):
+            if q in key:
+                return self.record(i)
+        return None
+
+
+class MappedTeamsById(Mapping):
+    """
+    team_id -> запись каталога, двоичным поиском по отсортированным id.
+    Выбывшие из турниров команды лежат в служебных полях каталога.
+    """
+
+    def __init__(self, catalog: MappedTeamCatalog):
+        self.catalog = catalog
+        self.retired: Dict[int, Dict[str, Any]] = {
+            int(team_id): info for team_id, info in catalog.meta.get("_retired", {}).items()
+        }
+
+    def __getitem__(self, team_id: int) -> Dict[str, Any]:
+        ids = self.catalog.ids
+        pos = bisect.bisect_left(ids, team_id)
+        if pos < len(ids) and ids[pos] == team_id:
+            return self.catalog.record(self.catalog.id_records[pos])
+        return self.retired[team_id]
+
+    def __iter__(self):
+        return itertools.chain(self.catalog.ids.tolist(), self.retired)
+
+    def __len__(self) -> int:
+        return len(self.catalog.ids) + len(self.retired)
+
+
+def try_compile_team_catalog() -> None:
+    try:
+        compile_team_catalog()
+    except OSError as e:
+        # в Windows открытый другим процессом каталог не заменить; он устареет и не откроется
+        print(f"[teams_cache] Каталог {TEAMS_CATALOG_FILE} не пересобран: {e}")
+
+
+def open_team_catalog(path: Path = TEAMS_CATALOG_FILE, source: Path = TEAMS_CACHE_FILE) -> Optional[MappedTeamCatalog]:
+    if not path.exists():
+        return None
+    try:
+        catalog = MappedTeamCatalog(path)
+    except (ValueError, struct.error, OSError) as e:
+        print(f"[teams_cache] Каталог {path} не читается: {e}")
+        return None
+    if not catalog.is_fresh(source):
+        print(f"[teams_cache] Каталог {path} старше {source}, читаем JSON.")
+        return None
+    return catalog
+
+
+TeamCatalog = tuple[
+    Mapping, Mapping, "TeamIndex", Optional["TeamAutocomplete"]
+]
+
+
+def build_team_catalog(teams: Mapping, retired: Optional[Mapping] = None) -> TeamCatalog:
+    """
+    Кэш команд со всеми индексами, строится в рабочем потоке. retired — выбывшие
+    из турниров команды: в поиск не попадают, но находятся по team_id.
+    """
+    cache = {key: intern_team_info(info) for key, info in teams.items()}
+    by_id: Dict[int, Dict[str, Any]] = {}
+    for info in cache.values():
+        by_id.setdefault(info["team_id"], info)
+    for team_id, info in (retired or {}).items():
+        by_id.setdefault(int(team_id), intern_team_info(info))
+    index = TeamIndex(cache)
+    return cache, by_id, index, TeamAutocomplete(cache, index)
 
-    if total_sec < -3600:
-        return "уже прошёл"
-    if total_sec < 0:
-        return "уже идёт"
 
-    days = total_sec // 86400
-    hours = (total_sec % 86400) // 3600
-    minutes = (total_sec % 3600) // 60
+def install_team_catalog(catalog: TeamCatalog) -> None:
+    # без await между присваиваниями: команды видят либо старый кэш, либо новый целиком
+    global TEAMS_CACHE, TEAMS_BY_ID, TEAMS_INDEX, TEAMS_AUTOCOMPLETE
+    TEAMS_CACHE, TEAMS_BY_ID, TEAMS_INDEX, TEAMS_AUTOCOMPLETE = catalog
 
-    if days == 0 and hours == 0:
-        return f"через {minutes} минут"
-    if days == 0:
-        return f"через {hours} ч {minutes} мин"
-    if days == 1:
-        return f"через {days} день {hours} ч"
-    if 2 <= days <= 4:
-        return f"через {days} дня {hours} ч"
-    return f"через {days} дней {hours} ч"
 
-# ------------------------- РАБОТА С football-data.org --------------------
+def parse_cache_timestamp(value: Any) -> Optional[datetime]:
+    try:
+        return datetime.fromisoformat(value)
+    except (TypeError, ValueError):
+        return None
 
-def football_headers() -> Dict[str, str]:
-    return {
-        "X-Auth-Token": FOOTBALL_DATA_TOKEN or "",
-        "Accept": "application/json",
-    }
 
-# ---------- КЭШ КОМАНД В ФАЙЛЕ (ТОЛЬКО ИЗ ФАЙЛА) ----------
+async def build_search_indexes(catalog: MappedTeamCatalog) -> None:
+    index = await asyncio.to_thread(TeamIndex, catalog)
+    autocomplete = await asyncio.to_thread(TeamAutocomplete, catalog, index)
+    # пока строили, кэш мог смениться обновлением из API
+    if TEAMS_CACHE is catalog:
+        install_team_catalog((catalog, catalog.by_id, index, autocomplete))
+        print("[teams_cache] Индексы поиска по каталогу построены")
+
 
 async def build_teams_cache(session: aiohttp.ClientSession):
-    global TEAMS_CACHE, TEAMS_CACHE_BUILT
+    global TEAMS_CACHE_SOURCES, TEAMS_CACHE_UPDATED, TEAMS_CACHE_BUILT
 
     if TEAMS_CACHE_BUILT:
         return
 
-    if not TEAMS_CACHE_FILE.exists():
-        print("[teams_cache] Файл teams_cache.json не найден.")
+    # свежий двоичный каталог открывается сразу, JSON не разбирается
+    catalog = await asyncio.to_thread(open_team_catalog)
+    if catalog is not None:
+        install_team_catalog((catalog, catalog.by_id, catalog, None))
+        TEAMS_CACHE_BUILT = True
+        print(f"[teams_cache] Открыт каталог {TEAMS_CATALOG_FILE}: {len(catalog)} команд")
+        TEAMS_CACHE_SOURCES = catalog.meta.get("_sources", {})
+        TEAMS_CACHE_UPDATED = parse_cache_timestamp(catalog.meta.get("_timestamp"))
+        asyncio.create_task(build_search_indexes(catalog))
+        return
+
+    if not await asyncio.to_thread(TEAMS_CACHE_FILE.exists):
+        print("[teams_cache] Файл teams_cache.json не найден, ждём обновления из API.")
         return
 
     try:
-        with TEAMS_CACHE_FILE.open("r", encoding="utf-8") as f:
-            data = json.load(f)
+        # разбор большого JSON — в рабочем потоке, чтобы не держать event loop
+        data = await asyncio.to_thread(read_json_file, TEAMS_CACHE_FILE)
         teams = data.get("teams", {})
         if not teams:
             print("[teams_cache] В файле teams_cache.json нет команд.")
             return
-        TEAMS_CACHE = teams
+        install_team_catalog(await asyncio.to_thread(build_team_catalog, teams, data.get("_retired")))
+        TEAMS_CACHE_SOURCES = data.get("_sources", {})
+        TEAMS_CACHE_UPDATED = parse_cache_timestamp(data.get("_timestamp"))
         TEAMS_CACHE_BUILT = True
         print(f"[teams_cache] Загружен локальный кэш команд: {len(TEAMS_CACHE)}")
     except Exception as e:
         print(f"[teams_cache] Ошибка чтения локального кэша: {e}")
+        return
+
+    # в следующий раз — сразу из каталога
+    await asyncio.to_thread(try_compile_team_catalog)
+
+
+async def fetch_competition_teams(
+    session: aiohttp.ClientSession,
+    code: str,
+    source: Dict[str, Any],
+) -> Optional[tuple[List[Dict[str, Any]], Dict[str, Any]]]:
+    """
+    /v4/competitions/{code}/teams с условным запросом. None — состав
+    не менялся (304) или API не ответил: остаются прежние команды.
+    """
+    headers = football_headers()
+    if source.get("etag"):
+        headers["If-None-Match"] = source["etag"]
+    if source.get("last_modified"):
+        headers["If-Modified-Since"] = source["last_modified"]
+
+    url = f"{FOOTBALL_DATA_BASE}/competitions/{code}/teams"
+    async with session.get(url, headers=headers) as resp:
+        if resp.status == 304:
+            return None
+        try:
+            data = await resp.json()
+        except Exception:
+            data = {}
+        if resp.status != 200:
+            print(f"[teams_cache] Ошибка {resp.status} для турнира {code}: {data}")
+            return None
+        new_source = {
+            "etag": resp.headers.get("ETag"),
+            "last_modified": resp.headers.get("Last-Modified"),
+        }
+
+    league_name = (data.get("competition") or {}).get("name") or COMPETITIONS_TRACKED[code]
+    teams = [
+        {
+            "team_id": team["id"],
+            "team_name": team["name"],
+            "short_name": team.get("shortName") or "",
+            "tla": team.get("tla") or "",
+            "league_code": code,
+            "league_name": league_name,
+        }
+        for team in data.get("teams", [])
+        if team.get("id") and team.get("name")
+    ]
+    new_source["team_ids"] = [team["team_id"] for team in teams]
+    return teams, new_source
+
+
+def retired_teams(old_by_id: Mapping, teams: Dict[str, Dict[str, Any]]) -> Dict[str, Dict[str, Any]]:
+    current = {info["team_id"] for info in teams.values()}
+    return {str(tid): dict(info) for tid, info in old_by_id.items() if tid not in current}
+
+
+def write_teams_cache(
+    teams: Dict[str, Dict[str, Any]],
+    sources: Dict[str, Dict[str, Any]],
+    retired: Dict[str, Dict[str, Any]],
+    updated: datetime,
+) -> None:
+    data = {"_timestamp": updated.isoformat(), "teams": teams, "_sources": sources, "_retired": retired}
+    tmp_path = TEAMS_CACHE_FILE.with_name(TEAMS_CACHE_FILE.name + ".tmp")
+    with tmp_path.open("w", encoding="utf-8") as f:
+        json.dump(data, f, ensure_ascii=False, indent=2)
+    os.replace(tmp_path, TEAMS_CACHE_FILE)
+    try_compile_team_catalog()
+
+
+async def refresh_teams_cache(session: aiohttp.ClientSession) -> bool:
+    """
+    Сверяет составы турниров из COMPETITIONS_TRACKED с API и при изменениях подменяет
+    кэш и индексы; не ответившие и не изменившиеся турниры берутся из текущего кэша.
+    """
+    global TEAMS_CACHE_SOURCES, TEAMS_CACHE_UPDATED, TEAMS_CACHE_BUILT
+
+    sources = dict(TEAMS_CACHE_SOURCES)
+    fetched: Dict[str, List[Dict[str, Any]]] = {}
+    for i, code in enumerate(COMPETITIONS_TRACKED):
+        if i:
+            await asyncio.sleep(TEAMS_REFRESH_REQUEST_GAP_SECONDS)
+        result = await fetch_competition_teams(session, code, sources.get(code, {}))
+        if result is not None:
+            fetched[code], sources[code] = result
+
+    updated = datetime.now()
+    if not fetched:
+        TEAMS_CACHE_UPDATED = updated
+        print("[teams_cache] Составы турниров не изменились.")
+        return False
+
+    old_cache, old_by_id = TEAMS_CACHE, TEAMS_BY_ID
+    teams: Dict[str, Dict[str, Any]] = {}
+    for code in COMPETITIONS_TRACKED:
+        if code in fetched:
+            infos = fetched[code]
+        elif "team_ids" in sources.get(code, {}):
+            infos = [old_by_id[tid] for tid in sources[code]["team_ids"] if tid in old_by_id]
+        else:
+            infos = [info for info in old_cache.values() if info.get("league_code") == code]
+        for info in infos:
+            teams.setdefault(info["team_name"].lower(), info)
+
+    # выбывшие команды остаются в индексе по id, прежние выбывшие — тоже
+    retired = await asyncio.to_thread(retired_teams, old_by_id, teams)
+    catalog = await asyncio.to_thread(build_team_catalog, teams, retired)
+    install_team_catalog(catalog)
+    TEAMS_CACHE_SOURCES = sources
+    TEAMS_CACHE_UPDATED = updated
+    TEAMS_CACHE_BUILT = True
+    await asyncio.to_thread(write_teams_cache, catalog[0], sources, retired, updated)
+    print(
+        f"[teams_cache] Обновлены турниры: {', '.join(fetched)}; "
+        f"команд было {len(old_cache)}, стало {len(catalog[0])}"
+    )
+    return True
 
 
 async def search_team(session: aiohttp.ClientSession, query: str) -> Optional[Dict[str, Any]]:
-    if not TEAMS_CACHE:
+    if TEAMS_INDEX is None:
         print("[search_team] TEAMS_CACHE пуст — кэш команд не загружен.")
         return None
 
-    q = query.lower().strip()
-
-    if q in TEAMS_CACHE:
-        return TEAMS_CACHE[q]
-
-    for key, info in TEAMS_CACHE.items():
-        if key.startswith(q):
-            return info
+    return TEAMS_INDEX.lookup(query)
 
-    for key, info in TEAMS_CACHE.items():
-        if q in key:
-            return info
 
-    return None
+def search_teams(queries: List[str]) -> List[Optional[Dict[str, Any]]]:
+    """
+    search_team для нескольких запросов сразу, по индексу TEAMS_INDEX.
+    """
+    if TEAMS_INDEX is None:
+        return [None] * len(queries)
+    return [TEAMS_INDEX.lookup(q) if q.strip() else None for q in queries]
 
 # ---------- ЗАПРОСЫ ПО КОМАНДАМ ----------
 
-async def fetch_team_matches(
+async def fetch_matches(
     session: aiohttp.ClientSession,
-    team_id: int,
+    url: str,
+    label: str,
     status: Optional[str] = None,
     date_from: Optional[str] = None,
     date_to: Optional[str] = None,
 ) -> List[Dict[str, Any]]:
-    """
-    /v4/teams/{id}/matches — матчи конкретной команды. [web:51][web:81]
-    """
-    url = f"{FOOTBALL_DATA_BASE}/teams/{team_id}/matches"
     params: Dict[str, str] = {}
     if status:
         params["status"] = status
@@ -270,17 +3342,63 @@ async def fetch_team_matches(
             data = {}
 
     if resp.status == 429:
-        print(f"[team_matches] 429 для team_id={team_id}: {data}")
+        print(f"[matches] 429 для {label}: {data}")
         return []
     if resp.status == 403:
-        print(f"[team_matches] 403 (нет доступа) для team_id={team_id}: {data}")
+        print(f"[matches] 403 (нет доступа) для {label}: {data}")
         return []
     if resp.status != 200:
-        print(f"[team_matches] Ошибка {resp.status} для team_id={team_id}: {data}")
+        print(f"[matches] Ошибка {resp.status} для {label}: {data}")
         return []
 
     return data.get("matches", [])
 
+
+async def fetch_team_matches(
+    session: aiohttp.ClientSession,
+    team_id: int,
+    status: Optional[str] = None,
+    date_from: Optional[str] = None,
+    date_to: Optional[str] = None,
+) -> List[Dict[str, Any]]:
+    """
+    /v4/teams/{id}/matches — матчи конкретной команды. [web:51][web:81]
+    """
+    url = f"{FOOTBALL_DATA_BASE}/teams/{team_id}/matches"
+    return await fetch_matches(session, url, f"team_id={team_id}", status, date_from, date_to)
+
+
+async def fetch_competition_matches(
+    session: aiohttp.ClientSession,
+    code: str,
+    status: Optional[str] = None,
+    date_from: Optional[str] = None,
+    date_to: Optional[str] = None,
+) -> List[Dict[str, Any]]:
+    """
+    /v4/competitions/{code}/matches — все матчи турнира одним запросом.
+    """
+    url = f"{FOOTBALL_DATA_BASE}/competitions/{code}/matches"
+    return await fetch_matches(session, url, f"турнира {code}", status, date_from, date_to)
+
+
+async def fetch_subscription_matches(
+    session: aiohttp.ClientSession,
+    team_id: int,
+    status: Optional[str] = None,
+    date_from: Optional[str] = None,
+    date_to: Optional[str] = None,
+) -> List[Dict[str, Any]]:
+    """
+    Матчи по ключу подписки: команды или турнира целиком.
+    """
+    if is_competition_key(team_id):
+        code = competition_code(team_id)
+        if code is None:
+            return []
+        return await fetch_competition_matches(session, code, status, date_from, date_to)
+    return await fetch_team_matches(session, team_id, status, date_from, date_to)
+
 # ---------- LIVE-МАТЧИ ПО ПОДПИСАННЫМ КОМАНДАМ ----------
 
 async def fetch_live_fixtures(session: aiohttp.ClientSession) -> List[Dict[str, Any]]:
@@ -292,7 +3410,7 @@ async def fetch_live_fixtures(session: aiohttp.ClientSession) -> List[Dict[str,
     if time.time() - live_cache.get("timestamp", 0) <= LIVE_CACHE_TTL_SECONDS and live_cache.get("fixtures"):
         return live_cache["fixtures"]
 
-    subscribed_team_ids = get_all_subscribed_team_ids()
+    subscribed_team_ids = await get_all_subscribed_team_ids()
     if not subscribed_team_ids:
         print("[live_fixtures] Нет подписанных команд — live не опрашиваем.")
         live_cache = {"timestamp": time.time(), "fixtures": []}
@@ -304,8 +3422,9 @@ async def fetch_live_fixtures(session: aiohttp.ClientSession) -> List[Dict[str,
     date_from = (today - timedelta(days=1)).isoformat()
     date_to = (today + timedelta(days=1)).isoformat()
 
+    # на турнир — один запрос, а не по запросу на каждую его команду
     for team_id in subscribed_team_ids:
-        matches = await fetch_team_matches(
+        matches = await fetch_subscription_matches(
             session,
             team_id=team_id,
             status="LIVE,IN_PLAY,PAUSED,FINISHED",
@@ -356,7 +3475,7 @@ async def fetch_upcoming_for_user(
     result: Dict[int, List[Dict[str, Any]]] = {}
 
     for tid in user_team_ids:
-        matches = await fetch_team_matches(
+        matches = await fetch_subscription_matches(
             session,
             team_id=tid,
             status="SCHEDULED,TIMED",
@@ -375,25 +3494,27 @@ async def fetch_upcoming_for_user(
 
 # ----------------------------- ВОЙС И ЗВУК -------------------------------
 
-async def ensure_voice_connected():
+async def ensure_voice_connected(guild_id: int):
     await bot.wait_until_ready()
-    guild = bot.get_guild(GUILD_ID)
-    if not guild:
+    guild = bot.get_guild(guild_id)
+    config = GUILDS.get(guild_id)
+    if not guild or not config:
         return
 
-    channel = guild.get_channel(VOICE_CHANNEL_ID)
+    voice_channel_id = config["voice_channel_id"]
+    channel = guild.get_channel(voice_channel_id)
     if not isinstance(channel, discord.VoiceChannel):
         return
 
     if guild.voice_client is None or not guild.voice_client.is_connected():
         await channel.connect()
-    elif guild.voice_client.channel.id != VOICE_CHANNEL_ID:
+    elif guild.voice_client.channel.id != voice_channel_id:
         await guild.voice_client.move_to(channel)
 
 
-async def play_sound(kind: str):
-    await ensure_voice_connected()
-    guild = bot.get_guild(GUILD_ID)
+async def play_sound(kind: str, guild_id: int):
+    await ensure_voice_connected(guild_id)
+    guild = bot.get_guild(guild_id)
     if not guild or guild.voice_client is None:
         return
 
@@ -413,9 +3534,13 @@ async def on_voice_state_update(member: discord.Member, before: discord.VoiceSta
     if member.id != bot.user.id:
         return
 
-    if after.channel is None or (after.channel and after.channel.id != VOICE_CHANNEL_ID):
+    config = GUILDS.get(member.guild.id)
+    if config is None:
+        return
+
+    if after.channel is None or (after.channel and after.channel.id != config["voice_channel_id"]):
         await asyncio.sleep(1)
-        await ensure_voice_connected()
+        await ensure_voice_connected(member.guild.id)
 
 # --------- ДЕКОРАТОР ДЛЯ ОГРАНИЧЕНИЯ КОМАНД ПО КАНАЛУ ---------
 
@@ -427,46 +3552,64 @@ def only_in_allowed_channel():
                 ephemeral=True
             )
             return False
-        if interaction.channel_id != TEXT_CHANNEL_ID:
+        config = GUILDS.get(interaction.guild_id)
+        if config is None:
+            await interaction.response.send_message(
+                "Бот не настроен для работы на этом сервере.",
+                ephemeral=True
+            )
+            return False
+        if interaction.channel_id != config["text_channel_id"]:
             await interaction.response.send_message(
                 "Эти команды разрешено использовать только в указанном служебном канале.",
                 ephemeral=True
             )
             return False
+        # любая команда продлевает подписки пользователя на этом сервере;
+        # отметка пишется в фоне, ответ на команду её не ждёт
+        asyncio.create_task(touch_user(interaction.guild_id, interaction.user.id))
         return True
     return app_commands.check(predicate)
 
+
+async def touch_user(guild_id: int, user_id: int) -> None:
+    try:
+        await guild_subscriptions.store(guild_id).touch(user_id)
+    except Exception as e:
+        print(f"[subscriptions] Не удалось отметить активность {user_id}: {e}")
+
 # -------------------------- AUTOCOMPLETE ДЛЯ /live -----------------------
 
 async def team_autocomplete(
     interaction: discord.Interaction,
     current: str
 ) -> List[app_commands.Choice[str]]:
-    choices: List[app_commands.Choice[str]] = []
+    if TEAMS_AUTOCOMPLETE is None:
+        return []
+    return TEAMS_AUTOCOMPLETE.complete(current)
 
-    if not TEAMS_CACHE:
-        return choices
+def split_team_list(value: str) -> List[str]:
+    return [token.strip() for token in value.split(",") if token.strip()]
 
-    names_seen = set()
-    q = current.lower().strip()
 
-    for info in TEAMS_CACHE.values():
-        name = info["team_name"]
-        lname = name.lower()
-        if q and q not in lname:
-            continue
-        if name in names_seen:
+async def team_list_autocomplete(
+    interaction: discord.Interaction,
+    current: str
+) -> List[app_commands.Choice[str]]:
+    """
+    Подсказки для списка через запятую: дополняется последнее название,
+    уже введённые остаются как есть.
+    """
+    head, _, last = current.rpartition(",")
+    done = split_team_list(head)
+    prefix = ", ".join(done + [""]) if done else ""
+    choices: List[app_commands.Choice[str]] = []
+    for choice in await team_autocomplete(interaction, last):
+        value = prefix + choice.value
+        # у Discord подсказка не длиннее 100 символов
+        if len(value) > 100:
             continue
-        names_seen.add(name)
-        choices.append(app_commands.Choice(name=name, value=name))
-        if len(choices) >= 25:
-            break
-
-    if not q and not choices:
-        for info in list(TEAMS_CACHE.values())[:25]:
-            name = info["team_name"]
-            choices.append(app_commands.Choice(name=name, value=name))
-
+        choices.append(app_commands.Choice(name=value, value=value))
     return choices
 
 # ------------------------------- КОМАНДЫ -------------------------------
@@ -474,7 +3617,7 @@ async def team_autocomplete(
 @tree.command(name="help", description="Показать список команд футбольного бота")
 @only_in_allowed_channel()
 async def help_command(interaction: discord.Interaction):
-    await play_sound("command")
+    await play_sound("command", interaction.guild_id)
 
     embed = discord.Embed(
         title="⚽ Футбольный бот — помощь",
@@ -501,6 +3644,26 @@ async def help_command(interaction: discord.Interaction):
         value="Список твоих подписанных команд.",
         inline=False
     )
+    embed.add_field(
+        name="/live-many [команды через запятую]",
+        value="Подписка сразу на несколько команд.",
+        inline=False
+    )
+    embed.add_field(
+        name="/live-league [турнир]",
+        value="Подписка на все матчи турнира. Отменить — /live-league-stop.",
+        inline=False
+    )
+    embed.add_field(
+        name="/live-notify [события] [ID команды]",
+        value="Какие события матча присылать: например, только голы или только итоговый счёт.",
+        inline=False
+    )
+    embed.add_field(
+        name="/live-quiet [начало] [конец]",
+        value="Тихие часы: уведомления за это время придут одной сводкой. Отключить — /live-quiet-off.",
+        inline=False
+    )
     await interaction.response.send_message(embed=embed, ephemeral=True)
 
 @tree.command(name="live", description="Подписаться на команду из поддерживаемых турниров")
@@ -509,7 +3672,7 @@ async def help_command(interaction: discord.Interaction):
 @app_commands.autocomplete(team=team_autocomplete)
 async def live_subscribe(interaction: discord.Interaction, team: str):
     await interaction.response.defer(ephemeral=True)
-    await play_sound("command")
+    await play_sound("command", interaction.guild_id)
 
     async with aiohttp.ClientSession() as session:
         info = await search_team(session, team)
@@ -521,11 +3684,10 @@ async def live_subscribe(interaction: discord.Interaction, team: str):
         )
         return
 
-    add_team_subscription(
+    await add_team_subscription(
+        guild_id=interaction.guild_id,
         user_id=interaction.user.id,
         team_id=info["team_id"],
-        team_name=info["team_name"],
-        league_name=info["league_name"],
     )
 
     embed = discord.Embed(
@@ -536,13 +3698,98 @@ async def live_subscribe(interaction: discord.Interaction, team: str):
     )
     await interaction.followup.send(embed=embed, ephemeral=True)
 
+@tree.command(name="live-many", description="Подписаться сразу на несколько команд")
+@only_in_allowed_channel()
+@app_commands.describe(teams="Названия команд через запятую")
+@app_commands.autocomplete(teams=team_list_autocomplete)
+async def live_subscribe_many(interaction: discord.Interaction, teams: str):
+    await play_sound("command", interaction.guild_id)
+
+    queries = split_team_list(teams)
+    if not queries:
+        await interaction.response.send_message(
+            "Перечисли команды через запятую, например: Arsenal, Barcelona, Bayern.",
+            ephemeral=True
+        )
+        return
+
+    resolved: Dict[int, Dict[str, Any]] = {}
+    not_found: List[str] = []
+    for query, info in zip(queries, search_teams(queries)):
+        if info is None:
+            not_found.append(query)
+        else:
+            resolved.setdefault(info["team_id"], info)
+
+    added = 0
+    if resolved:
+        added = await add_team_subscriptions(interaction.guild_id, interaction.user.id, resolved)
+
+    lines = [f"**{info['team_name']}** ({info['league_name']})" for info in resolved.values()]
+    if not_found:
+        lines.append("")
+        lines.append("Не найдены: " + ", ".join(not_found))
+
+    embed = discord.Embed(
+        title=f"✅ Новых подписок: {added}" if resolved else "❌ Ни одной команды не найдено",
+        description="\n".join(lines),
+        colour=discord.Colour.green() if resolved else discord.Colour.red()
+    )
+    await interaction.response.send_message(embed=embed, ephemeral=True)
+
+@tree.command(name="live-league", description="Подписаться на все матчи турнира")
+@only_in_allowed_channel()
+@app_commands.describe(code="Турнир")
+@app_commands.choices(code=[
+    app_commands.Choice(name=name, value=code) for code, name in COMPETITIONS_TRACKED.items()
+])
+async def live_league(interaction: discord.Interaction, code: app_commands.Choice[str]):
+    await play_sound("command", interaction.guild_id)
+
+    await add_team_subscription(
+        guild_id=interaction.guild_id,
+        user_id=interaction.user.id,
+        team_id=competition_key(COMPETITION_IDS[code.value]),
+    )
+
+    embed = discord.Embed(
+        title="✅ Подписка оформлена",
+        description=f"Теперь ты будешь получать уведомления по всем матчам турнира **{code.name}**.",
+        colour=discord.Colour.green()
+    )
+    await interaction.response.send_message(embed=embed, ephemeral=True)
+
+@tree.command(name="live-league-stop", description="Отменить подписку на турнир")
+@only_in_allowed_channel()
+@app_commands.describe(code="Турнир")
+@app_commands.choices(code=[
+    app_commands.Choice(name=name, value=code) for code, name in COMPETITIONS_TRACKED.items()
+])
+async def live_league_stop(interaction: discord.Interaction, code: app_commands.Choice[str]):
+    await play_sound("command", interaction.guild_id)
+
+    ok = await remove_team_subscription(
+        interaction.guild_id, interaction.user.id, competition_key(COMPETITION_IDS[code.value])
+    )
+    if not ok:
+        await interaction.response.send_message(
+            "У тебя нет подписки на этот турнир (проверь /live-list).",
+            ephemeral=True
+        )
+        return
+
+    await interaction.response.send_message(
+        f"Подписка на турнир **{code.name}** удалена.",
+        ephemeral=True
+    )
+
 @tree.command(name="live-stop", description="Отменить подписку на команду")
 @only_in_allowed_channel()
 @app_commands.describe(team_id="ID команды (смотри /live-list)")
 async def live_stop(interaction: discord.Interaction, team_id: int):
-    await play_sound("command")
+    await play_sound("command", interaction.guild_id)
 
-    ok = remove_team_subscription(interaction.user.id, team_id)
+    ok = await remove_team_subscription(interaction.guild_id, interaction.user.id, team_id)
     if not ok:
         await interaction.response.send_message(
             "У тебя нет подписки на эту команду (проверь /live-list).",
@@ -551,27 +3798,107 @@ async def live_stop(interaction: discord.Interaction, team_id: int):
         return
 
     await interaction.response.send_message(
-        f"Подписка на команду с ID `{team_id}` удалена.",
+        f"Подписка на команду **{team_display(team_id)[0]}** (ID `{team_id}`) удалена.",
         ephemeral=True
     )
 
 @tree.command(name="live-stop-all", description="Удалить все подписки на команды")
 @only_in_allowed_channel()
 async def live_stop_all(interaction: discord.Interaction):
-    await play_sound("command")
+    await play_sound("command", interaction.guild_id)
 
-    clear_user_subscriptions(interaction.user.id)
+    await clear_user_subscriptions(interaction.guild_id, interaction.user.id)
     await interaction.response.send_message(
         "Все твои подписки на команды удалены.",
         ephemeral=True
     )
 
+@tree.command(name="live-notify", description="Какие события матча присылать тебе в личные сообщения")
+@only_in_allowed_channel()
+@app_commands.describe(
+    events="Какие события присылать",
+    team_id="ID команды (смотри /live-list); без него — для всех твоих подписок",
+)
+@app_commands.choices(events=[
+    app_commands.Choice(name=label, value=mask) for label, mask in NOTIFY_PRESETS.items()
+])
+async def live_notify(
+    interaction: discord.Interaction,
+    events: app_commands.Choice[int],
+    team_id: Optional[int] = None,
+):
+    await play_sound("command", interaction.guild_id)
+
+    subs = await get_user_subscriptions(interaction.guild_id, interaction.user.id)
+    if team_id is not None and team_id not in subs:
+        await interaction.response.send_message(
+            "У тебя нет подписки на эту команду (проверь /live-list).",
+            ephemeral=True
+        )
+        return
+    if not subs:
+        await interaction.response.send_message(
+            "У тебя пока нет подписок на команды. Используй `/live`.",
+            ephemeral=True
+        )
+        return
+
+    targets = [team_id] if team_id is not None else subs
+    for tid in targets:
+        await set_notification_events(interaction.guild_id, interaction.user.id, tid, events.value)
+
+    scope = f"команды **{team_display(team_id)[0]}**" if team_id is not None else "всех твоих команд"
+    await interaction.response.send_message(
+        f"Для {scope} теперь приходят: {describe_events(events.value)}.",
+        ephemeral=True
+    )
+
+@tree.command(name="live-quiet", description="Тихие часы: уведомления за это время придут одной сводкой")
+@only_in_allowed_channel()
+@app_commands.describe(
+    start="Начало тихих часов по МСК, например 23:00",
+    end="Конец тихих часов по МСК, например 08:00",
+)
+async def live_quiet(interaction: discord.Interaction, start: str, end: str):
+    await play_sound("command", interaction.guild_id)
+
+    start_minute = parse_hh_mm(start)
+    end_minute = parse_hh_mm(end)
+    if start_minute is None or end_minute is None or start_minute == end_minute:
+        await interaction.response.send_message(
+            "Укажи время в формате ЧЧ:ММ, начало и конец должны различаться.",
+            ephemeral=True
+        )
+        return
+
+    await deferred_notifications.open()
+    deferred_notifications.set_quiet_hours(interaction.user.id, start_minute, end_minute)
+    await deferred_notifications.save()
+    await interaction.response.send_message(
+        f"Тихие часы: {format_hh_mm(start_minute)}–{format_hh_mm(end_minute)} (по МСК). "
+        f"Уведомления за это время придут одной сводкой.",
+        ephemeral=True
+    )
+
+@tree.command(name="live-quiet-off", description="Отключить тихие часы")
+@only_in_allowed_channel()
+async def live_quiet_off(interaction: discord.Interaction):
+    await play_sound("command", interaction.guild_id)
+
+    await deferred_notifications.open()
+    deferred_notifications.clear_quiet_hours(interaction.user.id)
+    await deferred_notifications.save()
+    await interaction.response.send_message(
+        "Тихие часы отключены. Если что-то было отложено, сводка придёт в течение минуты.",
+        ephemeral=True
+    )
+
 @tree.command(name="live-list", description="Показать твои подписанные команды")
 @only_in_allowed_channel()
 async def live_list(interaction: discord.Interaction):
-    await play_sound("command")
+    await play_sound("command", interaction.guild_id)
 
-    subs = get_user_subscriptions(interaction.user.id)
+    subs = await get_user_subscriptions(interaction.guild_id, interaction.user.id)
     if not subs:
         await interaction.response.send_message(
             "У тебя пока нет подписок на команды. Используй `/live`.",
@@ -579,10 +3906,15 @@ async def live_list(interaction: discord.Interaction):
         )
         return
 
-    desc_lines = [
-        f"ID: `{t['team_id']}` — **{t['team_name']}** ({t['league']})"
-        for t in subs
-    ]
+    events = await get_notification_events(interaction.guild_id, interaction.user.id)
+
+    desc_lines = []
+    for tid in subs:
+        team_name, league_name = team_display(tid)
+        line = f"ID: `{tid}` — **{team_name}** ({league_name})"
+        if tid in events:
+            line += f" · уведомления: {describe_events(events[tid])}"
+        desc_lines.append(line)
 
     embed = discord.Embed(
         title="📜 Твои команды",
@@ -594,9 +3926,9 @@ async def live_list(interaction: discord.Interaction):
 @tree.command(name="live-upcoming", description="Ближайшие матчи по твоим подписанным командам")
 @only_in_allowed_channel()
 async def live_upcoming(interaction: discord.Interaction):
-    await play_sound("command")
+    await play_sound("command", interaction.guild_id)
 
-    subs = get_user_subscriptions(interaction.user.id)
+    subs = await get_user_subscriptions(interaction.guild_id, interaction.user.id)
     if not subs:
         await interaction.response.send_message(
             "У тебя пока нет подписок на команды. Используй `/live`, чтобы подписаться.",
@@ -604,8 +3936,8 @@ async def live_upcoming(interaction: discord.Interaction):
         )
         return
 
-    user_team_ids = [t["team_id"] for t in subs]
-    team_names_by_id = {t["team_id"]: t["team_name"] for t in subs}
+    user_team_ids = subs
+    team_names_by_id = {tid: team_display(tid)[0] for tid in subs}
 
     async with aiohttp.ClientSession() as session:
         team_matches = await fetch_upcoming_for_user(session, user_team_ids)
@@ -675,11 +4007,20 @@ async def live_upcoming(interaction: discord.Interaction):
 @tree.command(name="live-now", description="Матчи, которые сейчас идут по подписанным командам")
 @only_in_allowed_channel()
 async def live_now(interaction: discord.Interaction):
-    await play_sound("command")
+    await play_sound("command", interaction.guild_id)
 
     async with aiohttp.ClientSession() as session:
         fixtures = await fetch_live_fixtures(session)
 
+    # live-кэш общий на все серверы, показываем только команды этого
+    guild_team_ids = await guild_subscriptions.teams[interaction.guild_id].team_ids()
+    fixtures = [
+        m for m in fixtures
+        if m["homeTeam"]["id"] in guild_team_ids
+        or m["awayTeam"]["id"] in guild_team_ids
+        or competition_key(m["competition"]["id"]) in guild_team_ids
+    ]
+
     if not fixtures:
         await interaction.response.send_message(
             "Сейчас нет идущих матчей для подписанных команд.",
@@ -714,19 +4055,15 @@ async def live_now(interaction: discord.Interaction):
 async def poll_live_matches():
     """
     Live-ивенты только по матчам подписанных команд. [web:51]
+    Каждая команда и турнир опрашиваются один раз на все серверы.
     """
     await bot.wait_until_ready()
-    guild = bot.get_guild(GUILD_ID)
-    text_channel = guild.get_channel(TEXT_CHANNEL_ID) if guild else None
 
     async with aiohttp.ClientSession() as session:
         fixtures = await fetch_live_fixtures(session)
 
     global last_fixtures_state
     current_state: Dict[int, Dict[str, Any]] = {}
-    db = load_subscriptions()
-    users = db.get("users", {})
-
     notifications: List[Dict[str, Any]] = []
 
     for m in fixtures:
@@ -759,41 +4096,52 @@ async def poll_live_matches():
             notifications.append({"type": "end", "match": m, "message": "Матч окончен."})
 
     last_fixtures_state = current_state
+    for match_id in [mid for mid in undeliverable_mentioned if mid not in current_state]:
+        del undeliverable_mentioned[match_id]
+
+    team_guilds = await guild_subscriptions.team_guilds()
+    await deferred_notifications.sync()
+    await undeliverable_recipients.sync()
+    now = time.time()
+    minute = msk_minute_of_day()
 
     for note in notifications:
         m = note["match"]
         home = m["homeTeam"]
         away = m["awayTeam"]
+        home_name = fixture_team_name(home)
+        away_name = fixture_team_name(away)
         league_name = m["competition"]["name"]
         score = m.get("score", {})
         ft = score.get("fullTime", {}) or {}
         home_goals = ft.get("home") or 0
         away_goals = ft.get("away") or 0
 
-        involved_team_ids = {home["id"], away["id"]}
-
-        matched_users: List[int] = []
-        for user_id_str, entry in users.items():
-            user_teams = {t["team_id"] for t in entry.get("teams", [])}
-            if user_teams & involved_team_ids:
-                matched_users.append(int(user_id_str))
+        # подписчики турнира целиком лежат в тех же индексах под ключом турнира
+        involved_team_ids = {home["id"], away["id"], competition_key(m["competition"]["id"])}
 
-        if not matched_users:
+        guild_ids: set[int] = set()
+        for tid in involved_team_ids:
+            guild_ids |= team_guilds.get(tid, set())
+        if not guild_ids:
             continue
 
+        event = NOTIFY_EVENTS[note["type"]]
+
+        sound = None
         if note["type"] == "goal":
-            await play_sound("goal")
+            sound = "goal"
         elif note["type"] == "end":
-            await play_sound("match_end")
+            sound = "match_end"
         elif note["type"] == "start":
-            await play_sound("match_start")
+            sound = "match_start"
         elif note["type"] == "pause":
-            await play_sound("timeout")
+            sound = "timeout"
 
         text = (
             f"**{note['message']}**\n"
             f"Турнир: **{league_name}**\n"
-            f"Матч: **{home['name']} {home_goals}:{away_goals} {away['name']}**"
+            f"Матч: **{home_name} {home_goals}:{away_goals} {away_name}**"
         )
 
         embed = discord.Embed(
@@ -801,40 +4149,221 @@ async def poll_live_matches():
             description=text,
             colour=discord.Colour.orange()
         )
+        digest_line = (
+            f"{note['message']} {league_name}: "
+            f"**{home_name} {home_goals}:{away_goals} {away_name}**"
+        )
 
-        for user_id in matched_users:
-            user = bot.get_user(user_id) or await bot.fetch_user(user_id)
-            try:
-                await user.send(embed=embed)
-            except discord.Forbidden:
-                pass
+        # подписанный на одну команду на двух серверах получит одно сообщение
+        delivered: set[int] = set()
+        # дошедшее личное сообщение — тоже активность: такие подписки не снимаются как брошенные
+        direct: Dict[int, List[int]] = {}
+
+        for guild_id in sorted(guild_ids):
+            # отключившие этот тип события отсеиваются по индексу, до рассылки
+            matched_users = await guild_subscriptions.store(guild_id).recipients_for_teams(
+                involved_team_ids, exclude=delivered, event=event
+            )
+            # все подписчики сервера отключили это событие — ни звука, ни поста
+            if not matched_users:
+                continue
+
+            if sound:
+                await play_sound(sound, guild_id)
+
+            # до кого личные сообщения не доходят — упомянем в канале сервера, но один раз за матч
+            mentions: List[int] = []
+            mentioned = undeliverable_mentioned.setdefault(m["id"], set())
+            for user_id in matched_users:
+                if deferred_notifications.is_quiet(user_id, minute):
+                    deferred_notifications.defer(user_id, m["id"], digest_line)
+                    delivered.add(user_id)
+                elif await send_direct(user_id, now, embed=embed):
+                    delivered.add(user_id)
+                    direct.setdefault(guild_id, []).append(user_id)
+                elif UNDELIVERABLE_MENTION_FALLBACK and user_id not in mentioned:
+                    mentions.append(user_id)
+                    mentioned.add(user_id)
+                    delivered.add(user_id)
+
+            guild = bot.get_guild(guild_id)
+            text_channel = guild.get_channel(GUILDS[guild_id]["text_channel_id"]) if guild else None
+            if text_channel and text_channel.permissions_for(guild.me).send_messages:
+                await text_channel.send(embed=embed)
+                for i in range(0, len(mentions), UNDELIVERABLE_MENTIONS_MAX):
+                    await text_channel.send(
+                        " ".join(f"<@{uid}>" for uid in mentions[i:i + UNDELIVERABLE_MENTIONS_MAX]),
+                        allowed_mentions=discord.AllowedMentions(users=True),
+                    )
+
+        for guild_id, user_ids in direct.items():
+            await guild_subscriptions.store(guild_id).touch_many(user_ids)
+
+    await deferred_notifications.save()
+    await undeliverable_recipients.save()
+
+
+@tasks.loop(seconds=60)
+async def flush_deferred_notifications():
+    """
+    Раз в минуту рассылает сводки всем, у кого закончились тихие часы.
+    """
+    await deferred_notifications.sync()
+    await undeliverable_recipients.sync()
+    due = await deferred_notifications.take_due(msk_minute_of_day())
+    now = time.time()
+    delivered: List[int] = []
+    for user_id, lines in due:
+        shown = lines[-QUIET_DIGEST_MAX_MATCHES:]
+        description = "\n".join(shown)
+        if len(lines) > len(shown):
+            description += f"\n…и ещё матчей: {len(lines) - len(shown)}"
+        embed = discord.Embed(
+            title="🌙 Пока были тихие часы",
+            description=description,
+            colour=discord.Colour.dark_blue()
+        )
+        # недоставленная сводка пропадает: упоминать в канале ночной счёт незачем
+        if await send_direct(user_id, now, embed=embed):
+            delivered.append(user_id)
+    if due:
+        print(f"[quiet] Отправлено сводок: {len(due)}")
+    if delivered:
+        # сводка могла собраться из подписок на нескольких серверах
+        for store in guild_subscriptions.stores.values():
+            await store.touch_many(delivered)
+    await deferred_notifications.save()
+    await undeliverable_recipients.save()
+
+# --------------------- ОБНОВЛЕНИЕ КЭША КОМАНД ---------------------------
+
+@tasks.loop(seconds=TEAMS_REFRESH_SECONDS)
+async def refresh_teams_cache_loop():
+    """
+    Раз в TEAMS_REFRESH_SECONDS подтягивает составы турниров из API:
+    повышенные и вылетевшие клубы появляются без перезапуска бота.
+    """
+    # сразу после запуска не обновляем, если файл достаточно свежий
+    if TEAMS_CACHE_UPDATED is not None and datetime.now() - TEAMS_CACHE_UPDATED < timedelta(seconds=TEAMS_REFRESH_SECONDS):
+        return
+    try:
+        async with aiohttp.ClientSession() as session:
+            await refresh_teams_cache(session)
+    except Exception as e:
+        print(f"[teams_cache] Ошибка обновления из API: {e}")
+
+# -------------------- СНЯТИЕ ПОДПИСОК НЕАКТИВНЫХ ------------------------
+
+@tasks.loop(seconds=SUBSCRIPTIONS_SWEEP_SECONDS)
+async def expire_inactive_subscriptions():
+    """
+    Снимает подписки тех, кто не пользовался ботом и не получал личных
+    уведомлений дольше SUBSCRIPTIONS_INACTIVE_DAYS: их команды больше не опрашиваются.
+    """
+    cutoff = time.time() - SUBSCRIPTIONS_INACTIVE_DAYS * 86400
+    for guild_id, store in guild_subscriptions.stores.items():
+        expired = await store.expire(cutoff)
+        if expired:
+            print(f"[expire] Сервер {guild_id}: сняты подписки неактивных пользователей: {len(expired)}")
+
+
+@bot.event
+async def on_member_remove(member: discord.Member):
+    if member.guild.id not in GUILDS:
+        return
+    if await get_user_subscriptions(member.guild.id, member.id):
+        await clear_user_subscriptions(member.guild.id, member.id)
+        print(f"[expire] {member} покинул сервер {member.guild.id}, подписки сняты")
+
+# ------------------------ КОНТРОЛЬ ЗАДЕРЖЕК EVENT LOOP ---------------------
+
+loop_lag_stats: Dict[str, float] = {
+    "max_ms": 0.0,
+    "total_ms": 0.0,
+    "samples": 0,
+    "stalls": 0,
+}
 
-        if text_channel and text_channel.permissions_for(guild.me).send_messages:
-            await text_channel.send(embed=embed)
+
+loop_lag_task: Optional[asyncio.Task] = None
+
+
+async def monitor_loop_lag():
+    """
+    Замеряет, насколько позже положенного просыпается короткий sleep:
+    всё сверх интервала — время, когда event loop был чем-то занят.
+    """
+    loop = asyncio.get_running_loop()
+    stats = loop_lag_stats
+    while True:
+        started = loop.time()
+        await asyncio.sleep(LOOP_LAG_SAMPLE_SECONDS)
+        lag_ms = max(0.0, (loop.time() - started - LOOP_LAG_SAMPLE_SECONDS) * 1000)
+
+        stats["max_ms"] = max(stats["max_ms"], lag_ms)
+        stats["total_ms"] += lag_ms
+        stats["samples"] += 1
+        if lag_ms >= LOOP_LAG_STALL_MS:
+            stats["stalls"] += 1
+            print(f"[loop_lag] Event loop был занят {lag_ms:.0f} мс")
+
+        if stats["samples"] * LOOP_LAG_SAMPLE_SECONDS >= LOOP_LAG_REPORT_SECONDS:
+            avg_ms = stats["total_ms"] / stats["samples"]
+            print(
+                f"[loop_lag] За {LOOP_LAG_REPORT_SECONDS} с: среднее {avg_ms:.1f} мс, "
+                f"максимум {stats['max_ms']:.0f} мс, "
+                f"задержек от {LOOP_LAG_STALL_MS} мс: {stats['stalls']:.0f}"
+            )
+            stats.update(max_ms=0.0, total_ms=0.0, samples=0, stalls=0)
 
 # --------------------------- ЖИЗНЕННЫЙ ЦИКЛ БОТА --------------------------
 
 @bot.event
 async def on_ready():
+    global loop_lag_task
     print(f"Вошёл как {bot.user} (ID: {bot.user.id})")
     await bot.wait_until_ready()
     await bot.change_presence(activity=discord.Game(name="Футбол (football-data.org)"))
 
-    await ensure_voice_connected()
+    if loop_lag_task is None or loop_lag_task.done():
+        loop_lag_task = asyncio.create_task(monitor_loop_lag())
+
+    for guild_id in GUILDS:
+        await ensure_voice_connected(guild_id)
+
+    await guild_subscriptions.open()
+    await deferred_notifications.open()
+    await undeliverable_recipients.open()
 
     async with aiohttp.ClientSession() as session:
         await build_teams_cache(session)
 
-    guild = discord.Object(id=GUILD_ID)
-    bot.tree.copy_global_to(guild=guild)
-    await bot.tree.sync(guild=guild)
+    for guild_id in GUILDS:
+        guild = discord.Object(id=guild_id)
+        bot.tree.copy_global_to(guild=guild)
+        await bot.tree.sync(guild=guild)
 
     if not poll_live_matches.is_running():
         poll_live_matches.start()
 
+    if not flush_deferred_notifications.is_running():
+        flush_deferred_notifications.start()
+
+    if not refresh_teams_cache_loop.is_running():
+        refresh_teams_cache_loop.start()
+
+    if SUBSCRIPTIONS_INACTIVE_DAYS and not expire_inactive_subscriptions.is_running():
+        expire_inactive_subscriptions.start()
+
 if __name__ == "__main__":
     if not DISCORD_TOKEN:
         raise RuntimeError("Не задан DISCORD_TOKEN.")
     if not FOOTBALL_DATA_TOKEN:
         raise RuntimeError("Не задан FOOTBALL_DATA_TOKEN.")
-    bot.run(DISCORD_TOKEN)
+    try:
+        bot.run(DISCORD_TOKEN)
+    finally:
+        # несброшенные изменения подписок не теряем при остановке
+        guild_subscriptions.close()
+        deferred_notifications.close()
+        undeliverable_recipients.close()
@@ -0,0 +1,93 @@
+"""
+Задержка подсказок /live на каждое нажатие клавиши: прежний перебор
+TEAMS_CACHE против TeamAutocomplete (готовые ответы на короткие запросы,
+триграммы и LRU для длинных). Печатает p50 и p99.
+
+    python bench_autocomplete.py [число синтетических команд]
+"""
+
+import random
+import sys
+import time
+
+from discord import app_commands
+
+from Luzhniki import (
+    TEAMS_CACHE_FILE,
+    TeamAutocomplete,
+    TeamIndex,
+    read_json_file,
+)
+from bench_team_search import synthetic_cache
+
+SYNTHETIC_TEAMS = int(sys.argv[1]) if len(sys.argv) > 1 else 50_000
+USERS = 300   # сколько человек набирают название посимвольно
+
+
+def linear_autocomplete(cache: dict, current: str) -> list:
+    # как было в team_autocomplete до индекса
+    choices = []
+    names_seen = set()
+    q = current.lower().strip()
+    for info in cache.values():
+        name = info["team_name"]
+        lname = name.lower()
+        if q and q not in lname:
+            continue
+        if name in names_seen:
+            continue
+        names_seen.add(name)
+        choices.append(app_commands.Choice(name=name, value=name))
+        if len(choices) >= 25:
+            break
+    return choices
+
+
+def keystrokes(cache: dict) -> list:
+    # люди чаще ищут одни и те же клубы: половина запросов — из двадцати популярных
+    rnd = random.Random(3)
+    names = [info["team_name"] for info in cache.values()]
+    popular = names[:20]
+    typed = []
+    for _ in range(USERS):
+        name = rnd.choice(popular if rnd.random() < 0.5 else names)
+        word = rnd.choice(name.split())
+        typed.extend(word[:n] for n in range(1, len(word) + 1))
+    return typed
+
+
+def latencies(fn, queries: list) -> list:
+    result = []
+    for q in queries:
+        started = time.perf_counter()
+        fn(q)
+        result.append((time.perf_counter() - started) * 1_000_000)
+    result.sort()
+    return result
+
+
+def report(label: str, values: list) -> None:
+    p50 = values[len(values) // 2]
+    p99 = values[int(len(values) * 0.99)]
+    print(f"  {label:<22} p50 {p50:9.1f} мкс   p99 {p99:9.1f} мкс")
+
+
+def run(label: str, cache: dict) -> None:
+    print(f"{label}: команд {len(cache)}")
+    started = time.perf_counter()
+    engine = TeamAutocomplete(cache, TeamIndex(cache))
+    print(f"  {'Построение':<22} {(time.perf_counter() - started) * 1000:.0f} мс")
+
+    queries = keystrokes(cache)
+    report("Перебор TEAMS_CACHE", latencies(lambda q: linear_autocomplete(cache, q), queries))
+    report("TeamAutocomplete", latencies(engine.complete, queries))
+
+
+def main():
+    real = read_json_file(TEAMS_CACHE_FILE)["teams"]
+    run("teams_cache.json", real)
+    run("Синтетический кэш", synthetic_cache(real, SYNTHETIC_TEAMS))
+
+
+if __name__ == "__main__":
+    main()
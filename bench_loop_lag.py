@@ -0,0 +1,109 @@
+"""
+Самая долгая остановка event loop при загрузке подписок и свёртке журнала:
+прямо в event loop против рабочего потока. Остановку замеряет тот же
+приём, что и monitor_loop_lag: насколько позже положенного просыпается
+короткий sleep.
+
+    python bench_loop_lag.py [число пользователей]
+"""
+
+import asyncio
+import random
+import sys
+import tempfile
+from pathlib import Path
+
+from Luzhniki import (
+    TEAMS_CACHE_FILE,
+    JsonSubscriptionStore,
+    read_json_file,
+    save_subscriptions,
+)
+
+USERS = int(sys.argv[1]) if len(sys.argv) > 1 else 100_000
+TEAMS_PER_USER = (1, 5)
+SAMPLE_SECONDS = 0.01
+
+
+def synthetic_users(team_ids: list, count: int) -> dict:
+    rnd = random.Random(42)
+    return {
+        str(10**17 + i): {"teams": rnd.sample(team_ids, rnd.randint(*TEAMS_PER_USER)), "last_active": 0}
+        for i in range(count)
+    }
+
+
+async def max_stall(work) -> float:
+    """
+    Выполняет work() и возвращает самую долгую задержку пробного sleep, мс.
+    """
+    loop = asyncio.get_running_loop()
+    worst = 0.0
+    running = True
+
+    async def sample():
+        nonlocal worst
+        while running:
+            started = loop.time()
+            await asyncio.sleep(SAMPLE_SECONDS)
+            worst = max(worst, (loop.time() - started - SAMPLE_SECONDS) * 1000)
+
+    sampler = asyncio.create_task(sample())
+    # пробник должен успеть заснуть до начала работы
+    await asyncio.sleep(SAMPLE_SECONDS * 3)
+    await work()
+    await asyncio.sleep(SAMPLE_SECONDS * 3)
+    running = False
+    await sampler
+    return worst
+
+
+async def measure(path: Path) -> None:
+    async def load_sync():
+        store = JsonSubscriptionStore(path)
+        store.load()
+        store.close()
+
+    async def load_thread():
+        store = JsonSubscriptionStore(path)
+        await store.open()
+        store.close()
+
+    async def compact_sync(store: JsonSubscriptionStore) -> None:
+        # то же, что compact(), но без рабочих потоков
+        snapshot = store.snapshot()
+        store._rotate_journal()
+        store._write_snapshot(snapshot)
+
+    for label, work in (
+        ("Загрузка в event loop", load_sync),
+        ("Загрузка в рабочем потоке", load_thread),
+    ):
+        print(f"{label:<30} {await max_stall(work):8.0f} мс")
+
+    for label, work in (
+        ("Свёртка в event loop", compact_sync),
+        ("Свёртка в рабочем потоке", JsonSubscriptionStore.compact),
+    ):
+        # загрузка не входит в замер свёртки
+        store = JsonSubscriptionStore(path)
+        await store.open()
+        print(f"{label:<30} {await max_stall(lambda: work(store)):8.0f} мс")
+        store.close()
+
+
+def main():
+    team_ids = sorted({t["team_id"] for t in read_json_file(TEAMS_CACHE_FILE)["teams"].values()})
+    users = synthetic_users(team_ids, USERS)
+    print(f"Пользователей: {USERS}, подписок: {sum(len(e['teams']) for e in users.values())}")
+    print(f"Самая долгая задержка sleep({SAMPLE_SECONDS * 1000:.0f} мс):")
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = Path(tmp) / "subscriptions.json"
+        save_subscriptions({"users": users}, path)
+        del users
+        asyncio.run(measure(path))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,86 @@
+"""
+Поиск получателей уведомления о матче: старый вложенный цикл по всем
+пользователям против битовых масок JsonSubscriptionStore.
+
+    python bench_recipients.py [число подписок]
+"""
+
+import random
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+from Luzhniki import (
+    TEAMS_CACHE_FILE,
+    JsonSubscriptionStore,
+    read_json_file,
+    save_subscriptions,
+)
+
+SUBSCRIPTIONS = int(sys.argv[1]) if len(sys.argv) > 1 else 1_000_000
+TEAMS_PER_USER = 4
+EVENTS = 20
+# популярные клубы: Arsenal, Liverpool, Real Madrid, Barcelona, Bayern, Brazil
+POPULAR_TEAM_IDS = [57, 64, 86, 81, 5, 764]
+
+
+def synthetic_users(team_ids: list, count: int) -> dict:
+    rnd = random.Random(42)
+    users = {}
+    for i in range(count // TEAMS_PER_USER):
+        picked = set(rnd.sample(team_ids, TEAMS_PER_USER - 1))
+        # у каждого второго в подписках есть один из популярных клубов
+        picked.add(rnd.choice(POPULAR_TEAM_IDS) if i % 2 else rnd.choice(team_ids))
+        users[str(10**17 + i)] = {"teams": sorted(picked)}
+    return users
+
+
+def nested_loops(users: dict, involved: set) -> list:
+    # как было в poll_live_matches до индексов
+    matched = []
+    for user_id_str, entry in users.items():
+        user_teams = set(entry["teams"])
+        if user_teams & involved:
+            matched.append(int(user_id_str))
+    return matched
+
+
+def timed(label: str, fn, matches: list) -> float:
+    started = time.perf_counter()
+    total = 0
+    for involved in matches:
+        total += len(fn(involved))
+    per_event = (time.perf_counter() - started) / len(matches) * 1000
+    print(f"{label:<34} {per_event:9.2f} мс/событие (получателей в среднем {total // len(matches)})")
+    return per_event
+
+
+def main():
+    team_ids = sorted({t["team_id"] for t in read_json_file(TEAMS_CACHE_FILE)["teams"].values()})
+    users = synthetic_users(team_ids, SUBSCRIPTIONS)
+    print(f"Пользователей: {len(users)}, подписок: {sum(len(e['teams']) for e in users.values())}")
+
+    rnd = random.Random(7)
+    matches = [
+        {rnd.choice(POPULAR_TEAM_IDS), rnd.choice(team_ids)} for _ in range(EVENTS)
+    ]
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = Path(tmp) / "subscriptions.json"
+        save_subscriptions({"users": users}, path)
+        store = JsonSubscriptionStore(path)
+        store.load()
+        store.close()
+
+    old = timed("Вложенный цикл по пользователям", lambda inv: nested_loops(users, inv), matches)
+    new = timed(
+        "Битовые маски",
+        lambda inv: store.users_in_mask(store.subscriber_mask(inv)),
+        matches,
+    )
+    print(f"Ускорение: в {old / new:.0f} раз")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,90 @@
+"""
+Память под подписки: старый формат (словари с названиями команд в каждой
+записи) против компактного (UserSubscriptions с array('i') team_id).
+
+    python bench_subscriptions_memory.py [число пользователей]
+"""
+
+import gc
+import json
+import random
+import sys
+import tempfile
+import tracemalloc
+from pathlib import Path
+
+from Luzhniki import (
+    TEAMS_CACHE_FILE,
+    JsonSubscriptionStore,
+    read_json_file,
+    save_subscriptions,
+)
+
+USERS = int(sys.argv[1]) if len(sys.argv) > 1 else 100_000
+TEAMS_PER_USER = (1, 5)
+
+
+def synthetic_users(teams: list, count: int) -> dict:
+    rnd = random.Random(42)
+    users = {}
+    for i in range(count):
+        picked = rnd.sample(teams, rnd.randint(*TEAMS_PER_USER))
+        users[str(10**17 + i)] = {
+            "teams": [
+                {"team_id": t["team_id"], "team_name": t["team_name"], "league": t["league_name"]}
+                for t in picked
+            ]
+        }
+    return users
+
+
+def measure(label: str, build) -> int:
+    gc.collect()
+    tracemalloc.start()
+    result = build()
+    gc.collect()
+    size, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del result
+    print(f"{label:<45} {size / 1024 / 1024:8.1f} МБ")
+    return size
+
+
+def main():
+    teams = list(read_json_file(TEAMS_CACHE_FILE)["teams"].values())
+    users = synthetic_users(teams, USERS)
+    subs_total = sum(len(entry["teams"]) for entry in users.values())
+    print(f"Пользователей: {USERS}, подписок: {subs_total}")
+
+    with tempfile.TemporaryDirectory() as tmp:
+        legacy_path = Path(tmp) / "legacy.json"
+        with legacy_path.open("w", encoding="utf-8") as f:
+            json.dump({"users": users}, f, ensure_ascii=False, indent=2)
+
+        compact_path = Path(tmp) / "compact.json"
+        save_subscriptions(
+            {"users": {key: {"teams": [t["team_id"] for t in entry["teams"]]} for key, entry in users.items()}},
+            compact_path,
+        )
+        del users
+
+        print(f"{'Файл: старый формат (indent=2)':<45} {legacy_path.stat().st_size / 1024 / 1024:8.1f} МБ")
+        print(f"{'Файл: компактный снимок':<45} {compact_path.stat().st_size / 1024 / 1024:8.1f} МБ")
+
+        legacy = measure("Память: dict-of-lists (json.load)", lambda: read_json_file(legacy_path))
+
+        def load_compact():
+            store = JsonSubscriptionStore(compact_path)
+            store.load()
+            store.close()
+            # индекс team_id -> подписчики считаем отдельно, в старом формате его не было
+            store.team_subscribers = {}
+            return store.users
+
+        compact = measure("Память: UserSubscriptions + array('i')", load_compact)
+
+    print(f"Экономия: в {legacy / compact:.1f} раза")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,71 @@
+"""
+Запуск бота с кэшем команд: разбор teams_cache.json и построение словарей
+против открытия teams_cache.bin через mmap, плюс первые запросы к каталогу.
+
+    python bench_team_catalog.py [число синтетических команд]
+"""
+
+import json
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+from Luzhniki import (
+    TEAMS_CACHE_FILE,
+    MappedTeamCatalog,
+    build_team_catalog,
+    compile_team_catalog,
+    read_json_file,
+)
+from bench_team_search import synthetic_cache
+
+SYNTHETIC_TEAMS = int(sys.argv[1]) if len(sys.argv) > 1 else 50_000
+
+
+def ms(started: float) -> float:
+    return (time.perf_counter() - started) * 1000
+
+
+def run(label: str, teams: dict) -> None:
+    with tempfile.TemporaryDirectory() as tmp:
+        source = Path(tmp) / "teams_cache.json"
+        target = Path(tmp) / "teams_cache.bin"
+        with source.open("w", encoding="utf-8") as f:
+            json.dump({"_timestamp": "", "teams": teams}, f, ensure_ascii=False, indent=2)
+        compile_team_catalog(source, target)
+        print(f"{label}: команд {len(teams)}, JSON {source.stat().st_size / 1024:.0f} КБ, каталог {target.stat().st_size / 1024:.0f} КБ")
+
+        started = time.perf_counter()
+        data = read_json_file(source)
+        parse_ms = ms(started)
+        cache, by_id, _, _ = build_team_catalog(data["teams"])
+        print(f"  {'JSON: разбор':<34} {parse_ms:9.1f} мс")
+        print(f"  {'JSON: разбор + все индексы':<34} {ms(started):9.1f} мс")
+
+        started = time.perf_counter()
+        catalog = MappedTeamCatalog(target)
+        print(f"  {'Каталог: открытие':<34} {ms(started):9.3f} мс")
+
+        queries = list(teams)[::max(1, len(teams) // 1000)]
+        started = time.perf_counter()
+        for key in queries:
+            assert catalog[key]["team_id"] == cache[key]["team_id"]
+            assert catalog.lookup(key[:4], fuzzy=False) is not None
+        per_query = ms(started) * 1000 / len(queries)
+        print(f"  {'Каталог: точный + по началу':<34} {per_query:9.1f} мкс/запрос")
+
+        started = time.perf_counter()
+        for tid in list(by_id)[:1000]:
+            assert catalog.by_id[tid]["team_id"] == tid
+        print(f"  {'Каталог: по team_id':<34} {ms(started):9.1f} мс на 1000")
+
+
+def main():
+    real = read_json_file(TEAMS_CACHE_FILE)["teams"]
+    run("teams_cache.json", real)
+    run("Синтетический кэш", synthetic_cache(real, SYNTHETIC_TEAMS))
+
+
+if __name__ == "__main__":
+    main()
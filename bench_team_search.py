@@ -0,0 +1,134 @@
+"""
+Поиск команды по названию: прежний перебор TEAMS_CACHE против TeamIndex
+(отсортированные ключи + bisect для начала, триграммы для подстроки),
+и нечёткий поиск с опечатками: триграммный индекс против difflib по
+всем ключам.
+
+    python bench_team_search.py [число синтетических команд]
+
+Первый замер — на настоящем teams_cache.json, второй — на кэше,
+дополненном синтетическими командами до заданного числа.
+"""
+
+import difflib
+import random
+import sys
+import time
+
+from Luzhniki import (
+    TEAMS_CACHE_FILE,
+    TeamIndex,
+    read_json_file,
+)
+
+SYNTHETIC_TEAMS = int(sys.argv[1]) if len(sys.argv) > 1 else 50_000
+QUERIES = 2_000
+TYPO_QUERIES = 100
+
+PREFIXES = ["fc", "ac", "sc", "real", "sporting", "athletic", "dynamo", "united", "city", "club"]
+SYLLABLES = ["ka", "ro", "mi", "lan", "ber", "go", "vi", "sta", "dor", "ne", "ta", "lis", "bo", "ri", "zen"]
+
+
+def synthetic_cache(real: dict, count: int) -> dict:
+    rnd = random.Random(42)
+    cache = dict(real)
+    while len(cache) < count:
+        town = "".join(rnd.choice(SYLLABLES) for _ in range(rnd.randint(2, 4)))
+        name = f"{rnd.choice(PREFIXES)} {town} {rnd.randint(1, 999)}"
+        cache.setdefault(name, {
+            "team_id": 100_000 + len(cache),
+            "team_name": name.title(),
+            "league_code": "SYN",
+            "league_name": "Synthetic League",
+        })
+    return cache
+
+
+def linear_search(cache: dict, query: str):
+    # как было в search_team до индекса
+    q = query.lower().strip()
+    if q in cache:
+        return cache[q]
+    for key, info in cache.items():
+        if key.startswith(q):
+            return info
+    for key, info in cache.items():
+        if q in key:
+            return info
+    return None
+
+
+def make_queries(keys: list) -> list:
+    rnd = random.Random(7)
+    queries = []
+    for _ in range(QUERIES):
+        key = rnd.choice(keys)
+        kind = rnd.randrange(4)
+        if kind == 0:
+            queries.append(key)                                   # точное
+        elif kind == 1:
+            queries.append(key[:rnd.randint(2, max(2, len(key) - 1))])  # начало
+        elif kind == 2:
+            start = rnd.randint(1, max(1, len(key) - 4))
+            queries.append(key[start:start + 4])                  # подстрока
+        else:
+            queries.append(key[::-1][:6])                         # скорее всего промах
+    return queries
+
+
+def with_typo(key: str, rnd: random.Random) -> str:
+    pos = rnd.randrange(len(key))
+    if rnd.random() < 0.5:
+        return key[:pos] + key[pos + 1:]                            # пропущена буква
+    return key[:pos] + rnd.choice("aeiou") + key[pos + 1:]          # не та буква
+
+
+def difflib_search(keys: list, query: str):
+    # «наивный» нечёткий поиск: сходство со всеми ключами подряд
+    return difflib.get_close_matches(query, keys, n=1, cutoff=0.6)
+
+
+def timed(label: str, fn, queries: list) -> float:
+    started = time.perf_counter()
+    for q in queries:
+        fn(q)
+    per_query = (time.perf_counter() - started) / len(queries) * 1_000_000
+    print(f"  {label:<26} {per_query:10.1f} мкс/запрос")
+    return per_query
+
+
+def run(label: str, cache: dict) -> None:
+    print(f"{label}: команд {len(cache)}")
+    started = time.perf_counter()
+    index = TeamIndex(cache)
+    print(f"  {'Построение индекса':<26} {(time.perf_counter() - started) * 1000:10.1f} мс")
+
+    queries = make_queries(list(cache))
+    for q in queries:
+        assert linear_search(cache, q) is index.lookup(q, fuzzy=False, aliases=False), q
+
+    old = timed("Перебор TEAMS_CACHE", lambda q: linear_search(cache, q), queries)
+    new = timed("TeamIndex", lambda q: index.lookup(q, fuzzy=False, aliases=False), queries)
+    print(f"  Ускорение: в {old / new:.0f} раз")
+
+    rnd = random.Random(11)
+    keys = list(cache)
+    picked = [rnd.choice(keys) for _ in range(TYPO_QUERIES)]
+    typos = [with_typo(key, rnd) for key in picked]
+    hits = sum(
+        1 for key, q in zip(picked, typos)
+        if any(info is cache[key] for _, info in index.fuzzy(q, limit=5))
+    )
+    old = timed("Опечатки: difflib", lambda q: difflib_search(keys, q), typos)
+    new = timed("Опечатки: триграммы", lambda q: index.fuzzy(q, limit=25), typos)
+    print(f"  Ускорение: в {old / new:.0f} раз, нужная команда в первой пятёрке: {hits}/{TYPO_QUERIES}")
+
+
+def main():
+    real = read_json_file(TEAMS_CACHE_FILE)["teams"]
+    run("teams_cache.json", real)
+    run("Синтетический кэш", synthetic_cache(real, SYNTHETIC_TEAMS))
+
+
+if __name__ == "__main__":
+    main()
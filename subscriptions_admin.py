@@ -0,0 +1,171 @@
+"""
+Выгрузка и загрузка базы подписок построчным JSON (одна подписка на строку):
+
+    {"user_id": 123456789012345678, "team_id": 57, "events": 10, "last_active": 1760000000}
+
+events — маска событий подписки (по умолчанию все), last_active — unix-время
+последней активности пользователя (по умолчанию — время загрузки).
+
+    python subscriptions_admin.py export subs.ndjson [--backend sqlite] [--guild ID]
+    python subscriptions_admin.py import subs.ndjson [--backend sharded] [--guild ID] [--dry-run]
+
+Файл читается и пишется потоком, пачками по --batch-size пар, поэтому
+память не зависит от размера базы. Загрузка добавляет подписки к уже
+существующим (повторы пропускаются) — так базы разных экземпляров бота
+сливаются в одну или переезжают между бэкендами и серверами
+(--guild, по умолчанию основной сервер). У уже существующих подписок
+настройки не меняются, время активности берётся более позднее. team_id проверяются
+по teams_cache.json и списку турниров. Вместо имени файла можно
+указать "-" для stdin/stdout.
+
+С бэкендом "sqlite" инструмент можно запускать при работающем боте —
+бот подхватит загруженные подписки. Хранилища "json" и "sharded"
+принадлежат одному процессу: пока бот запущен, они заняты.
+"""
+
+import argparse
+import asyncio
+import json
+import sys
+import time
+from typing import List, Optional, Set
+
+from Luzhniki import (
+    COMPETITION_IDS,
+    GUILD_ID,
+    NOTIFY_ALL,
+    SUBSCRIPTIONS_BACKEND,
+    SUBSCRIPTIONS_BATCH_SIZE,
+    TEAMS_CACHE_FILE,
+    SubscriptionRecord,
+    SubscriptionStore,
+    competition_key,
+    create_subscription_store,
+    read_json_file,
+)
+
+# сколько отклонённых строк показать поимённо
+REJECTED_SHOWN = 20
+
+
+def known_team_ids() -> Set[int]:
+    if not TEAMS_CACHE_FILE.exists():
+        raise SystemExit(f"Нет {TEAMS_CACHE_FILE}: не с чем сверять team_id, сначала запустите бота")
+    teams = read_json_file(TEAMS_CACHE_FILE).get("teams", {})
+    # подписки на турнир целиком хранятся с отрицательным ключом турнира
+    competitions = {competition_key(cid) for cid in COMPETITION_IDS.values()}
+    return {team["team_id"] for team in teams.values()} | competitions
+
+
+def parse_record(line: str, team_ids: Set[int]) -> Optional[SubscriptionRecord]:
+    try:
+        record = json.loads(line)
+        user_id = record["user_id"]
+        team_id = record["team_id"]
+        # в выгрузках старого формата были только user_id и team_id
+        events = record.get("events", NOTIFY_ALL)
+        last_active = record.get("last_active")
+    except (json.JSONDecodeError, TypeError, KeyError, AttributeError):
+        return None
+    # bool — тоже int, его не пропускаем
+    if type(user_id) is not int or type(team_id) is not int or user_id <= 0:
+        return None
+    if type(events) is not int or events & ~NOTIFY_ALL:
+        return None
+    if last_active is not None and (type(last_active) is not int or last_active < 0):
+        return None
+    if team_id not in team_ids:
+        return None
+    return SubscriptionRecord(user_id, team_id, events, last_active)
+
+
+def format_record(record: SubscriptionRecord) -> str:
+    data = {"user_id": record.user_id, "team_id": record.team_id, "events": record.events}
+    if record.last_active is not None:
+        data["last_active"] = record.last_active
+    return json.dumps(data)
+
+
+def report(action: str, count: int, started: float) -> None:
+    elapsed = time.perf_counter() - started
+    rate = count / elapsed if elapsed > 0 else 0
+    print(f"[admin] {action}: {count} записей за {elapsed:.2f} с ({rate:,.0f} записей/с)", file=sys.stderr)
+
+
+async def export_subscriptions(store: SubscriptionStore, path: str, batch_size: int) -> None:
+    started = time.perf_counter()
+    count = 0
+    out = sys.stdout if path == "-" else open(path, "w", encoding="utf-8")
+    try:
+        async for batch in store.iter_subscriptions(batch_size):
+            out.write("".join(format_record(record) + "\n" for record in batch))
+            count += len(batch)
+    finally:
+        if out is not sys.stdout:
+            out.close()
+    report("Выгружено", count, started)
+
+
+async def import_subscriptions(store: SubscriptionStore, path: str, batch_size: int, dry_run: bool) -> None:
+    team_ids = known_team_ids()
+    started = time.perf_counter()
+    read = added = rejected = 0
+    batch: List[SubscriptionRecord] = []
+
+    async def flush() -> None:
+        nonlocal added, batch
+        if batch and not dry_run:
+            added += await store.import_records(batch)
+        batch = []
+
+    src = sys.stdin if path == "-" else open(path, "r", encoding="utf-8")
+    try:
+        for line_no, line in enumerate(src, 1):
+            if not line.strip():
+                continue
+            record = parse_record(line, team_ids)
+            if record is None:
+                rejected += 1
+                if rejected <= REJECTED_SHOWN:
+                    print(f"[admin] Строка {line_no} пропущена: {line.strip()[:120]}", file=sys.stderr)
+                continue
+            batch.append(record)
+            read += 1
+            if len(batch) >= batch_size:
+                await flush()
+        await flush()
+    finally:
+        if src is not sys.stdin:
+            src.close()
+
+    report("Прочитано" if dry_run else "Загружено", read, started)
+    if not dry_run:
+        print(f"[admin] Новых подписок: {added}, уже были: {read - added}", file=sys.stderr)
+    if rejected:
+        print(f"[admin] Отклонено строк: {rejected}", file=sys.stderr)
+
+
+async def main() -> None:
+    parser = argparse.ArgumentParser(description="Выгрузка и загрузка подписок Luzhniki")
+    parser.add_argument("command", choices=["export", "import"])
+    parser.add_argument("file", help='файл NDJSON или "-"')
+    parser.add_argument("--backend", default=SUBSCRIPTIONS_BACKEND, choices=["json", "sqlite", "sharded"])
+    parser.add_argument("--guild", type=int, default=GUILD_ID, help="ID сервера, чьи подписки выгружать или загружать")
+    parser.add_argument("--batch-size", type=int, default=SUBSCRIPTIONS_BATCH_SIZE)
+    parser.add_argument("--dry-run", action="store_true", help="только проверить файл, ничего не записывать")
+    args = parser.parse_args()
+
+    store = create_subscription_store(args.backend, args.guild)
+    try:
+        await store.open()
+        if args.command == "export":
+            await export_subscriptions(store, args.file, args.batch_size)
+        else:
+            await import_subscriptions(store, args.file, args.batch_size, args.dry_run)
+        await store.wait_idle()
+    finally:
+        store.close()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
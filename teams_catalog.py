@@ -0,0 +1,37 @@
+"""
+Сборка двоичного каталога команд teams_cache.bin из teams_cache.json:
+
+    python teams_catalog.py [teams_cache.json] [teams_cache.bin]
+
+Бот пересобирает каталог сам после загрузки JSON и после обновления
+составов из API; вручную это нужно, если teams_cache.json правили руками.
+Каталог не переносится между машинами с разным порядком байтов —
+собирайте его там, где запускается бот.
+"""
+
+import sys
+import time
+from pathlib import Path
+
+from Luzhniki import (
+    TEAMS_CACHE_FILE,
+    TEAMS_CATALOG_FILE,
+    compile_team_catalog,
+)
+
+
+def main():
+    source = Path(sys.argv[1]) if len(sys.argv) > 1 else TEAMS_CACHE_FILE
+    target = Path(sys.argv[2]) if len(sys.argv) > 2 else TEAMS_CATALOG_FILE
+    if not source.exists():
+        raise SystemExit(f"Нет {source}")
+    started = time.perf_counter()
+    count = compile_team_catalog(source, target)
+    print(
+        f"{target}: {count} команд, {target.stat().st_size / 1024:.1f} КБ "
+        f"(из {source.stat().st_size / 1024:.1f} КБ JSON) за {(time.perf_counter() - started) * 1000:.0f} мс"
+    )
+
+
+if __name__ == "__main__":
+    main()
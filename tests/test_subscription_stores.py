@@ -0,0 +1,264 @@
+"""
+Хранилища подписок: восстановление журнала и одинаковые ответы всех бэкендов.
+"""
+
+import asyncio
+import json
+
+import pytest
+
+from Luzhniki import (
+    NOTIFY_ALL,
+    NOTIFY_END,
+    NOTIFY_GOAL,
+    NOTIFY_START,
+    JsonSubscriptionStore,
+    ShardedSubscriptionStore,
+    SqliteSubscriptionStore,
+    SubscriptionRecord,
+    save_subscriptions,
+)
+
+BACKENDS = {
+    "json": lambda tmp_path: JsonSubscriptionStore(tmp_path / "subscriptions.json"),
+    "sqlite": lambda tmp_path: SqliteSubscriptionStore(tmp_path / "subscriptions.db"),
+    "sharded": lambda tmp_path: ShardedSubscriptionStore(tmp_path / "shards", shard_count=4),
+}
+
+
+def crash(store: JsonSubscriptionStore) -> None:
+    # процесс упал: журнал дописан, но не свёрнут; блокировку снимает ОС
+    store._io.shutdown(wait=True)
+    store._journal.close()
+    store._process_lock.close()
+
+
+async def subscriptions(store) -> list[tuple[int, int, int]]:
+    return sorted([
+        (record.user_id, record.team_id, record.events)
+        async for batch in store.iter_subscriptions(batch_size=2)
+        for record in batch
+    ])
+
+
+# ---- журнал JSON-хранилища ----
+
+def test_journal_replay_skips_torn_last_line(tmp_path):
+    path = tmp_path / "subscriptions.json"
+
+    async def write():
+        store = JsonSubscriptionStore(path)
+        await store.add(1, 10)
+        await store.add(1, 11)
+        await store.set_events(1, 11, NOTIFY_GOAL)
+        await store.add(2, 10)
+        await store.remove(2, 10)
+        crash(store)
+
+    asyncio.run(write())
+    # запись оборвалась на полуслове
+    with path.with_suffix(".journal").open("a", encoding="utf-8") as f:
+        f.write('{"op": "add", "user": "3", "te')
+
+    async def reopen_and_write():
+        store = JsonSubscriptionStore(path)
+        assert await subscriptions(store) == [(1, 10, NOTIFY_ALL), (1, 11, NOTIFY_GOAL)]
+        await store.add(4, 12)
+        crash(store)
+
+    asyncio.run(reopen_and_write())
+
+    async def reopen():
+        store = JsonSubscriptionStore(path)
+        # новая запись не склеилась с оборванной строкой
+        assert await subscriptions(store) == [(1, 10, NOTIFY_ALL), (1, 11, NOTIFY_GOAL), (4, 12, NOTIFY_ALL)]
+        store.close()
+
+    asyncio.run(reopen())
+
+
+def test_journal_replay_after_interrupted_compaction(tmp_path):
+    path = tmp_path / "subscriptions.json"
+
+    async def write():
+        store = JsonSubscriptionStore(path)
+        await store.add(1, 10)
+        await store.add(2, 10)
+        await store.add(2, 11)
+        # свёртка началась: журнал отложен в сторону, снимок ещё не записан
+        await asyncio.get_running_loop().run_in_executor(store._io, store._rotate_journal)
+        await store.remove(2, 10)
+        await store.add(3, 12)
+        crash(store)
+
+    asyncio.run(write())
+    assert path.with_suffix(".journal.compacting").exists()
+
+    async def reopen():
+        store = JsonSubscriptionStore(path)
+        assert await subscriptions(store) == [(1, 10, NOTIFY_ALL), (2, 11, NOTIFY_ALL), (3, 12, NOTIFY_ALL)]
+        assert await store.team_counts() == {10: 1, 11: 1, 12: 1}
+        store.close()
+
+    asyncio.run(reopen())
+    # свёртка дописана при загрузке
+    assert not path.with_suffix(".journal.compacting").exists()
+    assert sorted(json.loads(path.read_text(encoding="utf-8"))["users"]) == ["1", "2", "3"]
+
+
+def test_journal_replay_after_snapshot_written_but_not_cleaned(tmp_path):
+    path = tmp_path / "subscriptions.json"
+
+    async def write():
+        store = JsonSubscriptionStore(path)
+        await store.add(1, 10)
+        await store.add(1, 11)
+        await store.remove(1, 10)
+        snapshot = store.snapshot()
+        await asyncio.get_running_loop().run_in_executor(store._io, store._rotate_journal)
+        # снимок записан, а отложенный журнал удалить не успели
+        save_subscriptions(snapshot, path)
+        crash(store)
+
+    asyncio.run(write())
+
+    async def reopen():
+        store = JsonSubscriptionStore(path)
+        # повторное применение хвоста поверх снимка ничего не меняет
+        assert await subscriptions(store) == [(1, 11, NOTIFY_ALL)]
+        store.close()
+
+    asyncio.run(reopen())
+
+
+@pytest.mark.parametrize("backend", ["sqlite", "sharded"])
+def test_migration_replays_json_journal(tmp_path, backend):
+    path = tmp_path / "subscriptions.json"
+
+    async def write():
+        store = JsonSubscriptionStore(path)
+        await store.add(1, 10)
+        await store.add(2, 11)
+        await store.set_events(2, 11, NOTIFY_GOAL)
+        crash(store)
+
+    asyncio.run(write())
+
+    async def migrate():
+        # снимка ещё нет, всё лежит в журнале
+        target = tmp_path / ("subscriptions.db" if backend == "sqlite" else "shards")
+        store = {"sqlite": SqliteSubscriptionStore, "sharded": ShardedSubscriptionStore}[backend](
+            target, migrate_from=path
+        )
+        assert await subscriptions(store) == [(1, 10, NOTIFY_ALL), (2, 11, NOTIFY_GOAL)]
+        assert await store.all_team_ids() == {10, 11}
+        store.close()
+
+    asyncio.run(migrate())
+
+
+# ---- одинаковые ответы всех бэкендов ----
+
+async def apply_changes(store) -> list:
+    return [
+        await store.add(1, 10),
+        await store.add(1, 10),
+        await store.add(1, 11),
+        # повтор пары внутри пачки и уже существующая подписка пропускаются
+        await store.add_many([(2, 10), (2, 12), (3, 11), (1, 10), (2, 10)]),
+        await store.set_events(1, 10, NOTIFY_GOAL | NOTIFY_END),
+        await store.set_events(1, 99, NOTIFY_GOAL),
+        await store.set_events(3, 11, NOTIFY_START),
+        await store.remove(2, 12),
+        await store.remove(2, 12),
+        await store.clear(3),
+        # подписка на турнир целиком — под отрицательным ключом
+        await store.add(4, -2021),
+    ]
+
+
+async def observe(store) -> dict:
+    return {
+        "users": {uid: sorted(await store.get_user(uid)) for uid in (1, 2, 3, 4)},
+        "events": {uid: await store.get_events(uid) for uid in (1, 2, 3, 4)},
+        "counts": await store.team_counts(),
+        "teams": await store.all_team_ids(),
+        "goal": await store.subscribers_for_teams({10}, NOTIFY_GOAL),
+        "start": await store.subscribers_for_teams({10}, NOTIFY_START),
+        "recipients": await store.recipients_for_teams({10, 11}, exclude={2}, event=NOTIFY_START),
+        "all": await subscriptions(store),
+    }
+
+
+EXPECTED = {
+    "users": {1: [10, 11], 2: [10], 3: [], 4: [-2021]},
+    "events": {1: {10: NOTIFY_GOAL | NOTIFY_END}, 2: {}, 3: {}, 4: {}},
+    "counts": {10: 2, 11: 1, -2021: 1},
+    "teams": {10, 11, -2021},
+    "goal": {1, 2},
+    "start": {2},
+    "recipients": {1},
+    "all": [(1, 10, NOTIFY_GOAL | NOTIFY_END), (1, 11, NOTIFY_ALL), (2, 10, NOTIFY_ALL), (4, -2021, NOTIFY_ALL)],
+}
+
+
+@pytest.mark.parametrize("backend", sorted(BACKENDS))
+def test_backends_agree(tmp_path, backend):
+    async def run():
+        store = BACKENDS[backend](tmp_path)
+        results = await apply_changes(store)
+        assert results == [True, False, True, 3, True, False, True, True, False, None, True]
+        assert await observe(store) == EXPECTED
+        await store.wait_idle()
+        store.close()
+
+        # то же самое после перезапуска
+        store = BACKENDS[backend](tmp_path)
+        assert await observe(store) == EXPECTED
+        await store.wait_idle()
+        store.close()
+
+    asyncio.run(run())
+
+
+@pytest.mark.parametrize("backend", sorted(BACKENDS))
+def test_import_with_events_keeps_recipient_cache_exact(tmp_path, backend):
+    async def run():
+        store = BACKENDS[backend](tmp_path)
+        await store.add(1, 57)
+        # записи кэша получателей уже посчитаны до импорта
+        assert await store.recipients_for_teams({57}, event=NOTIFY_GOAL) == {1}
+        assert await store.recipients_for_teams({57}, event=NOTIFY_END) == {1}
+        assert await store.import_records([SubscriptionRecord(2, 57, NOTIFY_END, None)]) == 1
+        assert await store.recipients_for_teams({57}, event=NOTIFY_GOAL) == {1}
+        assert await store.recipients_for_teams({57}, event=NOTIFY_END) == {1, 2}
+        assert await store.subscribers_for_teams({57}, NOTIFY_GOAL) == {1}
+        await store.wait_idle()
+        store.close()
+
+    asyncio.run(run())
+
+
+def test_sharded_summary_journal_folds(tmp_path):
+    path = tmp_path / "shards"
+
+    async def run():
+        # строка журнала сводки — около 12 байт, свёртка через каждые несколько изменений
+        store = ShardedSubscriptionStore(path, shard_count=4, journal_max_bytes=40)
+        for user_id in range(1, 7):
+            await store.add(user_id, 10)
+        await store.remove(3, 10)
+        await store.add(1, 11)
+        assert await store.team_counts() == {10: 5, 11: 1}
+        # сводка уже сворачивалась по ходу, а не переписывалась на каждое изменение
+        assert store.summary_path.exists()
+        assert not store.dirty_path.exists()
+        store.close()
+
+        store = ShardedSubscriptionStore(path, shard_count=4)
+        assert await store.team_counts() == {10: 5, 11: 1}
+        # хвост журнала свёрнут при загрузке
+        assert not store.summary_journal_path.exists()
+        store.close()
+
+    asyncio.run(run())
@@ -0,0 +1,72 @@
+"""
+Каталог команд через mmap отвечает так же, как индекс поиска по JSON.
+"""
+
+import json
+
+import pytest
+
+from Luzhniki import (
+    TEAM_ALIASES,
+    TEAMS_CACHE_FILE,
+    MappedTeamCatalog,
+    build_team_catalog,
+    compile_team_catalog,
+    read_json_file,
+)
+
+
+@pytest.fixture(scope="module")
+def teams():
+    teams = read_json_file(TEAMS_CACHE_FILE)["teams"]
+    # shortName и tla в файле есть не у всех команд — добавим псевдонимы из API
+    teams = {key: dict(info) for key, info in teams.items()}
+    first = next(iter(teams.values()))
+    first.update(short_name="Short " + first["team_name"], tla="ZZQ")
+    return teams
+
+
+@pytest.fixture(scope="module")
+def catalogs(teams, tmp_path_factory):
+    tmp_path = tmp_path_factory.mktemp("catalog")
+    source = tmp_path / "teams_cache.json"
+    target = tmp_path / "teams_cache.bin"
+    source.write_text(json.dumps({"_timestamp": "", "teams": teams}, ensure_ascii=False), encoding="utf-8")
+    assert compile_team_catalog(source, target) == len(teams)
+    cache, by_id, index, _ = build_team_catalog(teams)
+    mapped = MappedTeamCatalog(target)
+    assert mapped.is_fresh(source)
+    return cache, by_id, index, mapped
+
+
+def queries(teams):
+    for key, info in teams.items():
+        yield key
+        yield key.upper()
+        yield f"  {key} "
+        for n in range(1, min(len(key), 5) + 1):
+            yield key[:n]
+        yield key[len(key) // 2:]
+        yield key[1:-1]
+        for field in ("short_name", "tla"):
+            if info.get(field):
+                yield info[field]
+    yield from TEAM_ALIASES
+    yield from ("", "zzzz", "fc", "united", "ü", "real m")
+
+
+def test_mapped_lookup_matches_team_index(teams, catalogs):
+    _, _, index, mapped = catalogs
+    for query in queries(teams):
+        # у каталога без TeamIndex нет поиска с опечатками
+        assert mapped.lookup(query) == index.lookup(query, fuzzy=False), query
+        assert mapped.lookup(query, aliases=False) == index.lookup(query, fuzzy=False, aliases=False), query
+
+
+def test_mapped_records_match_cache(catalogs):
+    cache, by_id, _, mapped = catalogs
+    assert list(mapped) == list(cache)
+    for key, info in cache.items():
+        assert mapped[key] == info
+    for team_id, info in by_id.items():
+        assert mapped.by_id[team_id] == info